@@ -0,0 +1,259 @@
+import re
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from adk import metrics
+from adk.search_cache import normalize_query
+from config.settings import (
+    ANSWER_CACHE_DIM,
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_MIN_WORDS,
+    ANSWER_CACHE_THRESHOLD,
+    ANSWER_CACHE_TTL_S,
+    SEARCH_CACHE_DEFAULT_LOCALE,
+)
+
+# Whole-turn answer cache for near-paraphrases of the same question ("cheap sushi near Sol",
+# "affordable sushi around Puerta del Sol"): a hit answers the turn with no model call.
+# Prompts are embedded offline with a hashing embedding of their normalized words, and looked up
+# by cosine similarity over a NumPy matrix of the cached prompts. At the cache sizes of this app
+# an exact scan is a single matrix-vector product well under a millisecond, so there is no need
+# for an approximate index. The similarity of a bag of words can't tell prompts that differ in a
+# single key word apart ("open on Sunday" and "open on Monday"), so a hit also needs no
+# conflicting words (conflicting_words):
+# - no cuisine, diet, price, time or negation word that only one of the prompts has
+# - not a word of each prompt that the other doesn't have, a substitution ("in Madrid" and
+#   "in Barcelona"); a single extra word is a paraphrase ("near Sol", "around Puerta del Sol")
+#
+# Only self-contained, non-personal turns are cached:
+# - prompts about the user (my, mine, I...) or referring to the previous turns (it, those...)
+#   are neither looked up nor stored (is_cacheable)
+# - answers of turns that used the user's profile (PERSONAL_TOOLS) or contain it are not stored
+# - entries are scoped by the locale of the session, answers are in the user's language
+
+PERSONAL_TOOLS = ("get_user_info", "user_info_agent")
+
+PERSONAL_PATTERN = re.compile(r"\b(i|i'm|my|mine|myself|we|us|our|ours|yo|mi|mis|m[ií]o|nosotros|nuestr[oa]s?)\b", re.IGNORECASE)
+CONTEXTUAL_PATTERN = re.compile(
+    r"^\s*(and|but|also|what about|y|pero|tambi[eé]n)\b|\b(it|its|those|these|them|they|ones|another|else|again|above|previous|eso|esos|esas|otro|otra|otros|otras)\b",
+    re.IGNORECASE,
+)
+
+# Words that don't change the question, and words with the same meaning for the embedding
+STOPWORDS = frozenset(
+    "a an the of in on at to for with and or is are be can could would please me some any "
+    "near around close by nearby next place places spot spots good nice "
+    "el la los las un una unos unas de del en al con por para y o cerca"
+    .split()
+)
+SYNONYMS = {
+    "affordable": "cheap", "inexpensive": "cheap", "budget": "cheap", "barato": "cheap", "baratos": "cheap", "económico": "cheap",
+    "eatery": "restaurant", "restaurante": "restaurant", "restaurantes": "restaurant",
+    "top": "best", "finest": "best", "mejor": "best", "mejores": "best",
+    "suggest": "recommend", "recomienda": "recommend", "recomiéndame": "recommend",
+}
+
+# Words that change the answer when only one of two similar prompts has them
+DISCRIMINATIVE_WORDS = frozenset(
+    "sushi ramen pizza pasta tapas burgers tacos paella seafood steak brunch breakfast lunch dinner "
+    "italian japanese chinese mexican indian thai french spanish korean vietnamese greek turkish peruvian "
+    "vegan vegetarian halal kosher gluten cheap expensive luxury michelin best "
+    "monday tuesday wednesday thursday friday saturday sunday weekend today tonight tomorrow late night "
+    "without no not non sin except excluding "
+    "caro italiano japonés chino mexicano vegano vegetariano lunes martes miércoles jueves viernes sábado domingo hoy mañana noche"
+    .split()
+)
+# Content words that don't change the question, ignored when comparing prompts
+GENERIC_WORDS = frozenset("restaurant food eat recommend find show where which what option tell list".split())
+
+_hits = metrics.counter("answer_cache.hits", "Turns answered from the answer cache")
+_misses = metrics.counter("answer_cache.misses", "Cacheable turns that missed the answer cache")
+_bypassed = metrics.counter("answer_cache.bypassed", "Turns not looked up in the answer cache (personal or follow-up prompts)")
+_stores = metrics.counter("answer_cache.stores", "Answers stored in the answer cache")
+_hit_rate = metrics.gauge("answer_cache.hit_rate", "Hits over lookups of the answer cache")
+_lookup_seconds = metrics.histogram("answer_cache.lookup_seconds", "Time to embed a prompt and search the answer cache")
+_entries_gauge = metrics.gauge("answer_cache.entries", "Live entries in the answer cache")
+
+
+def _stem(word: str) -> str:
+    if len(word) > 4 and word.endswith("es"):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def _content_words(text: str) -> list[str]:
+    return [_stem(SYNONYMS.get(word, word)) for word in normalize_query(text).split() if word not in STOPWORDS]
+
+
+# The lists of words stemmed as the content words
+_DISCRIMINATIVE_STEMS = frozenset(map(_stem, DISCRIMINATIVE_WORDS))
+_GENERIC_STEMS = frozenset(map(_stem, GENERIC_WORDS))
+
+
+def content_words(text: str) -> frozenset[str]:
+    """Words of a text that change its meaning, with the synonyms and plurals folded."""
+    return frozenset(_content_words(text))
+
+
+def conflicting_words(words: frozenset[str], other: frozenset[str]) -> frozenset[str]:
+    """Content words that make two prompts different questions, however similar their embeddings.
+
+    The discriminative words only one of them has, or all the words they don't share when each has
+    one the other doesn't.
+    """
+    only, only_other = words - other - _GENERIC_STEMS, other - words - _GENERIC_STEMS
+    if only and only_other:
+        return only | only_other
+    return (only | only_other) & _DISCRIMINATIVE_STEMS
+
+
+def embed(text: str, dim: int = ANSWER_CACHE_DIM) -> np.ndarray:
+    """Unit-norm hashing embedding of the content words of a text (zero vector when it has none)."""
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in _content_words(text):
+        h = zlib.crc32(word.encode("utf-8"))
+        vector[h % dim] += 1.0 if h & 0x80000000 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def is_cacheable(prompt: str) -> bool:
+    """Whether the answer to a prompt can be shared with other sessions."""
+    return len(prompt.split()) >= ANSWER_CACHE_MIN_WORDS and not PERSONAL_PATTERN.search(prompt) and not CONTEXTUAL_PATTERN.search(prompt)
+
+
+def answer_scope(state: dict) -> str:
+    """Scope of the cached answers of a session, answers are only shared within a locale."""
+    return state.get("user_locale") or SEARCH_CACHE_DEFAULT_LOCALE
+
+
+def mentions_profile(answer: str, state: dict) -> bool:
+    """Whether an answer contains the user's profile from the session state."""
+    values = (state.get("user_full_name"), state.get("user_email"))
+    return any(value and value.casefold() in answer.casefold() for value in values)
+
+
+@dataclass
+class CachedAnswer:
+    prompt: str  # Prompt the answer was stored for
+    answer: str
+    similarity: float
+
+
+class AnswerCache:
+    """Similarity, TTL and LRU bounded cache of the answers of whole turns, shared by all the sessions.
+
+    The embeddings of the cached prompts are the rows of a preallocated matrix, a slot is free
+    when its entry has expired, and the least recently used entry is evicted when none is.
+    """
+
+    def __init__(self, ttl_s: float, max_entries: int, threshold: float, dim: int = ANSWER_CACHE_DIM):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.dim = dim
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self._expires_at = np.zeros(max_entries)  # time.time() of expiry, 0 for free slots
+        self._used_at = np.zeros(max_entries)
+        self._scopes = np.full(max_entries, -1, dtype=np.int32)
+        self._scope_ids: dict[str, int] = {}
+        self._entries: list[Optional[tuple[str, str]]] = [None] * max_entries  # (prompt, answer)
+        self._words: list[frozenset[str]] = [frozenset()] * max_entries  # Content words of the prompts
+        self._lock = threading.Lock()
+
+    def _match(self, vector: np.ndarray, words: frozenset[str], scope_id: int, now: float) -> Optional[tuple[int, float]]:
+        # Most similar live entry of the scope over the threshold with no conflicting words
+        scores = self._vectors @ vector
+        scores[(self._expires_at <= now) | (self._scopes != scope_id)] = -1.0
+        candidates = np.flatnonzero(scores >= self.threshold)
+        for index in candidates[np.argsort(-scores[candidates])]:
+            if not conflicting_words(words, self._words[index]):
+                return int(index), float(scores[index])
+        return None
+
+    def get(self, prompt: str, scope: str) -> Optional[CachedAnswer]:
+        start = time.perf_counter()
+        vector = embed(prompt, self.dim)
+        words = content_words(prompt)
+        now = time.time()
+        result = None
+        with self._lock:
+            scope_id = self._scope_ids.get(scope)
+            match = self._match(vector, words, scope_id, now) if scope_id is not None and vector.any() else None
+            if match is not None:
+                index, similarity = match
+                self._used_at[index] = now
+                cached_prompt, answer = self._entries[index]
+                result = CachedAnswer(cached_prompt, answer, similarity)
+        _lookup_seconds.observe(time.perf_counter() - start)
+        (_hits if result is not None else _misses).inc()
+        _hit_rate.set(_hits.value() / (_hits.value() + _misses.value()))
+        return result
+
+    def put(self, prompt: str, scope: str, answer: str) -> None:
+        vector = embed(prompt, self.dim)
+        if not vector.any():
+            return
+        words = content_words(prompt)
+        now = time.time()
+        with self._lock:
+            scope_id = self._scope_ids.setdefault(scope, len(self._scope_ids))
+            match = self._match(vector, words, scope_id, now)
+            if match is not None:
+                # A paraphrase of a cached prompt replaces it
+                index = match[0]
+            else:
+                # Otherwise the entry takes an expired slot or the least recently used one
+                expired = np.flatnonzero(self._expires_at <= now)
+                index = int(expired[0]) if len(expired) else int(np.argmin(self._used_at))
+            self._vectors[index] = vector
+            self._expires_at[index] = now + self.ttl_s
+            self._used_at[index] = now
+            self._scopes[index] = scope_id
+            self._entries[index] = (prompt, answer)
+            self._words[index] = words
+            _entries_gauge.set(int(np.count_nonzero(self._expires_at > now)))
+        _stores.inc()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._expires_at[:] = 0
+            self._entries = [None] * self.max_entries
+            _entries_gauge.set(0)
+
+
+_cache: Optional[AnswerCache] = None
+_cache_lock = threading.Lock()
+
+
+def configure_answer_cache(
+    ttl_s: float = ANSWER_CACHE_TTL_S,
+    max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+    threshold: float = ANSWER_CACHE_THRESHOLD,
+    dim: int = ANSWER_CACHE_DIM,
+) -> AnswerCache:
+    """Replaces the process-wide answer cache, e.g. with another threshold for benchmarks."""
+    global _cache
+    with _cache_lock:
+        _cache = AnswerCache(ttl_s, max_entries, threshold, dim)
+        return _cache
+
+
+def get_answer_cache() -> AnswerCache:
+    """Returns the process-wide answer cache configured in config/settings.py."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AnswerCache(ANSWER_CACHE_TTL_S, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_DIM)
+        return _cache
+
+
+def record_bypass() -> None:
+    _bypassed.inc()
@@ -0,0 +1,314 @@
+import logging
+import math
+import threading
+import time
+import unicodedata
+from typing import Optional, Sequence
+
+import numpy as np
+
+from adk import metrics
+from config.settings import RESTAURANT_CATALOG_PATH, RESTAURANT_GRID_CELL_KM, RESTAURANT_RESULTS_LIMIT
+
+# Local restaurant catalog, loaded from a CSV or Parquet file (RESTAURANT_CATALOG_PATH) with the
+# columns name, cuisine (several separated by ";"), price (1 to 4, or "€" to "€€€€"), rating,
+# latitude, longitude and, optionally, neighborhood and address.
+#
+# The rows are held as NumPy columns, with:
+# - a grid index of the rows by location, in cells of RESTAURANT_GRID_CELL_KM
+# - inverted indexes of the rows by cuisine, neighborhood and price level, and the rows sorted
+#   by rating
+# A query starts from the smallest candidate set of its filters and checks the other filters on
+# the columns of the candidates, so it doesn't scan the whole catalog.
+#
+# The root agent calls find_restaurants before searching the web, and falls back to search_agent
+# when the catalog has no answer.
+
+logger = logging.getLogger(__name__)
+
+EARTH_KM_PER_DEGREE = 111.32
+
+_queries = metrics.counter("catalog.queries", "Queries to the restaurant catalog")
+_empty = metrics.counter("catalog.empty_results", "Catalog queries with no result, answered by the web search")
+_query_seconds = metrics.histogram("catalog.query_seconds", "Time of the catalog queries")
+
+
+def normalize_term(term: str) -> str:
+    """Casefolded term without accents, so "Cocina Japonesa" matches "cocina japonesa"."""
+    term = unicodedata.normalize("NFKD", term.casefold())
+    return " ".join("".join(c for c in term if not unicodedata.combining(c)).split())
+
+
+def _parse_price(value) -> int:
+    if isinstance(value, str) and value.strip() and set(value.strip()) <= set("€$"):
+        return len(value.strip())
+    try:
+        return min(4, max(1, int(float(value))))
+    except (TypeError, ValueError):
+        return 0  # Unknown
+
+
+def _postings(rows_by_term: dict[str, list[int]]) -> dict[str, np.ndarray]:
+    return {term: np.asarray(rows, dtype=np.int32) for term, rows in rows_by_term.items()}
+
+
+class RestaurantCatalog:
+    """Columnar restaurant catalog with a grid location index and inverted attribute indexes.
+
+    Immutable once built, so queries need no lock.
+    """
+
+    def __init__(
+        self,
+        names: Sequence[str],
+        cuisines: Sequence[str],
+        prices: Sequence,
+        ratings: Sequence[float],
+        latitudes: Sequence[float],
+        longitudes: Sequence[float],
+        neighborhoods: Optional[Sequence[str]] = None,
+        addresses: Optional[Sequence[str]] = None,
+        cell_km: float = RESTAURANT_GRID_CELL_KM,
+    ):
+        size = len(names)
+        self.names = np.asarray(names, dtype=object)
+        self.cuisines = np.asarray(cuisines, dtype=object)
+        self.prices = np.fromiter((_parse_price(price) for price in prices), dtype=np.int8, count=size)
+        self.ratings = np.nan_to_num(np.asarray(ratings, dtype=np.float32))
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.neighborhoods = np.asarray(neighborhoods if neighborhoods is not None else [""] * size, dtype=object)
+        self.addresses = np.asarray(addresses if addresses is not None else [""] * size, dtype=object)
+
+        # Inverted indexes, each posting list holds the row numbers of a term
+        by_cuisine: dict[str, list[int]] = {}
+        by_neighborhood: dict[str, list[int]] = {}
+        for row, (cuisine, neighborhood) in enumerate(zip(self.cuisines, self.neighborhoods)):
+            for term in str(cuisine).split(";"):
+                if term := normalize_term(term):
+                    by_cuisine.setdefault(term, []).append(row)
+            if term := normalize_term(str(neighborhood or "")):
+                by_neighborhood.setdefault(term, []).append(row)
+        self._by_cuisine = _postings(by_cuisine)
+        self._by_neighborhood = _postings(by_neighborhood)
+        # Rows at each price level or below, unknown prices (0) only when the price isn't filtered
+        self._by_max_price = {level: np.flatnonzero((self.prices >= 1) & (self.prices <= level)).astype(np.int32) for level in range(1, 5)}
+        self._by_rating = np.argsort(-self.ratings, kind="stable").astype(np.int32)
+
+        # Grid of cells of about cell_km x cell_km, the longitude step is the one at the mean latitude
+        self.cell_km = cell_km
+        mean_latitude = float(self.latitudes.mean()) if size else 0.0
+        self._lat_step = cell_km / EARTH_KM_PER_DEGREE
+        self._lon_step = cell_km / (EARTH_KM_PER_DEGREE * max(0.01, math.cos(math.radians(mean_latitude))))
+        cells_i = np.floor(self.latitudes / self._lat_step).astype(np.int64)
+        cells_j = np.floor(self.longitudes / self._lon_step).astype(np.int64)
+        order = np.lexsort((cells_j, cells_i)).astype(np.int32)
+        cells, starts = np.unique(np.stack((cells_i[order], cells_j[order]), axis=1), axis=0, return_index=True)
+        ends = np.append(starts[1:], size)
+        self._cells = {(int(i), int(j)): order[start:end] for (i, j), start, end in zip(cells, starts, ends)}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @classmethod
+    def load(cls, path: str, cell_km: float = RESTAURANT_GRID_CELL_KM) -> "RestaurantCatalog":
+        """Loads a catalog from a CSV or Parquet file."""
+        import pandas as pd
+
+        frame = pd.read_parquet(path) if path.endswith((".parquet", ".pq")) else pd.read_csv(path)
+        frame = frame.dropna(subset=["name", "latitude", "longitude"])
+        optional = lambda column: frame[column].fillna("").astype(str).to_numpy() if column in frame else None
+        return cls(
+            names=frame["name"].astype(str).to_numpy(),
+            cuisines=frame["cuisine"].fillna("").astype(str).to_numpy(),
+            prices=frame["price"].to_numpy() if "price" in frame else [0] * len(frame),
+            ratings=frame["rating"].to_numpy() if "rating" in frame else np.zeros(len(frame)),
+            latitudes=frame["latitude"].to_numpy(),
+            longitudes=frame["longitude"].to_numpy(),
+            neighborhoods=optional("neighborhood"),
+            addresses=optional("address"),
+            cell_km=cell_km,
+        )
+
+    def known_cuisines(self, limit: int = 30) -> list[str]:
+        """Most common cuisines of the catalog."""
+        return sorted(self._by_cuisine, key=lambda term: -len(self._by_cuisine[term]))[:limit]
+
+    def _near(self, latitude: float, longitude: float, radius_km: float) -> np.ndarray:
+        # Rows of the cells that overlap the square around the point
+        reach = math.ceil(radius_km / self.cell_km)
+        center_i, center_j = math.floor(latitude / self._lat_step), math.floor(longitude / self._lon_step)
+        cells = [self._cells.get((i, j)) for i in range(center_i - reach, center_i + reach + 1) for j in range(center_j - reach, center_j + reach + 1)]
+        cells = [rows for rows in cells if rows is not None]
+        return np.concatenate(cells) if cells else np.empty(0, dtype=np.int32)
+
+    def _distances_km(self, rows: np.ndarray, latitude: float, longitude: float) -> np.ndarray:
+        # Equirectangular approximation, exact enough within a city
+        dlat = self.latitudes[rows] - latitude
+        dlon = (self.longitudes[rows] - longitude) * math.cos(math.radians(latitude))
+        return EARTH_KM_PER_DEGREE * np.hypot(dlat, dlon)
+
+    def _neighborhood_rows(self, neighborhood: str) -> Optional[np.ndarray]:
+        term = normalize_term(neighborhood)
+        if not term:
+            return None
+        rows = self._by_neighborhood.get(term)
+        if rows is not None:
+            return rows
+        # "Sol" also matches "Puerta del Sol", and the other way around
+        matches = [rows for name, rows in self._by_neighborhood.items() if term in name or name in term]
+        return np.unique(np.concatenate(matches)) if matches else None
+
+    def search(
+        self,
+        cuisine: str = "",
+        max_price: int = 0,
+        min_rating: float = 0.0,
+        neighborhood: str = "",
+        latitude: Optional[float] = None,
+        longitude: Optional[float] = None,
+        radius_km: float = 1.0,
+        limit: int = RESTAURANT_RESULTS_LIMIT,
+    ) -> list[dict]:
+        """Restaurants that match all the given filters, best rated first and nearest on ties.
+
+        Empty filters (0 or "") don't filter. An unknown cuisine or neighborhood matches nothing.
+        """
+        # Candidate rows of the indexed filters, the query starts from the smallest set and checks
+        # the price and the rating on the columns of the remaining rows
+        candidates: list[np.ndarray] = []
+        if cuisine:
+            rows = self._by_cuisine.get(normalize_term(cuisine))
+            if rows is None:
+                return []
+            candidates.append(rows)
+        if neighborhood:
+            rows = self._neighborhood_rows(neighborhood)
+            if rows is None:
+                return []
+            candidates.append(rows)
+        located = latitude is not None and longitude is not None
+        if located:
+            candidates.append(self._near(latitude, longitude, radius_km))
+        max_price = min(4, max(1, int(max_price))) if max_price else 0
+
+        if not candidates and not max_price:
+            # Only the rating filter: the best rated rows are the first ones of the rating index
+            rows = self._by_rating[: min(limit, len(self))]
+            return [self._result(row) for row in rows[self.ratings[rows] >= min_rating]]
+
+        candidates.sort(key=len)
+        rows = candidates[0] if candidates else self._by_max_price[max_price]
+        for other in candidates[1:]:
+            if not len(rows):
+                break
+            member = np.zeros(len(self), dtype=bool)
+            member[other] = True
+            rows = rows[member[rows]]
+        if max_price and candidates:
+            rows = rows[(self.prices[rows] >= 1) & (self.prices[rows] <= max_price)]
+        if min_rating:
+            rows = rows[self.ratings[rows] >= min_rating]
+        distances = None
+        if located and len(rows):
+            distances = self._distances_km(rows, latitude, longitude)
+            inside = distances <= radius_km
+            rows, distances = rows[inside], distances[inside]
+        if not len(rows):
+            return []
+        ratings = self.ratings[rows]
+        if len(rows) > limit:
+            # Only the rows rated as the limit-th best or better can make the results
+            top = ratings >= np.partition(ratings, -limit)[-limit]
+            rows, ratings = rows[top], ratings[top]
+            distances = None if distances is None else distances[top]
+        # Best rated first, nearest first on ties
+        order = np.lexsort((distances if distances is not None else rows, -ratings))[:limit]
+        return [self._result(row, None if distances is None else float(distances[index])) for row, index in zip(rows[order], order)]
+
+    def _result(self, row: int, distance_km: Optional[float] = None) -> dict:
+        result = {
+            "name": self.names[row],
+            "cuisine": self.cuisines[row],
+            "price": "€" * int(self.prices[row]) if self.prices[row] else "unknown",
+            "rating": round(float(self.ratings[row]), 1),
+            "neighborhood": self.neighborhoods[row],
+            "address": self.addresses[row],
+        }
+        if distance_km is not None:
+            result["distance_km"] = round(distance_km, 2)
+        return result
+
+
+_catalog: Optional[RestaurantCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+def configure_catalog(path: Optional[str] = RESTAURANT_CATALOG_PATH, cell_km: float = RESTAURANT_GRID_CELL_KM) -> Optional[RestaurantCatalog]:
+    """Replaces the process-wide restaurant catalog, e.g. with a generated one for benchmarks."""
+    global _catalog
+    with _catalog_lock:
+        _catalog = RestaurantCatalog.load(path, cell_km) if path else None
+        return _catalog
+
+
+def get_catalog() -> Optional[RestaurantCatalog]:
+    """Returns the process-wide restaurant catalog of RESTAURANT_CATALOG_PATH, None without one."""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None and RESTAURANT_CATALOG_PATH:
+            start = time.perf_counter()
+            _catalog = RestaurantCatalog.load(RESTAURANT_CATALOG_PATH)
+            logger.info("Loaded %d restaurants from %s in %.2f s", len(_catalog), RESTAURANT_CATALOG_PATH, time.perf_counter() - start)
+        return _catalog
+
+
+def find_restaurants(
+    cuisine: str = "",
+    max_price: int = 0,
+    min_rating: float = 0.0,
+    neighborhood: str = "",
+    latitude: float = 0.0,
+    longitude: float = 0.0,
+    radius_km: float = 1.0,
+) -> dict:
+    """Finds restaurants in the local restaurant catalog, best rated first.
+
+    Args:
+        cuisine: Type of food, for example "japanese" or "tapas". Empty for any cuisine.
+        max_price: Maximum price level, from 1 (cheap) to 4 (expensive). 0 for any price.
+        min_rating: Minimum rating, from 0 to 5. 0 for any rating.
+        neighborhood: Neighborhood or area of the city, for example "Malasaña". Empty for anywhere.
+        latitude: Latitude of the place to search around. 0 to not search around a place.
+        longitude: Longitude of the place to search around. 0 to not search around a place.
+        radius_km: Distance in km around the place (latitude and longitude) to search.
+
+    Returns:
+        Dictionary with status and the restaurants found. Examples:
+        - Success: {"status": "success", "restaurants": [{"name": "Sushi Bar", "cuisine": "japanese", "price": "€€", "rating": 4.6, "neighborhood": "Sol", "address": "Calle Mayor 1"}]}
+        - Not found: {"status": "not_found", "message": "...", "known_cuisines": ["tapas", "japanese"]}
+    """
+    catalog = get_catalog()
+    if catalog is None:
+        return {"status": "not_found", "message": "There is no restaurant catalog, use the search_agent tool"}
+    _queries.inc()
+    start = time.perf_counter()
+    located = bool(latitude or longitude)
+    restaurants = catalog.search(
+        cuisine=cuisine,
+        max_price=max_price,
+        min_rating=min_rating,
+        neighborhood=neighborhood,
+        latitude=latitude if located else None,
+        longitude=longitude if located else None,
+        radius_km=radius_km,
+    )
+    _query_seconds.observe(time.perf_counter() - start)
+    if not restaurants:
+        _empty.inc()
+        return {
+            "status": "not_found",
+            "message": "No restaurant of the catalog matches, try other filters or use the search_agent tool",
+            "known_cuisines": catalog.known_cuisines(),
+        }
+    return {"status": "success", "restaurants": restaurants}
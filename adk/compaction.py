@@ -0,0 +1,169 @@
+import asyncio
+import contextvars
+import logging
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from google.genai import types
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.apps.base_events_summarizer import BaseEventsSummarizer
+from google.adk.events import Event
+from google.adk.plugins.base_plugin import BasePlugin
+from google.adk.sessions import BaseSessionService
+
+from adk import metrics
+from config.settings import COMPACTION_MIN_EVENTS, COMPACTION_TRIGGER_TOKENS
+
+# Token-budget compaction of the session history. After each turn, the size of the context the
+# next model call will get is estimated, and when it crosses COMPACTION_TRIGGER_TOKENS the events
+# since the last compaction are summarized in a background task. ADK builds the model context
+# from the compaction events (the summary replaces the events of its time range), so later turns
+# send the summary instead of the whole history.
+#
+# A turn and a compaction of the same session never write at the same time: a new turn cancels
+# the compaction of its session while it is summarizing, and waits for it while it is writing the
+# compaction event, which is short.
+
+logger = logging.getLogger(__name__)
+
+_runs = metrics.counter("compaction.runs", "Compactions that appended a summary to the session")
+_cancelled = metrics.counter("compaction.cancelled", "Compactions cancelled or discarded because a new turn started")
+_tokens_saved = metrics.counter("compaction.context_tokens_saved", "Estimated context tokens removed by the compactions, per later model call")
+_summary_tokens = metrics.counter("compaction.summary_tokens", "Estimated tokens of the summarization calls (prompt and summary)")
+_seconds = metrics.histogram("compaction.seconds", "Latency of the summarization calls")
+
+# Per-session lock held by the turns and by the compactions while they write the session
+_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+# Compaction tasks in flight by session id, and whether they are still summarizing
+_tasks: dict[str, tuple[asyncio.Task, list[bool]]] = {}
+
+
+def _lock(session_id: str) -> asyncio.Lock:
+    lock = _locks.get(session_id)
+    if lock is None:
+        lock = _locks[session_id] = asyncio.Lock()
+    return lock
+
+
+@asynccontextmanager
+async def session_turn(session_id: str) -> AsyncIterator[None]:
+    """Runs a turn of the session with exclusive access to its history."""
+    entry = _tasks.get(session_id)
+    if entry is not None and entry[1][0]:
+        # Summarizing: the summary would miss this turn, so it is dropped
+        entry[0].cancel()
+    lock = _lock(session_id)
+    async with lock:
+        yield
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly 4 characters per token, as the Gemini tokenizer for English text
+    return len(text) // 4
+
+
+def _content_text(content: Optional[types.Content]) -> str:
+    if content is None:
+        return ""
+    return " ".join(str(part.text or part.function_call or part.function_response or "") for part in content.parts or [])
+
+
+def _pending_events(events: list[Event]) -> list[Event]:
+    # Events since the end of the last compaction, which is what the next compaction covers
+    last_end = 0.0
+    for event in reversed(events):
+        if event.actions and event.actions.compaction and event.actions.compaction.end_timestamp:
+            last_end = event.actions.compaction.end_timestamp
+            break
+    return [event for event in events if event.timestamp > last_end and not (event.actions and event.actions.compaction)]
+
+
+def estimate_context_tokens(events: list[Event]) -> int:
+    """Estimates the prompt tokens of the next model call of a session.
+
+    The prompt token count reported by the last model call is exact for the context up to that
+    call, the events after it are estimated from their text.
+    """
+    tokens = 0
+    for index in range(len(events) - 1, -1, -1):
+        usage = events[index].usage_metadata
+        if usage is not None and usage.prompt_token_count:
+            tokens = usage.prompt_token_count + (usage.candidates_token_count or 0)
+            events = events[index + 1:]
+            break
+    else:
+        # No reported usage, estimate the history since the last compaction and its summary
+        summary = next((event.actions.compaction.compacted_content for event in reversed(events) if event.actions and event.actions.compaction), None)
+        tokens = estimate_tokens(_content_text(summary))
+        events = _pending_events(events)
+    return tokens + sum(estimate_tokens(_content_text(event.content)) for event in events)
+
+
+class CompactionPlugin(BasePlugin):
+    """Starts a background compaction of the session after the turns whose context is over budget."""
+
+    def __init__(
+        self,
+        app_name: str,
+        summarizer: BaseEventsSummarizer,
+        trigger_tokens: int = COMPACTION_TRIGGER_TOKENS,
+        min_events: int = COMPACTION_MIN_EVENTS,
+        name: str = "compaction",
+    ):
+        super().__init__(name=name)
+        self.app_name = app_name
+        self.summarizer = summarizer
+        self.trigger_tokens = trigger_tokens
+        self.min_events = min_events
+
+    async def after_run_callback(self, *, invocation_context: InvocationContext) -> None:
+        # AgentTool forwards the plugins to the runners of the sub-agents, which have their own app name
+        if invocation_context.app_name != self.app_name:
+            return None
+        session = invocation_context.session
+        if session.id in _tasks or estimate_context_tokens(session.events) < self.trigger_tokens:
+            return None
+        events = _pending_events(session.events)
+        if len(events) < self.min_events:
+            return None
+        summarizing = [True]
+        # In an empty context: the deadline, route and scheduler key of the finished turn don't
+        # apply to the summarization, which runs with their defaults as background work
+        task = asyncio.create_task(
+            self._compact(invocation_context.session_service, session.app_name, session.user_id, session.id, events, summarizing),
+            context=contextvars.Context(),
+        )
+        _tasks[session.id] = (task, summarizing)
+        task.add_done_callback(lambda _: _tasks.pop(session.id, None))
+
+    async def _compact(self, session_service: BaseSessionService, app_name: str, user_id: str, session_id: str, events: list[Event], summarizing: list[bool]) -> None:
+        start = time.perf_counter()
+        try:
+            compaction_event = await self.summarizer.maybe_summarize_events(events=events)
+        except asyncio.CancelledError:
+            _cancelled.inc()
+            return
+        except Exception:
+            logger.exception("Compaction of session %s failed", session_id)
+            return
+        _seconds.observe(time.perf_counter() - start)
+        if compaction_event is None:
+            return
+
+        summarizing[0] = False
+        async with _lock(session_id):
+            session = await session_service.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+            # ADK hides the events after the start of a compaction from the context, so the summary
+            # must cover the whole history up to its append
+            if session is None or not session.events or session.events[-1].id != events[-1].id:
+                _cancelled.inc()
+                return
+            await session_service.append_event(session=session, event=compaction_event)
+
+        compacted = sum(estimate_tokens(_content_text(event.content)) for event in events)
+        summary = estimate_tokens(_content_text(compaction_event.actions.compaction.compacted_content))
+        _runs.inc()
+        _tokens_saved.inc(max(0, compacted - summary))
+        _summary_tokens.inc(compacted + summary)
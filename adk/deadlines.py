@@ -0,0 +1,103 @@
+import asyncio
+import contextvars
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Optional
+
+from google.genai import types
+from google.adk.models import LlmRequest
+from google.adk.tools import AgentTool, ToolContext
+
+from adk import metrics
+from config.settings import MODEL_CALL_TIMEOUT_S, SUBAGENT_BUDGET_SHARE
+
+# Per-turn deadlines. A turn runs under a deadline (TURN_DEADLINE_S, see init_adk._run_turn), kept in
+# a context variable so it reaches everything the turn runs: the tasks of the tool calls inherit it.
+# - Model calls get an HTTP timeout of the time left, capped at MODEL_CALL_TIMEOUT_S, and don't
+#   back off past the deadline (adk/scheduler.py)
+# - Sub-agent calls (BudgetedAgentTool) get SUBAGENT_BUDGET_SHARE of the time left, so the root
+#   agent still has time to answer without their result when they run out of it
+# - When the turn deadline hits, the turn is cancelled and ends with the text it has so far and a
+#   notice, instead of hanging
+
+logger = logging.getLogger(__name__)
+
+_turn_misses = metrics.counter("deadlines.turn_misses", "Turns ended by their deadline with a degraded answer")
+_subagent_misses = metrics.counter("deadlines.subagent_misses", "Sub-agent calls ended by their share of the turn deadline")
+
+# loop.time() at which the current turn (or sub-agent call) must end, None without a deadline
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("turn_deadline", default=None)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left to the deadline of the current turn, None without a deadline."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - asyncio.get_running_loop().time())
+
+
+@asynccontextmanager
+async def deadline(seconds: Optional[float]) -> AsyncIterator[None]:
+    """Runs the block with a deadline in `seconds`, or the enclosing one if it's sooner.
+
+    The block is cancelled at the deadline and TimeoutError is raised. None runs it with the
+    enclosing deadline, if any.
+    """
+    current = _deadline.get()
+    when = current
+    if seconds is not None:
+        when = asyncio.get_running_loop().time() + seconds
+        if current is not None:
+            when = min(when, current)
+    token = _deadline.set(when)
+    try:
+        async with asyncio.timeout_at(when):
+            yield
+    finally:
+        try:
+            _deadline.reset(token)
+        except ValueError:
+            # An async generator closed from another task runs this in a different context
+            pass
+
+
+def record_turn_miss() -> None:
+    _turn_misses.inc()
+
+
+def apply_call_timeout(llm_request: LlmRequest) -> None:
+    """Sets the HTTP timeout of a model call to the time left in the turn, up to MODEL_CALL_TIMEOUT_S."""
+    timeout = MODEL_CALL_TIMEOUT_S
+    left = remaining()
+    if left is not None:
+        timeout = left if timeout is None else min(timeout, left)
+    if timeout is None:
+        return
+    if llm_request.config.http_options is None:
+        llm_request.config.http_options = types.HttpOptions()
+    # In milliseconds
+    llm_request.config.http_options.timeout = max(1, int(timeout * 1000))
+
+
+class BudgetedAgentTool(AgentTool):
+    """AgentTool that gives the sub-agent a share of the time left in the turn.
+
+    A sub-agent that runs out of it returns an error to the calling agent, which answers with
+    what it has instead of the turn missing its deadline.
+    """
+
+    async def run_async(self, *, args: dict[str, Any], tool_context: ToolContext) -> Any:
+        left = remaining()
+        if left is None:
+            return await super().run_async(args=args, tool_context=tool_context)
+        try:
+            async with deadline(left * SUBAGENT_BUDGET_SHARE):
+                return await super().run_async(args=args, tool_context=tool_context)
+        except TimeoutError:
+            if remaining() == 0.0:
+                # The turn deadline itself, handled by the turn
+                raise
+            _subagent_misses.inc()
+            logger.warning("Sub-agent %s ran out of its %.1f s budget", self.agent.name, left * SUBAGENT_BUDGET_SHARE)
+            return {"status": "error", "error_message": f"{self.agent.name} didn't answer in time, answer without its result"}
@@ -0,0 +1,82 @@
+import asyncio
+import atexit
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Coroutine, Iterator, Optional
+
+# One long-lived event loop per process, running on its own daemon thread and
+# shared by every Streamlit session. Keeping the loop alive lets the cached
+# Runner reuse its HTTP connections and DB handles between turns.
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_thread: Optional[threading.Thread] = None
+_lock = threading.Lock()
+
+
+def _run_loop(loop: asyncio.AbstractEventLoop) -> None:
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Returns the shared background event loop, starting it on first use."""
+    global _loop, _thread
+    with _lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            _thread = threading.Thread(target=_run_loop, args=(_loop,), name="adk-event-loop", daemon=True)
+            _thread.start()
+        return _loop
+
+
+def submit(coro: Coroutine[Any, Any, Any]) -> Future:
+    """Schedules a coroutine on the shared loop from any thread.
+
+    Returns a concurrent.futures.Future with the coroutine result.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+
+def run_coroutine(coro: Coroutine[Any, Any, Any], timeout: Optional[float] = None) -> Any:
+    """Runs a coroutine on the shared loop and blocks the calling thread until it finishes."""
+    return submit(coro).result(timeout)
+
+
+_DONE = object()
+
+
+def iterate(agen: AsyncIterator[Any]) -> Iterator[Any]:
+    """Consumes an async iterator on the shared loop and yields its items in the calling thread.
+
+    Exceptions raised by the async iterator are re-raised in the calling thread.
+    If the caller stops iterating early, the async iterator is cancelled.
+    """
+    items: queue.Queue = queue.Queue()
+
+    async def pump() -> None:
+        try:
+            async for item in agen:
+                items.put(item)
+        except BaseException as e:
+            items.put(e)
+            raise
+        finally:
+            items.put(_DONE)
+
+    future = submit(pump())
+    try:
+        while (item := items.get()) is not _DONE:
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        future.cancel()
+
+
+@atexit.register
+def _shutdown() -> None:
+    with _lock:
+        if _loop is not None and _loop.is_running():
+            _loop.call_soon_threadsafe(_loop.stop)
+        if _thread is not None:
+            _thread.join(timeout=5)
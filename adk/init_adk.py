@@ -1,20 +1,39 @@
-import os
-import streamlit as st
-from typing import List
+import asyncio
+import logging
+from typing import AsyncGenerator, Callable, Optional
 
 import streamlit as st
 
 from google.genai import types
+from google.adk.models import BaseLlm
 from google.adk.models.google_llm import Gemini
 from google.adk.agents import LlmAgent
-from google.adk.apps.app import App, EventsCompactionConfig
+from google.adk.agents.run_config import RunConfig, StreamingMode
+from google.adk.apps.app import App
+from google.adk.apps.llm_event_summarizer import LlmEventSummarizer
+from google.adk.events import Event, EventActions
 from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService, DatabaseSessionService
-from google.adk.tools import google_search, AgentTool
+from google.adk.sessions import BaseSessionService, Session
+from google.adk.tools import google_search, ToolContext
+
+from adk.answer_cache import PERSONAL_TOOLS, answer_scope, get_answer_cache, is_cacheable, mentions_profile, record_bypass
+from adk.catalog import find_restaurants, get_catalog
+from adk.compaction import CompactionPlugin, session_turn
+from adk.deadlines import BudgetedAgentTool, deadline, record_turn_miss
+from adk.persistence import TurnBufferedSessionService, buffered_turn, close_unanswered_calls
+from adk.routing import TEMPLATE, RoutedLlm, routed_turn, template_greeting_callback
+from adk.scheduler import ScheduledLlm, scheduling_key
+from adk.search_cache import after_search_callback, before_search_callback, on_search_error_callback
+from adk.session_cache import CachingSessionService
+from adk.session_store import create_session_service
+from adk.startup import start_prewarm
+from adk.turns import coordinate_turn
+from adk.tracing import TracedEventsSummarizer, TracingPlugin, trace_turn
+from config.settings import ADK_SESSION_KEY, APP_NAME, COMPACTION_ENABLED, MODEL_NAME, SESSION_CACHE_ENABLED, SESSION_CACHE_MAX_BYTES, SESSION_CACHE_MAX_EVENTS, SESSION_CACHE_MAX_SESSIONS, STREAMING_ENABLED, TRACING_ENABLED, USER_ID, USER_INFO_MODE, MODEL_SCHEDULER_ENABLED, PARALLEL_TOOL_CALLS, MODEL_ROUTING_ENABLED, TURN_DEADLINE_S, DEADLINE_NOTICE, ANSWER_CACHE_ENABLED, PERSISTENCE_BATCH_TURNS, PERSISTENCE_POLICY
 
-from config.settings import ADK_SESSION_KEY, APP_NAME, USER_ID, retry_config
+logger = logging.getLogger(__name__)
 
-def get_user_info() -> dict:
+def get_user_info(tool_context: ToolContext) -> dict:
     """"Returns the info about the logged user of the application.
 
     Args:
@@ -25,108 +44,199 @@ def get_user_info() -> dict:
         - Success: {"status": "success", user_info: {"user_email": "john@doe.com", "user_full_name: "John Doe"}}
         - Error: {"status": "error", "error_message": "User not logged in"}
     """
-    if not st.user:
+    # Agent turns run on the shared background event loop, where st.user is not available,
+    # so the user profile is read from the session state seeded by run_at_session
+    user_email = tool_context.state.get("user_email")
+    if not user_email:
         return {"status": "error", "error_message": "User not logged in"}
     else:
-        # return {"status": "success", "user_email": str(st.user.email), "user_full_name": str(st.user.name)}
-        return {"status": "success", "user_info": {"user_email": str(st.user.email), "user_full_name": str(st.user.name)}}
-
-@st.cache_data
-def get_google_api_key():
-    google_api_key = st.secrets["GOOGLE_API_KEY"]
-    if not google_api_key:
-        st.error("🔑 Authentication Error: Please make sure you have added 'GOOGLE_API_KEY' to your Streamlit secrets. ⚠️")
-        st.stop()
-    os.environ["GOOGLE_API_KEY"] = google_api_key
-    os.environ["GOOGLE_GENAI_USE_VERTEXAI"] = "FALSE"
-    # st.write("✅ Gemini API key setup complete.")
-    return google_api_key
+        return {"status": "success", "user_info": {"user_email": user_email, "user_full_name": tool_context.state.get("user_full_name")}}
 
-@st.cache_resource
-def initialize_adk():
-    try:
-        # BEGIN AGENT DEFINITION
-        # Same agent definition of file adk_debug/agent.py
-        user_info_agent = LlmAgent(
-            name = "user_info_agent",
-            model=Gemini(model="gemini-2.5-flash-lite", retry_options=retry_config),
-            instruction="""You are an agent that answers any question or request with the user's raw personal data.
-            RULES:
-                1. Use `get_user_info()` to get the info about the user
-                2. Answer any question or request with the RAW response of `get_user_info()` tool, with no further proccessing. 
-            EXAMPLES:
-                1.  - Question: What is my name?
-                    - Use `get_user_info()`
-                    - Answer: {"status": "success", "user_info": {"user_email": "bob@smith.com", "user_full_name": "Bob Smith"}} 
-                2.  - Question: What is my full name?
-                    - Use `get_user_info()`
-                    - Answer: {"status": "success", "user_info": {"user_email": "alice@example.com", "user_full_name": "Alice Grant"}} 
-                3.  - Question: What is email?
-                    - Use `get_user_info()`
-                    - Answer: {"status": "success", "user_info": {"user_email": "bob@smith.com", "user_full_name": "Bob Smith"}} 
-                4.  - Question: What is my address?
-                    - Use `get_user_info()`
-                    - Answer: {"status": "success", "user_info": {"user_email": "john@doe.com", "user_full_name": "John Doe", "address": "205 1st Avenue"}} 
-            """,
-            tools=[get_user_info]
-        )
+# Rules of the root agent to answer about the user, for each of the USER_INFO_MODE options
+USER_INFO_RULES = {
+    "agent_tool": """a) Each time the user greets you or asks you for a greeting:
+                - Use the user_info_agent tool to get information about the user
+                - Answer with a personalized greeting including the user's name and the user's email address, using the information returned by user_info_agent, dont invent any information about the user
+            b) For questions the user asks about himself/herself and/or questions about personal data of the user: Use the information returned by user_info_agent tool.""",
+    "direct_tool": """a) Each time the user greets you or asks you for a greeting:
+                - Use the get_user_info tool to get information about the user
+                - Answer with a personalized greeting including the user's name and the user's email address, using the information returned by get_user_info, dont invent any information about the user
+            b) For questions the user asks about himself/herself and/or questions about personal data of the user: Use the information returned by get_user_info tool.""",
+    "session_state": """a) Each time the user greets you or asks you for a greeting:
+                - Answer with a personalized greeting including the user's name and the user's email address, using the USER PROFILE below, dont invent any information about the user
+            b) For questions the user asks about himself/herself and/or questions about personal data of the user: Use the USER PROFILE below. If the information is not in the USER PROFILE, answer that you don't know it.""",
+}
 
-        search_agent = LlmAgent(
-            name = "search_agent",
-            model=Gemini(model="gemini-2.5-flash-lite", retry_options=retry_config),
-            instruction="""You are an agent that answers questions and you use the google_search tool to search the internet for information to answer the questions.
-            """,
-            tools=[google_search]
-        )
+USER_INFO_EXAMPLES = {
+    "agent_tool": """EXAMPLE:
+            - This response from user_info_agent: {"status": "success", "user_info": {"user_email": "john@doe.com", "user_full_name": "John Doe", "address": "205 1st Avenue"}} means that the user full name is 'John Doe', the user email is 'john@doe.com' and the user's address is '205 1st Avenue'.""",
+    "direct_tool": """EXAMPLE:
+            - This response from get_user_info: {"status": "success", "user_info": {"user_email": "john@doe.com", "user_full_name": "John Doe"}} means that the user full name is 'John Doe' and the user email is 'john@doe.com'.""",
+    "session_state": """USER PROFILE:
+            - Full name: {user_full_name?}
+            - Email: {user_email?}""",
+}
 
-        root_agent = LlmAgent(
-            name = "root_agent",
-            model=Gemini(model="gemini-2.5-flash-lite", retry_options=retry_config),
-            instruction="""You are a very helpful agent that answers the user's questions.
-            RULES:
-            1) Rules for answer the user's questions. Options:
-                a) Each time the user greets you or asks you for a greeting:
-                    - Use the user_info_agent tool to get information about the user
-                    - Answer with a personalized greeting including the user's name and the user's email address, using the information returned by user_info_agent, dont invent any information about the user
-                b) For questions the user asks about himself/herself and/or questions about personal data of the user: Use the information returned by user_info_agent tool.
-                c) For general questions not directly related to the user or the user's personal data', if you dont know the answer, use the search_agent tool to gather current information.
-            3) Always answer the user's questions
-            4) Always answer the user in the same language the user is using or the user wants you to use'
-            EXAMPLE:
-            - This response from user_info_agent: {"status": "success", "user_info": {"user_email": "john@doe.com", "user_full_name": "John Doe", "address": "205 1st Avenue"}} means that the user full name is 'John Doe', the user email is 'john@doe.com' and the user's address is '205 1st Avenue'.
-            """,
-            tools=[AgentTool(user_info_agent), AgentTool(search_agent)]
-        )
-        # Root agent sample definition for Streamlit app testing
-        # root_agent = LlmAgent(
-        #     name = "search_agent",
-        #     model=Gemini(model="gemini-2.5-flash-lite", retry_options=retry_config),
-        #     instruction="""You are a very helpful agent that answers the user's questions.
-        #     When you don't know something you you the tool google_adk to search the information.
-        #     """,
-        #     tools=[google_search]
-        # )
-        # END AGENT DEFINITION
-
-        # st.write("✅ Root Agent defined.")
-        # InMemorySessionService stores conversations in RAM (temporary)
-        # session_service = InMemorySessionService()
-        db_url = f"sqlite:///session_service_data.db"  # Local SQLite file
-        session_service = DatabaseSessionService(db_url=db_url)
-
-        # Create the app with context management
-        app_compacting = App(
-            name=APP_NAME,
-            root_agent=root_agent,
-            events_compaction_config=EventsCompactionConfig(
-                compaction_interval=3,  # Trigger compaction every 3 invocations
-                overlap_size=1,  # Keep 1 previous turn for context
-            )
-        )
+# Rule of the root agent to request the profile and the search together, which ADK runs
+# concurrently (the function calls of one model response are executed in parallel)
+PARALLEL_TOOLS_RULES = {
+    "agent_tool": """d) When a question needs both the user's information and a search (for example a restaurant recommendation for the user), call the user_info_agent tool and the search_agent tool together in the same step, don't wait for the result of one to call the other.""",
+    "direct_tool": """d) When a question needs both the user's information and a search (for example a restaurant recommendation for the user), call the get_user_info tool and the search_agent tool together in the same step, don't wait for the result of one to call the other.""",
+    "session_state": "",
+}
+
+# Rule of the root agent when there is a local restaurant catalog (RESTAURANT_CATALOG_PATH)
+CATALOG_RULE = """e) For restaurant recommendations, first use the find_restaurants tool with the filters of the question (for a place, pass its latitude and longitude). Use the search_agent tool only when find_restaurants finds no restaurants or the question needs information that isn't in the catalog, like opening hours, reviews or bookings."""
+
+def create_gemini_model() -> BaseLlm:
+    # No HTTP retries here, the model call scheduler retries the failed calls
+    return Gemini(model=MODEL_NAME)
+
+def create_runner(
+    user_info_mode: str = USER_INFO_MODE,
+    use_session_cache: bool = SESSION_CACHE_ENABLED,
+    session_service: Optional[BaseSessionService] = None,
+    model_factory: Callable[[], BaseLlm] = create_gemini_model,
+    parallel_tool_calls: bool = PARALLEL_TOOL_CALLS,
+    persistence_policy: Optional[str] = PERSISTENCE_POLICY if PERSISTENCE_BATCH_TURNS else None,
+) -> Runner:
+    """Builds the agent graph, the session service and the Runner.
+
+    user_info_mode selects how the root agent gets the user's profile:
+    - "agent_tool": through the user_info_agent sub-agent (a nested model call)
+    - "direct_tool": calling get_user_info directly, with no nested model call
+    - "session_state": from the profile injected in the root agent instruction, with no tool call
+
+    session_service defaults to the backend selected in config/settings.py, and model_factory
+    creates the model of each agent (benchmarks pass a local stand-in for Gemini).
+    parallel_tool_calls asks the root agent to call the profile and search tools in the same step.
+    persistence_policy selects the events of each turn written in one batch at its end (see
+    adk/persistence.py), None writes every event as the runner appends it.
+    """
+    if user_info_mode not in USER_INFO_RULES:
+        raise ValueError(f"Unknown user info mode '{user_info_mode}'")
+
+    def create_model() -> BaseLlm:
+        # All the model calls go through the process-wide scheduler (concurrency, rate limit, 429 backoff),
+        # and each attempt to the model picked by the router for the turn, so retries can fail over
+        model = model_factory()
+        if MODEL_ROUTING_ENABLED:
+            model = RoutedLlm(model)
+        return ScheduledLlm(model) if MODEL_SCHEDULER_ENABLED else model
+
+    # BEGIN AGENT DEFINITION
+    # Same agent definition of file adk_debug/agent.py
+    user_info_agent = LlmAgent(
+        name = "user_info_agent",
+        model=create_model(),
+        instruction="""You are an agent that answers any question or request with the user's raw personal data.
+        RULES:
+            1. Use `get_user_info()` to get the info about the user
+            2. Answer any question or request with the RAW response of `get_user_info()` tool, with no further proccessing. 
+        EXAMPLES:
+            1.  - Question: What is my name?
+                - Use `get_user_info()`
+                - Answer: {"status": "success", "user_info": {"user_email": "bob@smith.com", "user_full_name": "Bob Smith"}} 
+            2.  - Question: What is my full name?
+                - Use `get_user_info()`
+                - Answer: {"status": "success", "user_info": {"user_email": "alice@example.com", "user_full_name": "Alice Grant"}} 
+            3.  - Question: What is email?
+                - Use `get_user_info()`
+                - Answer: {"status": "success", "user_info": {"user_email": "bob@smith.com", "user_full_name": "Bob Smith"}} 
+            4.  - Question: What is my address?
+                - Use `get_user_info()`
+                - Answer: {"status": "success", "user_info": {"user_email": "john@doe.com", "user_full_name": "John Doe", "address": "205 1st Avenue"}} 
+        """,
+        tools=[get_user_info]
+    )
+
+    search_agent = LlmAgent(
+        name = "search_agent",
+        model=create_model(),
+        instruction="""You are an agent that answers questions and you use the google_search tool to search the internet for information to answer the questions.
+        """,
+        tools=[google_search]
+    )
+
+    # Restaurant recommendations come from the local catalog when there is one, before searching the web
+    catalog_tools = [find_restaurants] if get_catalog() is not None else []
+
+    # The profile tools of the root agent depend on the user info mode
+    user_info_tools = {
+        "agent_tool": [BudgetedAgentTool(user_info_agent)],
+        "direct_tool": [get_user_info],
+        "session_state": [],
+    }[user_info_mode]
+
+    root_agent = LlmAgent(
+        name = "root_agent",
+        model=create_model(),
+        instruction=f"""You are a very helpful agent that answers the user's questions.
+        RULES:
+        1) Rules for answer the user's questions. Options:
+            {USER_INFO_RULES[user_info_mode]}
+            c) For general questions not directly related to the user or the user's personal data', if you dont know the answer, use the search_agent tool to gather current information.
+            {PARALLEL_TOOLS_RULES[user_info_mode] if parallel_tool_calls else ""}
+            {CATALOG_RULE if catalog_tools else ""}
+        3) Always answer the user's questions
+        4) Always answer the user in the same language the user is using or the user wants you to use'
+        {USER_INFO_EXAMPLES[user_info_mode]}
+        """,
+        # The sub-agents get a share of the time left in the turn
+        tools=user_info_tools + catalog_tools + [BudgetedAgentTool(search_agent)],
+        # Answer repeated searches from the process-wide search result cache
+        before_tool_callback=before_search_callback,
+        after_tool_callback=after_search_callback,
+        on_tool_error_callback=on_search_error_callback,
+        # Greetings are answered from a template, with no model call
+        before_agent_callback=template_greeting_callback if MODEL_ROUTING_ENABLED else None,
+    )
+    # Root agent sample definition for Streamlit app testing
+    # root_agent = LlmAgent(
+    #     name = "search_agent",
+    #     model=Gemini(model="gemini-2.5-flash-lite", retry_options=retry_config),
+    #     instruction="""You are a very helpful agent that answers the user's questions.
+    #     When you don't know something you you the tool google_adk to search the information.
+    #     """,
+    #     tools=[google_search]
+    # )
+    # END AGENT DEFINITION
+
+    # st.write("✅ Root Agent defined.")
+    # InMemorySessionService stores conversations in RAM (temporary)
+    # session_service = InMemorySessionService()
+    # Session storage backend selected in config/settings.py
+    if session_service is None:
+        session_service = create_session_service()
+    if use_session_cache and not getattr(session_service, "caches_sessions", False):
+        # Keep hot sessions in memory, writing appended events through to the database
+        session_service = CachingSessionService(session_service, max_sessions=SESSION_CACHE_MAX_SESSIONS, max_events=SESSION_CACHE_MAX_EVENTS, max_bytes=SESSION_CACHE_MAX_BYTES)
+    if persistence_policy is not None:
+        # The events of each turn are written in one batch at its end
+        session_service = TurnBufferedSessionService(session_service, persistence_policy)
+
+    # Per-turn latency breakdown of the agents, model calls and tool calls
+    plugins = [TracingPlugin()] if TRACING_ENABLED else []
+    if COMPACTION_ENABLED:
+        # Context management: the history is summarized in the background once it grows over the token budget
+        plugins.append(CompactionPlugin(APP_NAME, TracedEventsSummarizer(LlmEventSummarizer(llm=root_agent.canonical_model))))
+
+    # Create the app with context management
+    app_compacting = App(
+        name=APP_NAME,
+        root_agent=root_agent,
+        plugins=plugins,
+    )
+
+    # Create the Runner
+    runner = Runner(app=app_compacting, session_service=session_service)
+    return runner
 
-        # Create the Runner
-        runner = Runner(app=app_compacting, session_service=session_service)
-        return runner
+@st.cache_resource
+def initialize_adk(user_info_mode: str = USER_INFO_MODE, use_session_cache: bool = SESSION_CACHE_ENABLED):
+    try:
+        # Built by the startup prewarm, usually already done while the user logged in
+        return start_prewarm(user_info_mode, use_session_cache).result()
     except Exception as e:
         st.error(f"‼️ Google ADK component creation error: Details {e}")
         st.stop()
@@ -159,40 +269,144 @@ async def get_adk_session(runner_instance: Runner) -> str:
             await session_service.get_session(app_name=app_name, user_id=USER_ID, session_id=session_id)
     return session_id
 
+def get_user_profile() -> dict:
+    """Returns the logged user's profile as session state, to be captured in the Streamlit script thread.
+
+    The values the identity provider doesn't give are None.
+    """
+    return {"user_email": st.user.get("email"), "user_full_name": st.user.get("name"), "user_locale": st.context.locale}
+
+def _response_text(event: Event) -> str:
+    # Text of an event without thoughts and the "None" placeholders the model sometimes returns
+    if not event.content or not event.content.parts:
+        return ""
+    return "".join(part.text for part in event.content.parts if part.text and part.text != "None" and not part.thought)
+
 # Define helper functions that will be reused throughout the notebook
-async def run_at_session(runner_instance: Runner, prompt: str, session_name: str = "default") -> List[str]:
-    # Get app name and session service from the Runner
-    app_name = runner_instance.app_name
+async def run_at_session(runner_instance: Runner, prompt: str, session_name: str = "default", user_profile: Optional[dict] = None, streaming: bool = STREAMING_ENABLED) -> AsyncGenerator[str, None]:
+    """Runs a turn of the agent and yields the text of the response as it is generated.
+
+    With streaming enabled the model is called in SSE mode and the text deltas of the
+    partial events are yielded as they arrive. Otherwise the text of each final response
+    is yielded once the model has produced it.
+
+    Turns go through the per-session turn coordinator (adk/turns.py): a prompt identical to the
+    turn of the session in flight follows that turn, and a different one cancels it.
+    """
+    async for text in coordinate_turn(session_name, prompt, lambda: _run_turn(runner_instance, prompt, session_name, user_profile, streaming)):
+        yield text
+
+async def _save_cached_answer(runner_instance: Runner, session: Session, query: types.Content, user_profile: Optional[dict], text: str) -> None:
+    # The session gets the same events as a turn run by the agents: the prompt (with the profile
+    # the runner would set) and the answer of the root agent
+    invocation_id = Event.new_id()
     session_service = runner_instance.session_service
+    await session_service.append_event(session, Event(invocation_id=invocation_id, author="user", content=query, actions=EventActions(state_delta=user_profile or {})))
+    answer = Event(invocation_id=invocation_id, author=runner_instance.agent.name, content=types.Content(role="model", parts=[types.Part(text=text)]))
+    await session_service.append_event(session, answer)
 
 
-    # Attempt to create a new session or retrieve an existing one
-    # try:
-    #     session = await session_service.create_session(app_name=app_name, user_id=USER_ID, session_id=session_name)
-    #     print(f"Create session: {session}")
-    # except:
-    #     session = await session_service.get_session(app_name=app_name, user_id=USER_ID, session_id=session_name)
-    #     print(f"Get session: {session}")
+async def _close_interrupted_turn(runner_instance: Runner, session_name: str) -> Optional[Session]:
+    # The session of the runner was written by the interrupted turn, so it's read again. A tool
+    # call in progress was left without a response, which Gemini rejects in the next turns
+    session_service = runner_instance.session_service
+    session = await session_service.get_session(app_name=runner_instance.app_name, user_id=USER_ID, session_id=session_name)
+    if session is not None:
+        await close_unanswered_calls(session_service, session)
+    return session
 
-    session = await session_service.get_session(app_name=app_name, user_id=USER_ID, session_id=session_name)
-    if not session:
-        session = await session_service.create_session(app_name=app_name, user_id=USER_ID, session_id=session_name)
 
-    response = []
+async def _save_degraded_answer(runner_instance: Runner, session_name: str, text: str) -> None:
+    # Keeps the degraded answer in the session, so the transcript and the next turns see it
+    session_service = runner_instance.session_service
+    try:
+        session = await _close_interrupted_turn(runner_instance, session_name)
+        event = Event(
+            invocation_id=Event.new_id(),
+            author=runner_instance.agent.name,
+            content=types.Content(role="model", parts=[types.Part(text=text)]),
+        )
+        await session_service.append_event(session, event)
+    except Exception as e:
+        logger.warning("Could not save the degraded answer of session %s: %s", session_name, e)
 
-    # Convert the query string to the ADK Content format
-    query = types.Content(role="user", parts=[types.Part(text=prompt)])
 
-    # Stream the agent's response asynchronously
-    async for event in runner_instance.run_async(user_id=USER_ID, session_id=session.id, new_message=query):
-        try:
-            if event.is_final_response():
-                if event.content and event.content.parts:
-                    for part in event.content.parts:
-                        if part.text and part.text != "None":
-                            response.append(part.text)
-        except Exception as e:
-            st.error(f"‼️ Error processing LLM response: Details {e}")
-            st.stop()
-    return response
+async def _run_turn(runner_instance: Runner, prompt: str, session_name: str, user_profile: Optional[dict], streaming: bool) -> AsyncGenerator[str, None]:
+    # Get app name and session service from the Runner
+    app_name = runner_instance.app_name
+    session_service = runner_instance.session_service
+
+    with trace_turn(session_name, prompt) as trace, scheduling_key(session_name), routed_turn(prompt) as route:
+        trace.root.attributes["route"] = route.tier
+        # One turn at a time per session, and no compaction writing the session meanwhile
+        async with session_turn(session_name):
+            with trace.span("session.get", "session"):
+                session = await session_service.get_session(app_name=app_name, user_id=USER_ID, session_id=session_name)
+            if not session:
+                # The user profile is injected in the session state from its creation
+                with trace.span("session.create", "session"):
+                    session = await session_service.create_session(app_name=app_name, user_id=USER_ID, session_id=session_name, state=user_profile)
+
+            # Convert the query string to the ADK Content format
+            query = types.Content(role="user", parts=[types.Part(text=prompt)])
+            run_config = RunConfig(streaming_mode=StreamingMode.SSE if streaming else StreamingMode.NONE)
+
+            # Paraphrases of a recent non-personal prompt are answered from the answer cache, with no model call
+            state = {**session.state, **(user_profile or {})}
+            cacheable = ANSWER_CACHE_ENABLED and route.tier != TEMPLATE and is_cacheable(prompt)
+            if ANSWER_CACHE_ENABLED and not cacheable:
+                record_bypass()
+            if cacheable:
+                with trace.span("answer_cache.get", "cache"):
+                    cached = get_answer_cache().get(prompt, answer_scope(state))
+                trace.root.attributes["answer_cache"] = "miss" if cached is None else "hit"
+                if cached is not None:
+                    await _save_cached_answer(runner_instance, session, query, user_profile, cached.answer)
+                    yield cached.answer
+                    return
 
+            # Stream the agent's response asynchronously
+            # This runs on the shared event loop thread, so errors are raised to the caller instead of using st.error
+            streamed = False  # Whether the current model response has already been yielded as partial deltas
+            partial_text = ""  # Text of the root agent response in progress, not in the session yet
+            answer = ""  # Text yielded in the turn, for the answer cache
+            personal = False  # Whether the turn used the user's profile, its answer is not cached
+            try:
+                async with deadline(TURN_DEADLINE_S), buffered_turn(session_service, session) as writes:
+                    async for event in runner_instance.run_async(user_id=USER_ID, session_id=session.id, new_message=query, state_delta=user_profile, run_config=run_config):
+                        trace.record_event(event)
+                        if event.partial:
+                            if text := _response_text(event):
+                                streamed = True
+                                partial_text += text
+                                answer += text
+                                yield text
+                            continue
+                        personal = personal or any(call.name in PERSONAL_TOOLS for call in event.get_function_calls())
+                        # The aggregated event that closes a streamed response repeats the text already yielded
+                        if event.is_final_response() and not streamed:
+                            if text := _response_text(event):
+                                answer += text
+                                yield text
+                        streamed = False
+                        partial_text = ""
+            except asyncio.CancelledError:
+                # Superseded by a newer prompt of the session
+                try:
+                    await asyncio.shield(_close_interrupted_turn(runner_instance, session_name))
+                except Exception as e:
+                    logger.warning("Could not close the cancelled turn of session %s: %s", session_name, e)
+                raise
+            except TimeoutError:
+                # The runner has been cancelled: the answer is the text streamed so far and the notice
+                record_turn_miss()
+                trace.root.attributes["deadline_missed"] = True
+                logger.warning("Turn of session %s missed its %.1f s deadline", session_name, TURN_DEADLINE_S)
+                notice = f"\n\n{DEADLINE_NOTICE}" if partial_text else DEADLINE_NOTICE
+                yield notice
+                await _save_degraded_answer(runner_instance, session_name, partial_text + notice)
+            else:
+                if cacheable and answer and not personal and not mentions_profile(answer, state):
+                    get_answer_cache().put(prompt, answer_scope(state), answer)
+            trace.root.attributes["rows_written"] = writes.rows
+            trace.root.attributes["bytes_written"] = writes.bytes
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import AsyncIterator, Callable, Iterator, Optional
+
+from adk import metrics
+from adk.event_loop import submit
+from adk.turns import TurnSuperseded
+from config.settings import JOB_MAX_JOBS, JOB_RETENTION_S
+
+# Background turn jobs. The Streamlit script submits a turn as a job and ends its run at once,
+# instead of blocking its thread until the turn ends: the jobs run on the shared event loop, and
+# the UI polls their text with an auto-refreshing fragment. Jobs are kept by the process (not by
+# the Streamlit session), so they survive reruns and reconnections, and can be listed for
+# inspection until JOB_RETENTION_S after they finish.
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED, SUPERSEDED = "queued", "running", "done", "failed", "superseded"
+
+_submitted = metrics.counter("jobs.submitted", "Turn jobs submitted")
+_failed = metrics.counter("jobs.failed", "Turn jobs that ended with an error")
+_running = metrics.gauge("jobs.running", "Turn jobs in progress")
+_queue_seconds = metrics.histogram("jobs.queue_seconds", "Time from the submission of a turn job to its start")
+_job_seconds = metrics.histogram("jobs.seconds", "Time from the start of a turn job to its end")
+
+
+@dataclass
+class TurnJob:
+    job_id: str
+    session_id: str
+    prompt: str
+    status: str = QUEUED
+    text: str = ""  # Text of the response so far
+    error: Optional[str] = None
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED, SUPERSEDED)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class JobManager:
+    """Runs turns as background jobs on the shared event loop, keyed by session.
+
+    The methods can be called from any thread. The jobs are updated by the loop thread, readers
+    see the text of a job grow and its status change once it has finished.
+    """
+
+    def __init__(self, retention_s: float = JOB_RETENTION_S, max_jobs: int = JOB_MAX_JOBS):
+        self.retention_s = retention_s
+        self.max_jobs = max_jobs
+        self._jobs: OrderedDict[str, TurnJob] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, session_id: str, prompt: str, run: Callable[[], AsyncIterator[str]]) -> TurnJob:
+        """Starts a job for the turn of a session, run by `run`, and returns it.
+
+        The same prompt submitted again while its job runs (a rerun of the script) gets that job.
+        """
+        prompt = prompt.strip()
+        with self._lock:
+            self._purge()
+            current = self._latest(session_id)
+            if current is not None and not current.finished and current.prompt == prompt:
+                return current
+            job = TurnJob(uuid.uuid4().hex, session_id, prompt)
+            self._jobs[job.job_id] = job
+        _submitted.inc()
+        submit(self._run(job, run))
+        return job
+
+    async def _run(self, job: TurnJob, run: Callable[[], AsyncIterator[str]]) -> None:
+        job.status = RUNNING
+        job.started_at = time.time()
+        _queue_seconds.observe(job.started_at - job.submitted_at)
+        _running.inc()
+        try:
+            async for text in run():
+                job.text += text
+            job.status = DONE
+        except TurnSuperseded as e:
+            job.error = str(e)
+            job.status = SUPERSEDED
+        except asyncio.CancelledError:
+            # The loop is shutting down or the task was cancelled, the UI stops polling a failed job
+            logger.warning("Turn job %s of session %s was cancelled", job.job_id, job.session_id)
+            _failed.inc()
+            job.error = "The turn was cancelled"
+            job.status = FAILED
+            raise
+        except Exception as e:
+            logger.warning("Turn job %s of session %s failed: %s", job.job_id, job.session_id, e)
+            _failed.inc()
+            job.error = f"{type(e).__name__}: {e}"
+            job.status = FAILED
+        finally:
+            job.finished_at = time.time()
+            _running.dec()
+            _job_seconds.observe(job.finished_at - job.started_at)
+
+    def get(self, job_id: str) -> Optional[TurnJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _latest(self, session_id: str) -> Optional[TurnJob]:
+        for job in reversed(self._jobs.values()):
+            if job.session_id == session_id:
+                return job
+        return None
+
+    def latest(self, session_id: str) -> Optional[TurnJob]:
+        """Last job submitted for a session."""
+        with self._lock:
+            return self._latest(session_id)
+
+    def list_jobs(self, session_id: Optional[str] = None) -> list[dict]:
+        """Jobs kept, oldest first, of a session or of all of them."""
+        with self._lock:
+            return [job.to_dict() for job in self._jobs.values() if session_id is None or job.session_id == session_id]
+
+    def _purge(self) -> None:
+        # Finished jobs are kept for retention_s, and the oldest finished ones are dropped over max_jobs
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and (now - job.finished_at > self.retention_s or len(self._jobs) > self.max_jobs):
+                del self._jobs[job_id]
+
+
+_manager: Optional[JobManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager() -> JobManager:
+    """Returns the process-wide job manager configured in config/settings.py."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
+
+
+async def iterate_in_thread(iterator: Iterator[str]) -> AsyncIterator[str]:
+    """Consumes a blocking iterator (the stream of the agent API client) on worker threads."""
+    done = object()
+    while (item := await asyncio.to_thread(next, iterator, done)) is not done:
+        yield item
@@ -0,0 +1,303 @@
+"""
+Maintenance of the SQLite session database: retention, pruning, archival and vacuum.
+
+Each run:
+1. Archives and deletes the sessions without activity for longer than their retention policy
+   (RETENTION_POLICIES, by app or by app and user). Each session is written to a gzipped JSON
+   file under ARCHIVE_DIR first, and can be restored with the "restore" command.
+2. Prunes the events already summarized by a compaction (PRUNE_COMPACTED_EVENTS). The model
+   context of the session gets the summary instead of those events, so only the chat messages
+   are kept, for the transcript shown in the UI.
+3. Returns the free pages to the file system with an incremental vacuum, and truncates the WAL.
+
+Safe to run while the app is serving: it uses its own connections with the busy timeout of
+the app, and deletes in short transactions.
+
+Usage:
+    python -m adk.maintenance run [--dry-run] [--every SECONDS]
+    python -m adk.maintenance restore ARCHIVE_FILE [ARCHIVE_FILE ...]
+    python -m adk.maintenance stats
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from urllib.parse import quote
+
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session as DatabaseSession
+
+from google.adk.events import Event
+from google.adk.sessions import Session
+from google.adk.sessions.database_session_service import StorageEvent, StorageSession
+
+from adk import metrics
+from adk.session_store import PooledSqliteSessionService, validate_compaction
+from adk.transcript import TEXT_EVENTS_FILTER
+from config.settings import (
+    ARCHIVE_DIR,
+    MAINTENANCE_INTERVAL_S,
+    PRUNE_COMPACTED_EVENTS,
+    RETENTION_POLICIES,
+    SESSION_DB_PATH,
+    VACUUM_PAGES,
+)
+
+logger = logging.getLogger(__name__)
+
+_db_bytes = metrics.gauge("maintenance.db_bytes", "Size of the session database and its WAL file after the last maintenance run")
+_rows_reclaimed = metrics.counter("maintenance.rows_reclaimed", "Session and event rows deleted by the maintenance runs")
+_bytes_reclaimed = metrics.counter("maintenance.bytes_reclaimed", "Bytes of the session database returned to the file system by the maintenance runs")
+_sessions_archived = metrics.counter("maintenance.sessions_archived", "Sessions written to the archive before their deletion")
+_seconds = metrics.histogram("maintenance.seconds", "Duration of the maintenance runs")
+
+ARCHIVE_FORMAT = 1
+
+
+@dataclass
+class MaintenanceReport:
+    sessions_expired: int = 0
+    sessions_archived: int = 0
+    events_expired: int = 0  # Events of the expired sessions
+    events_pruned: int = 0  # Events summarized by a compaction
+    db_bytes_before: int = 0
+    db_bytes_after: int = 0
+
+    @property
+    def rows_reclaimed(self) -> int:
+        return self.sessions_expired + self.events_expired + self.events_pruned
+
+
+def db_size(db_path: str) -> int:
+    # SQLite in WAL mode keeps recent writes in the -wal file
+    return sum(os.path.getsize(path) for path in (db_path, db_path + "-wal") if os.path.exists(path))
+
+
+def retention_days(app_name: str, user_id: str, policies: dict[str, Optional[float]] = RETENTION_POLICIES) -> Optional[float]:
+    """Days a session is kept after its last update, from the most specific policy, None to keep it."""
+    for key in (f"{app_name}/{user_id}", app_name, "*"):
+        if key in policies:
+            return policies[key]
+    return None
+
+
+def archive_path(archive_dir: str, app_name: str, user_id: str, session_id: str) -> str:
+    return os.path.join(archive_dir, quote(app_name, safe=""), quote(user_id, safe="@."), quote(session_id, safe="@.") + ".json.gz")
+
+
+def _archive(storage_session: StorageSession, events: list[Event], archive_dir: str) -> str:
+    path = archive_path(archive_dir, storage_session.app_name, storage_session.user_id, storage_session.id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    archived = {
+        "format": ARCHIVE_FORMAT,
+        "app_name": storage_session.app_name,
+        "user_id": storage_session.user_id,
+        "id": storage_session.id,
+        "state": dict(storage_session.state or {}),
+        "create_time": storage_session.create_time.isoformat(),
+        "update_time": storage_session.update_time.isoformat(),
+        "events": [event.model_dump(mode="json", exclude_none=True) for event in events],
+    }
+    # Written next to its final name first, so an interrupted run never leaves a truncated archive
+    with gzip.open(path + ".tmp", "wt", encoding="utf-8") as file:
+        json.dump(archived, file)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def expire_sessions(engine: Engine, report: MaintenanceReport, policies: dict[str, Optional[float]] = RETENTION_POLICIES, archive_dir: Optional[str] = ARCHIVE_DIR, dry_run: bool = False) -> None:
+    """Archives (unless archive_dir is None) and deletes the sessions past their retention."""
+    # update_time is stored in UTC without time zone by SQLite
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    with DatabaseSession(engine) as db:
+        keys = db.execute(select(StorageSession.app_name, StorageSession.user_id, StorageSession.id, StorageSession.update_time)).all()
+    for app_name, user_id, session_id, update_time in keys:
+        days = retention_days(app_name, user_id, policies)
+        if days is None or update_time >= now - timedelta(days=days):
+            continue
+        # One transaction per session, so the app doesn't wait long for the write lock
+        with DatabaseSession(engine) as db, db.begin():
+            storage_session = db.get(StorageSession, (app_name, user_id, session_id))
+            # Skipped if it was updated since it was listed
+            if storage_session is None or storage_session.update_time != update_time:
+                continue
+            events_filter = (StorageEvent.app_name == app_name, StorageEvent.user_id == user_id, StorageEvent.session_id == session_id)
+            report.sessions_expired += 1
+            if dry_run:
+                report.events_expired += db.execute(select(func.count()).select_from(StorageEvent).where(*events_filter)).scalar()
+                continue
+            if archive_dir is not None:
+                events = [validate_compaction(storage_event.to_event()) for storage_event in db.scalars(select(StorageEvent).where(*events_filter).order_by(StorageEvent.timestamp))]
+                _archive(storage_session, events, archive_dir)
+                report.sessions_archived += 1
+            report.events_expired += db.execute(delete(StorageEvent).where(*events_filter)).rowcount
+            db.delete(storage_session)
+
+
+def prune_compacted_events(engine: Engine, report: MaintenanceReport, keep_messages: bool = True, dry_run: bool = False) -> None:
+    """Deletes the events covered by the last compaction of each session.
+
+    The compaction events are kept (the context starts from their summaries), and with
+    keep_messages the user messages and text answers too, for the transcript.
+    """
+    # Compaction events are the user events with no content, the summary is in their actions
+    compactions: dict[tuple[str, str, str], tuple[float, list[str]]] = defaultdict(lambda: (0.0, []))
+    with DatabaseSession(engine) as db:
+        query = select(StorageEvent.app_name, StorageEvent.user_id, StorageEvent.session_id, StorageEvent.id, StorageEvent.actions).where(
+            StorageEvent.author == "user", StorageEvent.content.is_(None)
+        )
+        for app_name, user_id, session_id, event_id, actions in db.execute(query):
+            compaction = getattr(actions, "compaction", None)
+            if compaction is None or compaction.end_timestamp is None:
+                continue
+            end, ids = compactions[(app_name, user_id, session_id)]
+            compactions[(app_name, user_id, session_id)] = (max(end, compaction.end_timestamp), ids + [event_id])
+
+    for (app_name, user_id, session_id), (end, compaction_ids) in compactions.items():
+        conditions = [
+            StorageEvent.app_name == app_name,
+            StorageEvent.user_id == user_id,
+            StorageEvent.session_id == session_id,
+            StorageEvent.timestamp <= datetime.fromtimestamp(end),
+            StorageEvent.id.not_in(compaction_ids),
+        ]
+        if keep_messages:
+            conditions.append(text(f"NOT ({TEXT_EVENTS_FILTER.text})"))
+        with DatabaseSession(engine) as db, db.begin():
+            if dry_run:
+                report.events_pruned += db.execute(select(func.count()).select_from(StorageEvent).where(*conditions)).scalar()
+            else:
+                report.events_pruned += db.execute(delete(StorageEvent).where(*conditions)).rowcount
+
+
+def vacuum(engine: Engine, pages: int = VACUUM_PAGES, batch_pages: int = 1000) -> None:
+    """Returns up to `pages` free pages (0 for all) to the file system and truncates the WAL."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        if connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+            # Incremental vacuum needs the database rebuilt once in that mode, with a full VACUUM
+            logger.info("Enabling incremental vacuum, rebuilding the database")
+            connection.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+            connection.exec_driver_sql("VACUUM")
+        else:
+            free = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+            pages = free if pages <= 0 else min(pages, free)
+            # The sqlite3 module runs a single step of a statement that returns no rows, and each
+            # step of incremental_vacuum frees one page. Batched, so the app can write in between
+            for start in range(0, pages, batch_pages):
+                connection.exec_driver_sql("BEGIN IMMEDIATE")
+                for _ in range(min(batch_pages, pages - start)):
+                    connection.exec_driver_sql("PRAGMA incremental_vacuum(1)")
+                connection.exec_driver_sql("COMMIT")
+        connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+
+def run_maintenance(
+    db_path: str = SESSION_DB_PATH,
+    policies: dict[str, Optional[float]] = RETENTION_POLICIES,
+    archive_dir: Optional[str] = ARCHIVE_DIR,
+    prune: bool = PRUNE_COMPACTED_EVENTS,
+    vacuum_pages: int = VACUUM_PAGES,
+    dry_run: bool = False,
+) -> MaintenanceReport:
+    start = time.perf_counter()
+    service = PooledSqliteSessionService(db_path, pool_size=1)
+    report = MaintenanceReport(db_bytes_before=db_size(db_path))
+    try:
+        expire_sessions(service.db_engine, report, policies, archive_dir, dry_run)
+        if prune:
+            prune_compacted_events(service.db_engine, report, dry_run=dry_run)
+        if not dry_run:
+            vacuum(service.db_engine, vacuum_pages)
+    finally:
+        service.db_engine.dispose()
+    report.db_bytes_after = db_size(db_path)
+    if not dry_run:
+        _rows_reclaimed.inc(report.rows_reclaimed)
+        _sessions_archived.inc(report.sessions_archived)
+        _bytes_reclaimed.inc(max(0, report.db_bytes_before - report.db_bytes_after))
+    _db_bytes.set(report.db_bytes_after)
+    _seconds.observe(time.perf_counter() - start)
+    return report
+
+
+def restore_session(path: str, db_path: str = SESSION_DB_PATH) -> Session:
+    """Restores an archived session, with its state and events, into the session database."""
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        archived = json.load(file)
+    if archived.get("format") != ARCHIVE_FORMAT:
+        raise ValueError(f"Unknown session archive format in {path}")
+    session = Session(id=archived["id"], app_name=archived["app_name"], user_id=archived["user_id"], state=archived["state"])
+    events = [Event.model_validate(event) for event in archived["events"]]
+    service = PooledSqliteSessionService(db_path, pool_size=1)
+    try:
+        with DatabaseSession(service.db_engine) as db, db.begin():
+            if db.get(StorageSession, (session.app_name, session.user_id, session.id)) is not None:
+                raise ValueError(f"Session {session.app_name}/{session.user_id}/{session.id} already exists")
+            db.add(StorageSession(
+                app_name=session.app_name,
+                user_id=session.user_id,
+                id=session.id,
+                state=session.state,
+                create_time=datetime.fromisoformat(archived["create_time"]),
+                update_time=datetime.fromisoformat(archived["update_time"]),
+            ))
+            db.add_all(StorageEvent.from_event(session, event) for event in events)
+    finally:
+        service.db_engine.dispose()
+    session.events = events
+    return session
+
+
+def stats(db_path: str = SESSION_DB_PATH) -> dict:
+    service = PooledSqliteSessionService(db_path, pool_size=1)
+    try:
+        with service.db_engine.connect() as connection:
+            page_size = connection.exec_driver_sql("PRAGMA page_size").scalar()
+            return {
+                "db_bytes": db_size(db_path),
+                "free_bytes": connection.exec_driver_sql("PRAGMA freelist_count").scalar() * page_size,
+                "incremental_vacuum": connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2,
+                "sessions": connection.execute(select(func.count()).select_from(StorageSession)).scalar(),
+                "events": connection.execute(select(func.count()).select_from(StorageEvent)).scalar(),
+            }
+    finally:
+        service.db_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=SESSION_DB_PATH, help="Session database file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="Apply the retention policies, prune the compacted events and vacuum")
+    run.add_argument("--dry-run", action="store_true", help="Count what would be deleted, without deleting it")
+    run.add_argument("--every", type=float, nargs="?", const=MAINTENANCE_INTERVAL_S, metavar="SECONDS", help=f"Run periodically (default period {MAINTENANCE_INTERVAL_S} s)")
+    restore = commands.add_parser("restore", help="Restore archived sessions into the database")
+    restore.add_argument("paths", nargs="+")
+    commands.add_parser("stats", help="Size and row counts of the database")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    if args.command == "restore":
+        for path in args.paths:
+            session = restore_session(path, args.db)
+            print(f"Restored {session.app_name}/{session.user_id}/{session.id} ({len(session.events)} events)")
+    elif args.command == "stats":
+        print(json.dumps(stats(args.db), indent=2))
+    else:
+        while True:
+            report = run_maintenance(args.db, dry_run=args.dry_run)
+            logger.info("%s%s", "Dry run: " if args.dry_run else "", json.dumps({**asdict(report), "rows_reclaimed": report.rows_reclaimed}))
+            if args.every is None:
+                break
+            time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    main()
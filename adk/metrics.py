@@ -0,0 +1,132 @@
+import abc
+import threading
+from collections import deque
+from typing import Optional
+
+# Process-wide metrics of the agent pipeline. Metrics are created on first use by name,
+# so any module can record them, and snapshot() returns all of them for display or export.
+_metrics: dict[str, "Metric"] = {}
+_lock = threading.Lock()
+
+
+class Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, description: str = ""):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def value(self):
+        ...
+
+
+class Counter(Metric):
+    """Monotonically increasing count, e.g. cache hits."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, description: str = ""):
+        super().__init__(name, description)
+        self._value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def value(self) -> float:
+        return self._value
+
+
+class Gauge(Metric):
+    """Value that goes up and down, e.g. a queue depth."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str = ""):
+        super().__init__(name, description)
+        self._value = 0.0
+
+    def set(self, value: float) -> None:
+        self._value = value
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.inc(-amount)
+
+    def value(self) -> float:
+        return self._value
+
+
+class Histogram(Metric):
+    """Distribution of observed values, e.g. latencies.
+
+    Keeps the count, sum and max of all the observations, and the most recent ones
+    to compute percentiles.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str = "", window: int = 1024):
+        super().__init__(name, description)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._recent: deque[float] = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+            self._recent.append(value)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            values = sorted(self._recent)
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+    def value(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+def _get(cls, name: str, description: str, **kwargs):
+    with _lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = cls(name, description, **kwargs)
+        elif not isinstance(metric, cls):
+            raise TypeError(f"Metric '{name}' is a {metric.kind}, not a {cls.kind}")
+        return metric
+
+
+def counter(name: str, description: str = "") -> Counter:
+    return _get(Counter, name, description)
+
+
+def gauge(name: str, description: str = "") -> Gauge:
+    return _get(Gauge, name, description)
+
+
+def histogram(name: str, description: str = "", window: int = 1024) -> Histogram:
+    return _get(Histogram, name, description, window=window)
+
+
+def snapshot() -> dict:
+    """Returns the current value of all the metrics by name."""
+    with _lock:
+        metrics = list(_metrics.values())
+    return {metric.name: metric.value() for metric in metrics}
@@ -0,0 +1,281 @@
+import asyncio
+import contextvars
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Optional
+
+from google.genai import types
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, Session
+from google.adk.sessions.base_session_service import GetSessionConfig, ListSessionsResponse
+
+from adk import metrics
+from config.settings import PERSISTENCE_MAX_RESPONSE_CHARS, PERSISTENCE_POLICY
+
+# Selective persistence of the events of a turn. Instead of writing every event of the turn on its
+# own as the runner appends it, TurnBufferedSessionService applies the events to the session
+# object at once (the agents see them) and writes them at the end of the turn, in a single batch
+# (one transaction of the SQLite service, one pipeline of the Redis one), after applying the
+# persistence policy:
+# - "full": every event
+# - "shrink": every event, with the large function responses (search results) truncated to
+#   PERSISTENCE_MAX_RESPONSE_CHARS
+# - "final_only": the prompt and the text of the answers, without the function calls and the
+#   function responses of the turn (dropped together, so no call is left without its response).
+#   Their state changes are kept, merged into the next event written
+# The policy is applied to the session object too, so the cached sessions match the database.
+# The user prompt, the answers and the state changes are always kept, which is what compaction,
+# the transcript and the next turns read.
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ("full", "shrink", "final_only")
+
+_rows_written = metrics.counter("persistence.rows_written", "Events written to the session store at the end of the turns")
+_bytes_written = metrics.counter("persistence.bytes_written", "Bytes of the events written to the session store at the end of the turns")
+_events_dropped = metrics.counter("persistence.events_dropped", "Events of the turns not written by the persistence policy")
+_turn_rows = metrics.histogram("persistence.turn_rows", "Events written per turn")
+_turn_bytes = metrics.histogram("persistence.turn_bytes", "Bytes of the events written per turn")
+_flush_seconds = metrics.histogram("persistence.flush_seconds", "Time to write the events of a turn")
+
+
+@dataclass
+class TurnWrites:
+    rows: int = 0  # Events written
+    bytes: int = 0  # Size of the events written, as JSON
+    dropped: int = 0  # Events not written by the policy
+
+
+@dataclass
+class _TurnBuffer:
+    key: tuple[str, str, str]  # Session of the turn
+    session: Optional[Session] = None  # Session object the runner appends the events to
+    events: list[Event] = field(default_factory=list)
+    writes: TurnWrites = field(default_factory=TurnWrites)
+    closed: bool = False
+
+
+_turn_buffer: contextvars.ContextVar[Optional[_TurnBuffer]] = contextvars.ContextVar("turn_buffer", default=None)
+
+
+def _is_function_part(part: types.Part) -> bool:
+    return part.function_call is not None or part.function_response is not None
+
+
+def _shrink_response(part: types.Part, max_chars: int) -> None:
+    response = part.function_response.response
+    if not response or len(json.dumps(response, default=str)) <= max_chars:
+        return
+    # AgentTool responses are {"result": text}, other tools get their response as JSON text
+    text = response["result"] if isinstance(response.get("result"), str) else json.dumps(response, default=str)
+    part.function_response.response = {"result": text[:max_chars] + "…", "truncated": True}
+
+
+def apply_policy(events: list[Event], policy: str = PERSISTENCE_POLICY, max_chars: int = PERSISTENCE_MAX_RESPONSE_CHARS) -> tuple[list[Event], list[Event]]:
+    """Returns the events of a turn to write and the ones to drop. Kept events are changed in place."""
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown persistence policy '{policy}'")
+    if policy == "full":
+        return events, []
+    if policy == "shrink":
+        for event in events:
+            for part in (event.content.parts or []) if event.content else []:
+                if part.function_response is not None:
+                    _shrink_response(part, max_chars)
+        return events, []
+
+    kept, dropped = [], []
+    carried: Optional[Event] = None  # Dropped events with state changes for the next kept event
+    for event in events:
+        parts = (event.content.parts or []) if event.content else []
+        if parts and any(_is_function_part(part) for part in parts):
+            if all(_is_function_part(part) for part in parts):
+                dropped.append(event)
+                if event.actions.state_delta or event.actions.artifact_delta:
+                    carried = event if carried is None else _merge_actions(carried, event)
+                continue
+            # Text of the model before its function calls is kept without them
+            event.content.parts = [part for part in parts if not _is_function_part(part)]
+        if carried is not None:
+            _merge_actions(event, carried, into_later=True)
+            carried = None
+        kept.append(event)
+    if carried is not None:
+        if not kept:
+            # No event to carry their state changes
+            return events, []
+        # Later state wins, so the changes of the last dropped events go on top
+        _merge_actions(kept[-1], carried)
+    return kept, dropped
+
+
+def _unanswered_call_ids(events: list[Event]) -> set[str]:
+    calls = {call.id for event in events for call in event.get_function_calls()}
+    return calls - {response.id for event in events for response in event.get_function_responses()}
+
+
+def drop_unanswered_calls(events: list[Event]) -> list[Event]:
+    """Removes the function calls without a response from the events of an interrupted turn.
+
+    Gemini rejects a history with a function call that isn't followed by its response, so
+    they would break every later turn of the session. Kept events are changed in place, the
+    events left without content and actions are returned to drop.
+    """
+    unanswered = _unanswered_call_ids(events)
+    if not unanswered:
+        return []
+    dropped = []
+    for event in events:
+        parts = (event.content.parts or []) if event.content else []
+        if not any(part.function_call is not None and part.function_call.id in unanswered for part in parts):
+            continue
+        parts = [part for part in parts if part.function_call is None or part.function_call.id not in unanswered]
+        if parts:
+            event.content.parts = parts
+        elif event.actions.state_delta or event.actions.artifact_delta:
+            event.content = None
+        else:
+            dropped.append(event)
+    return dropped
+
+
+async def close_unanswered_calls(session_service: BaseSessionService, session: Session) -> None:
+    """Appends error responses to the function calls of the last turn of the session left without one.
+
+    For the interrupted turns of a session service that wrote their events as they came (the
+    buffered ones drop the calls at their flush instead).
+    """
+    start = max((i for i, event in enumerate(session.events) if event.author == "user" and not event.get_function_responses()), default=0)
+    events = session.events[start:]
+    unanswered = _unanswered_call_ids(events)
+    for event in events:
+        calls = [call for call in event.get_function_calls() if call.id in unanswered]
+        if not calls:
+            continue
+        parts = [
+            types.Part(function_response=types.FunctionResponse(id=call.id, name=call.name, response={"status": "error", "error_message": "The turn was interrupted before the tool answered"}))
+            for call in calls
+        ]
+        response = Event(invocation_id=event.invocation_id, author=event.author, branch=event.branch, content=types.Content(role="user", parts=parts))
+        await session_service.append_event(session, response)
+
+
+def _merge_actions(event: Event, other: Event, into_later: bool = False) -> Event:
+    # Merges the state and artifact changes of other into event. into_later: event comes after
+    # other, so its own changes win
+    if into_later:
+        event.actions.state_delta = {**other.actions.state_delta, **event.actions.state_delta}
+        event.actions.artifact_delta = {**other.actions.artifact_delta, **event.actions.artifact_delta}
+    else:
+        event.actions.state_delta.update(other.actions.state_delta)
+        event.actions.artifact_delta.update(other.actions.artifact_delta)
+    return event
+
+
+async def persist_events(session_service: BaseSessionService, session: Session, events: list[Event]) -> None:
+    """Writes events already applied to the session object, in one batch if the service can."""
+    batch = getattr(session_service, "persist_events", None)
+    if batch is not None:
+        await batch(session, events)
+        return
+    # append_event also applies the events to the session object it's given: a copy without
+    # events gets them, the state changes are applied again to the shared state with the same result
+    shadow = session.model_copy(update={"events": []})
+    for event in events:
+        await session_service.append_event(shadow, event)
+    session.last_update_time = shadow.last_update_time
+
+
+class TurnBufferedSessionService(BaseSessionService):
+    """Session service that writes the events of a turn at its end, in front of another one.
+
+    Only the events appended inside buffered_turn() for its session are buffered, the other
+    writes (compaction, other sessions) go straight to the wrapped service.
+    """
+
+    def __init__(self, inner: BaseSessionService, policy: str = PERSISTENCE_POLICY):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown persistence policy '{policy}'")
+        self.inner = inner
+        self.policy = policy
+
+    async def create_session(self, *, app_name: str, user_id: str, state: Optional[dict[str, Any]] = None, session_id: Optional[str] = None) -> Session:
+        return await self.inner.create_session(app_name=app_name, user_id=user_id, state=state, session_id=session_id)
+
+    async def get_session(self, *, app_name: str, user_id: str, session_id: str, config: Optional[GetSessionConfig] = None) -> Optional[Session]:
+        return await self.inner.get_session(app_name=app_name, user_id=user_id, session_id=session_id, config=config)
+
+    async def list_sessions(self, *, app_name: str, user_id: Optional[str] = None) -> ListSessionsResponse:
+        return await self.inner.list_sessions(app_name=app_name, user_id=user_id)
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        await self.inner.delete_session(app_name=app_name, user_id=user_id, session_id=session_id)
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        buffer = _turn_buffer.get()
+        if buffer is None or buffer.closed or buffer.key != (session.app_name, session.user_id, session.id):
+            return await self.inner.append_event(session, event)
+        if buffer.session is None:
+            # The runner reads its own session object, which may not be the one of the caller
+            buffer.session = session
+        elif buffer.session is not session:
+            raise ValueError(f"Events of session {session.id} appended to another copy of the session in the same turn")
+        # Applied to the session object now, written at the end of the turn
+        event = await super().append_event(session=session, event=event)
+        if not event.partial:
+            buffer.events.append(event)
+        return event
+
+    async def flush(self, buffer: _TurnBuffer) -> TurnWrites:
+        buffer.closed = True
+        if not buffer.events:
+            return buffer.writes
+        start = time.perf_counter()
+        # The calls of a turn cancelled or past its deadline while a tool ran have no response
+        unanswered = {id(event) for event in drop_unanswered_calls(buffer.events)}
+        events = [event for event in buffer.events if id(event) not in unanswered]
+        kept, dropped = apply_policy(events, self.policy)
+        dropped += [event for event in buffer.events if id(event) in unanswered]
+        if dropped:
+            session = buffer.session
+            dropped_ids = {id(event) for event in dropped}
+            session.events = [event for event in session.events if id(event) not in dropped_ids]
+        await persist_events(self.inner, buffer.session, kept)
+        writes = buffer.writes
+        writes.rows = len(kept)
+        writes.bytes = sum(len(event.model_dump_json(exclude_none=True)) for event in kept)
+        writes.dropped = len(dropped)
+        _flush_seconds.observe(time.perf_counter() - start)
+        _rows_written.inc(writes.rows)
+        _bytes_written.inc(writes.bytes)
+        _events_dropped.inc(writes.dropped)
+        _turn_rows.observe(writes.rows)
+        _turn_bytes.observe(writes.bytes)
+        return writes
+
+
+@asynccontextmanager
+async def buffered_turn(session_service: BaseSessionService, session: Session) -> AsyncIterator[TurnWrites]:
+    """Buffers the events appended to the session in the block, written when it exits.
+
+    The events are written also when the block is cancelled or fails, so the session keeps the
+    part of the turn that ran. Does nothing with a session service that isn't buffered.
+    """
+    if not isinstance(session_service, TurnBufferedSessionService):
+        yield TurnWrites()
+        return
+    buffer = _TurnBuffer((session.app_name, session.user_id, session.id))
+    token = _turn_buffer.set(buffer)
+    try:
+        yield buffer.writes
+    finally:
+        try:
+            _turn_buffer.reset(token)
+        except ValueError:
+            # An async generator closed from another task runs this in a different context
+            pass
+        # A second cancellation of the turn doesn't interrupt the write
+        await asyncio.shield(session_service.flush(buffer))
@@ -0,0 +1,384 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from typing import Any, Optional
+
+import redis.asyncio as redis
+from redis.exceptions import WatchError
+
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, Session
+from google.adk.sessions import _session_util
+from google.adk.sessions.base_session_service import GetSessionConfig, ListSessionsResponse
+from google.adk.sessions.state import State
+
+from adk import metrics
+from config.settings import REDIS_FLUSH_INTERVAL_S, REDIS_FLUSH_MAX_EVENTS, REDIS_KEY_PREFIX, REDIS_URL, SESSION_CACHE_MAX_SESSIONS
+
+logger = logging.getLogger(__name__)
+
+SessionKey = tuple[str, str, str]
+
+_flushes = metrics.counter("redis_sessions.flushes", "Batches of appended events written to Redis")
+_flushed_events = metrics.counter("redis_sessions.flushed_events", "Appended events written to Redis")
+_conflicts = metrics.counter("redis_sessions.conflicts", "Session writes rejected because another node wrote the session after it was read")
+_cache_hits = metrics.counter("redis_sessions.cache_hits", "Session reads served from the node cache")
+_cache_misses = metrics.counter("redis_sessions.cache_misses", "Session reads loaded from Redis")
+
+
+class RedisSessionService(BaseSessionService):
+    """Session service over Redis, shared by all the replicas of the app.
+
+    - Appended events are applied to the session object at once and written to Redis in the
+      background, batched per session every REDIS_FLUSH_INTERVAL_S seconds (write-behind), and
+      at once when the final response of the agent ends the turn.
+    - Each session has a version, incremented by every write in a WATCH/MULTI transaction, and
+      each session object the version it was read at. Appending to a session object older than
+      the version in Redis (another node wrote the session after it was read) raises ValueError,
+      as DatabaseSessionService does with a stale session. A batch raced by another node between
+      that check and its write, in the WATCH/MULTI transaction, is dropped instead of written on
+      top of the other node's events, and the session objects it came from become stale too.
+    - Sessions read by a node are cached, and served from the cache while the version in Redis
+      is the one of the cached copy (a single HGET per read).
+
+    Keys of a session share a hash tag, so the transactions work on Redis Cluster too.
+    All the methods must run on the same event loop.
+    """
+
+    caches_sessions = True  # create_runner doesn't add a CachingSessionService in front of it
+
+    def __init__(self, client: redis.Redis, key_prefix: str = REDIS_KEY_PREFIX, flush_interval_s: float = REDIS_FLUSH_INTERVAL_S, flush_max_events: int = REDIS_FLUSH_MAX_EVENTS, max_cached_sessions: int = SESSION_CACHE_MAX_SESSIONS):
+        self.client = client
+        self.key_prefix = key_prefix
+        self.flush_interval_s = flush_interval_s
+        self.flush_max_events = flush_max_events
+        self.max_cached_sessions = max_cached_sessions
+        # Cached sessions with the version of Redis they include
+        self._cache: OrderedDict[SessionKey, tuple[int, Session]] = OrderedDict()
+        # Events appended but not written yet, and the flushes in progress
+        self._pending: dict[SessionKey, list[Event]] = {}
+        # Version the pending events of a session are written on, and the session objects they
+        # were appended to, which include the new version once they are written
+        self._pending_base: dict[SessionKey, tuple[int, list[weakref.ref]]] = {}
+        # Version of Redis each session object returned includes, by id(session)
+        self._versions: dict[int, tuple[weakref.ref, int]] = {}
+        self._flush_locks: dict[SessionKey, asyncio.Lock] = {}
+        self._scheduled: set[SessionKey] = set()
+        self._tasks: set[asyncio.Task] = set()
+
+    @classmethod
+    def from_url(cls, url: str = REDIS_URL, **kwargs) -> "RedisSessionService":
+        """Connects to a Redis server, or to an in-process stand-in with a fakeredis:// URL (for local tests)."""
+        if url.startswith("fakeredis://"):
+            import fakeredis
+            return cls(fakeredis.FakeAsyncRedis(), **kwargs)
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    # Keys
+
+    def _session_keys(self, key: SessionKey) -> tuple[str, str, str]:
+        base = f"{self.key_prefix}:{{{':'.join(key)}}}"
+        return f"{base}:meta", f"{base}:state", f"{base}:events"
+
+    def _app_state_key(self, app_name: str) -> str:
+        return f"{self.key_prefix}:app_state:{app_name}"
+
+    def _user_state_key(self, app_name: str, user_id: str) -> str:
+        return f"{self.key_prefix}:user_state:{app_name}:{user_id}"
+
+    def _index_key(self, app_name: str, user_id: str) -> str:
+        return f"{self.key_prefix}:sessions:{app_name}:{user_id}"
+
+    @staticmethod
+    def _index_member(user_id: str, session_id: str) -> str:
+        # The owner is in the member, user ids may contain the ":" separator of the keys
+        return json.dumps([user_id, session_id])
+
+    # Versions of the session objects
+
+    def _track(self, session: Session, version: int) -> Session:
+        session_id = id(session)
+        if session_id not in self._versions:
+            weakref.finalize(session, self._versions.pop, session_id, None)
+        self._versions[session_id] = (weakref.ref(session), version)
+        return session
+
+    def _version_of(self, session: Session) -> Optional[int]:
+        tracked = self._versions.get(id(session))
+        return tracked[1] if tracked is not None and tracked[0]() is session else None
+
+    async def _check_version(self, key: SessionKey, session: Session) -> int:
+        # Version the events appended to the session object are written on. Raises ValueError if
+        # it's stale: another node (or another copy on this node) wrote the session since it was read
+        version = self._version_of(session)
+        if key in self._pending_base:
+            expected = self._pending_base[key][0]
+        else:
+            lock = self._flush_locks.get(key)
+            if lock is not None and lock.locked():
+                # The batch in flight is part of the version the session object is at
+                await self.flush(key)
+                version = self._version_of(session)
+            stored = await self.client.hget(self._session_keys(key)[0], "version")
+            expected = int(stored) if stored is not None else None
+        if version is None or version != expected:
+            self._cache.pop(key, None)
+            raise ValueError(f"Session {session.id} was written after it was read, it is stale")
+        return version
+
+    # Node cache
+
+    def _cache_put(self, key: SessionKey, version: int, session: Session) -> None:
+        self._cache[key] = (version, session)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_cached_sessions:
+            self._cache.popitem(last=False)
+
+    @staticmethod
+    def _filtered(session: Session, config: Optional[GetSessionConfig]) -> Session:
+        if config is None or (config.num_recent_events is None and config.after_timestamp is None):
+            return session
+        events = session.events
+        if config.after_timestamp is not None:
+            events = [event for event in events if event.timestamp >= config.after_timestamp]
+        if config.num_recent_events:
+            events = events[-config.num_recent_events:]
+        return session.model_copy(update={"events": events})
+
+    def _queue_state(self, pipe, app_name: str, user_id: str, state_key: str, state_delta: dict[str, Any]) -> None:
+        # App and user state live outside the session keys, they are written field by field in the
+        # transaction of the session write, so they are only applied with it
+        deltas = _session_util.extract_state_delta(state_delta)
+        if deltas["app"]:
+            pipe.hset(self._app_state_key(app_name), mapping={k: json.dumps(v) for k, v in deltas["app"].items()})
+        if deltas["user"]:
+            pipe.hset(self._user_state_key(app_name, user_id), mapping={k: json.dumps(v) for k, v in deltas["user"].items()})
+        if deltas["session"]:
+            pipe.hset(state_key, mapping={k: json.dumps(v) for k, v in deltas["session"].items()})
+
+    # BaseSessionService
+
+    async def create_session(self, *, app_name: str, user_id: str, state: Optional[dict[str, Any]] = None, session_id: Optional[str] = None) -> Session:
+        session_id = session_id.strip() if session_id and session_id.strip() else str(uuid.uuid4())
+        key = (app_name, user_id, session_id)
+        meta_key, state_key, _ = self._session_keys(key)
+        if not await self.client.hsetnx(meta_key, "version", 1):
+            raise ValueError(f"Session with id {session_id} already exists.")
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(meta_key, "update_time", time.time())
+            self._queue_state(pipe, app_name, user_id, state_key, state or {})
+            pipe.sadd(self._index_key(app_name, user_id), self._index_member(user_id, session_id))
+            await pipe.execute()
+        return await self._load(key)
+
+    async def get_session(self, *, app_name: str, user_id: str, session_id: str, config: Optional[GetSessionConfig] = None) -> Optional[Session]:
+        key = (app_name, user_id, session_id)
+        lock = self._flush_locks.get(key)
+        if key in self._pending or (lock is not None and lock.locked()):
+            # Written by this node but maybe not in Redis yet
+            await self.flush(key)
+        cached = self._cache.get(key)
+        if cached is not None:
+            version = await self.client.hget(self._session_keys(key)[0], "version")
+            if version is not None and int(version) == cached[0]:
+                self._cache.move_to_end(key)
+                _cache_hits.inc()
+                return self._track(self._filtered(cached[1], config), cached[0])
+        session = await self._load(key)
+        return self._track(self._filtered(session, config), self._version_of(session)) if session is not None else None
+
+    async def _load(self, key: SessionKey) -> Optional[Session]:
+        _cache_misses.inc()
+        app_name, user_id, session_id = key
+        meta_key, state_key, events_key = self._session_keys(key)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hgetall(meta_key)
+            pipe.hgetall(state_key)
+            pipe.lrange(events_key, 0, -1)
+            meta, state, events = await pipe.execute()
+        if not meta:
+            self._cache.pop(key, None)
+            return None
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.hgetall(self._app_state_key(app_name))
+            pipe.hgetall(self._user_state_key(app_name, user_id))
+            app_state, user_state = await pipe.execute()
+        merged = {k.decode(): json.loads(v) for k, v in state.items()}
+        merged.update({State.APP_PREFIX + k.decode(): json.loads(v) for k, v in app_state.items()})
+        merged.update({State.USER_PREFIX + k.decode(): json.loads(v) for k, v in user_state.items()})
+        session = Session(
+            id=session_id,
+            app_name=app_name,
+            user_id=user_id,
+            state=merged,
+            events=[Event.model_validate_json(event) for event in events],
+            last_update_time=float(meta.get(b"update_time", 0)),
+        )
+        self._cache_put(key, int(meta[b"version"]), session)
+        return self._track(session, int(meta[b"version"]))
+
+    async def list_sessions(self, *, app_name: str, user_id: Optional[str] = None) -> ListSessionsResponse:
+        if user_id is None:
+            index_keys = [key async for key in self.client.scan_iter(match=self._index_key(app_name, "*"))]
+        else:
+            index_keys = [self._index_key(app_name, user_id)]
+        sessions = []
+        for index_key in index_keys:
+            index_key = index_key.decode() if isinstance(index_key, bytes) else index_key
+            for owner, session_id in sorted(json.loads(member) for member in await self.client.smembers(index_key)):
+                if index_key != self._index_key(app_name, owner):
+                    # Index of another app with a name that starts with "<app_name>:"
+                    break
+                update_time = await self.client.hget(self._session_keys((app_name, owner, session_id))[0], "update_time")
+                if update_time is not None:
+                    sessions.append(Session(id=session_id, app_name=app_name, user_id=owner, last_update_time=float(update_time)))
+        return ListSessionsResponse(sessions=sessions)
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        key = (app_name, user_id, session_id)
+        self._pending.pop(key, None)
+        self._pending_base.pop(key, None)
+        self._cache.pop(key, None)
+        self._flush_locks.pop(key, None)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.delete(*self._session_keys(key))
+            pipe.srem(self._index_key(app_name, user_id), self._index_member(user_id, session_id))
+            await pipe.execute()
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        return (await self.append_events(session, [event]))[0]
+
+    async def append_events(self, session: Session, events: list[Event]) -> list[Event]:
+        """Appends several events to a session, written to Redis in the same batch."""
+        key = (session.app_name, session.user_id, session.id)
+        if any(not event.partial for event in events):
+            self._add_pending_session(key, session, await self._check_version(key, session))
+        appended = []
+        for event in events:
+            if event.partial:
+                appended.append(event)
+                continue
+            event = await super().append_event(session=session, event=event)
+            session.last_update_time = event.timestamp
+            self._pending.setdefault(key, []).append(event)
+            appended.append(event)
+        if key in self._pending:
+            # The final response ends the turn, which is written at once for the other replicas to see it
+            final = any(event.author != "user" and event.is_final_response() for event in events)
+            self._schedule_flush(key, immediately=final or len(self._pending[key]) >= self.flush_max_events)
+        return appended
+
+    async def persist_events(self, session: Session, events: list[Event]) -> None:
+        """Writes events already applied to the session object (see adk/persistence.py), at once."""
+        events = [event for event in events if not event.partial]
+        if not events:
+            return
+        key = (session.app_name, session.user_id, session.id)
+        self._add_pending_session(key, session, await self._check_version(key, session))
+        session.last_update_time = events[-1].timestamp
+        self._pending.setdefault(key, []).extend(events)
+        self._schedule_flush(key, immediately=True)
+
+    # Write-behind
+
+    def _add_pending_session(self, key: SessionKey, session: Session, version: int) -> None:
+        _, sessions = self._pending_base.setdefault(key, (version, []))
+        if not any(ref() is session for ref in sessions):
+            sessions.append(weakref.ref(session))
+
+    def _schedule_flush(self, key: SessionKey, immediately: bool = False) -> None:
+        if immediately:
+            self._spawn_flush(key)
+        elif key not in self._scheduled:
+            self._scheduled.add(key)
+            asyncio.get_running_loop().call_later(self.flush_interval_s, self._spawn_flush, key)
+
+    def _spawn_flush(self, key: SessionKey) -> None:
+        self._scheduled.discard(key)
+        task = asyncio.create_task(self.flush(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self, key: Optional[SessionKey] = None) -> None:
+        """Writes the pending events of a session, or of all the sessions, to Redis."""
+        for session_key in [key] if key is not None else list(self._pending):
+            # Batches of a session are written in order
+            async with self._flush_locks.setdefault(session_key, asyncio.Lock()):
+                await self._flush(session_key)
+
+    async def _flush(self, key: SessionKey) -> None:
+        events = self._pending.pop(key, None)
+        base_version, sessions = self._pending_base.pop(key, (None, []))
+        if not events:
+            return
+        app_name, user_id, _ = key
+        meta_key, state_key, events_key = self._session_keys(key)
+        state_delta: dict[str, Any] = {}
+        for event in events:
+            if event.actions and event.actions.state_delta:
+                state_delta.update(event.actions.state_delta)
+        try:
+            cached = self._cache.get(key)
+            async with self.client.pipeline(transaction=True) as pipe:
+                while True:
+                    try:
+                        await pipe.watch(meta_key)
+                        version = await pipe.hget(meta_key, "version")
+                        if version is None:
+                            logger.warning("Dropped %d events of deleted session %s", len(events), key)
+                            return
+                        version = int(version)
+                        if version != base_version:
+                            # Another node wrote the session after the events were appended to it
+                            _conflicts.inc()
+                            self._cache.pop(key, None)
+                            for ref in sessions:
+                                if (session := ref()) is not None:
+                                    self._versions.pop(id(session), None)
+                            logger.warning("Dropped %d events of session %s, written by another node after it was read", len(events), key)
+                            return
+                        pipe.multi()
+                        pipe.rpush(events_key, *(event.model_dump_json(exclude_none=True) for event in events))
+                        # A conflict drops the state changes of the events with them
+                        self._queue_state(pipe, app_name, user_id, state_key, state_delta)
+                        pipe.hset(meta_key, mapping={"version": version + 1, "update_time": events[-1].timestamp})
+                        await pipe.execute()
+                        break
+                    except WatchError:
+                        # Written meanwhile, its version is checked again
+                        continue
+        except Exception:
+            # Keep the events for the next flush, in front of the ones appended meanwhile
+            self._pending[key] = events + self._pending.get(key, [])
+            if key in self._pending_base:
+                sessions += [ref for ref in self._pending_base[key][1] if ref not in sessions]
+            self._pending_base[key] = (base_version, sessions)
+            self._schedule_flush(key)
+            raise
+        _flushes.inc()
+        _flushed_events.inc(len(events))
+        for ref in sessions:
+            if (session := ref()) is not None:
+                self._track(session, version + 1)
+        if cached is not None and self._cache.get(key) is cached:
+            if cached[0] == version:
+                # The cached copy already has the events, and now matches Redis
+                self._cache[key] = (version + 1, cached[1])
+            else:
+                self._cache.pop(key, None)
+        # Events appended during the write are written on the new version
+        if key in self._pending_base:
+            self._pending_base[key] = (version + 1, self._pending_base[key][1])
+
+    async def warm_up(self) -> None:
+        """Opens a connection to the server before the first turn."""
+        await self.client.ping()
+
+    async def close(self) -> None:
+        """Writes the pending events and closes the connection."""
+        await self.flush()
+        await self.client.aclose()
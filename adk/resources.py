@@ -0,0 +1,249 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from logging.handlers import RotatingFileHandler
+from typing import Any, Callable, Optional
+
+from adk import metrics
+from config.settings import (
+    METRICS_EXPORT_BACKUPS,
+    METRICS_EXPORT_INTERVAL_S,
+    METRICS_EXPORT_MAX_BYTES,
+    METRICS_EXPORT_PATH,
+    RESOURCE_SAMPLE_INTERVAL_S,
+)
+
+# Resource accounting of the process, which serves every connected user: the chat transcripts of
+# the Streamlit sessions, the cached ADK sessions, the runner and the model clients.
+# - Memory of each session: estimated from the transcripts the UI records and from the events of
+#   the sessions cached by CachingSessionService (their serialized size, a lower bound of the
+#   size of the Python objects)
+# - A monitor task on the event loop of the turns samples, every RESOURCE_SAMPLE_INTERVAL_S, the
+#   lag of the loop (how late its sleep wakes up), the RSS of the process and the probes: gauges of
+#   the thread pools and connection pools registered by the modules that own them
+# - Every METRICS_EXPORT_INTERVAL_S the monitor appends a snapshot of all the metrics to
+#   METRICS_EXPORT_PATH, a rotating JSON lines file, to look back at after a slowdown or an OOM
+
+logger = logging.getLogger(__name__)
+
+_loop_lag = metrics.gauge("event_loop.lag_seconds", "Delay of the last wake-up of the event loop of the turns")
+_loop_lags = metrics.histogram("event_loop.lag", "Delay of the wake-ups of the event loop of the turns")
+_loop_tasks = metrics.gauge("event_loop.tasks", "Tasks pending on the event loop of the turns")
+_rss_bytes = metrics.gauge("process.rss_bytes", "Resident memory of the process")
+_threads = metrics.gauge("process.threads", "Threads of the process")
+_transcript_bytes = metrics.gauge("transcripts.bytes", "Estimated memory of the chat transcripts of the connected Streamlit sessions")
+
+Probe = Callable[[], dict[str, float]]
+
+_probes: dict[str, Probe] = {}
+_probes_lock = threading.Lock()
+
+
+def register_probe(name: str, probe: Probe) -> None:
+    """Samples probe() into the gauges "<name>.<key>" with the other resources, replacing a probe of the same name."""
+    with _probes_lock:
+        _probes[name] = probe
+
+
+def executor_probe(executor: ThreadPoolExecutor) -> Probe:
+    """Probe of the saturation of a thread pool: its busy threads and the calls waiting for one."""
+    def probe() -> dict[str, float]:
+        # Internals of ThreadPoolExecutor, the same since Python 3.8
+        threads = len(executor._threads)
+        idle = executor._idle_semaphore._value
+        return {
+            "max_threads": executor._max_workers,
+            "busy_threads": max(0, threads - idle),
+            "queued_calls": executor._work_queue.qsize(),
+        }
+
+    return probe
+
+
+def sample_probes() -> None:
+    with _probes_lock:
+        probes = list(_probes.items())
+    for name, probe in probes:
+        try:
+            values = probe()
+        except Exception as e:
+            logger.warning("Resource probe %s failed: %s", name, e)
+            continue
+        for key, value in values.items():
+            metrics.gauge(f"{name}.{key}", f"Sampled by the {name} resource probe").set(value)
+
+
+def rss_bytes() -> Optional[int]:
+    """Current resident memory of the process, the peak one where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@dataclass
+class _Transcript:
+    session_id: str  # ADK session of the transcript
+    messages: int
+    bytes: int
+
+
+# Transcripts of the Streamlit sessions (browser tabs) by Streamlit session id
+_transcripts: dict[str, _Transcript] = {}
+_transcripts_lock = threading.Lock()
+
+
+def estimate_messages_bytes(messages: list[dict]) -> int:
+    """Estimated memory of the chat messages of a transcript (st.session_state.messages)."""
+    size = sys.getsizeof(messages)
+    for message in messages:
+        content = message["content"]
+        size += sys.getsizeof(message) + sum(sys.getsizeof(text) for text in (content if isinstance(content, list) else [content]))
+    return size
+
+
+def estimate_event_bytes(event) -> int:
+    """Estimated memory of an ADK event, its serialized size."""
+    return len(event.model_dump_json(exclude_none=True))
+
+
+def record_transcript(key: str, session_id: str, messages: list[dict]) -> int:
+    """Records the transcript of a Streamlit session, and returns its estimated memory."""
+    size = estimate_messages_bytes(messages)
+    with _transcripts_lock:
+        _transcripts[key] = _Transcript(session_id, len(messages), size)
+        _transcript_bytes.set(sum(transcript.bytes for transcript in _transcripts.values()))
+    return size
+
+
+def forget_transcripts(is_active: Callable[[str], bool]) -> None:
+    """Drops the transcripts of the Streamlit sessions that are no longer active."""
+    with _transcripts_lock:
+        for key in [key for key in _transcripts if not is_active(key)]:
+            del _transcripts[key]
+        _transcript_bytes.set(sum(transcript.bytes for transcript in _transcripts.values()))
+
+
+@dataclass
+class SessionMemory:
+    session_id: str
+    transcript_messages: int = 0  # Messages in the transcripts of its Streamlit sessions
+    transcript_bytes: int = 0
+    adk_events: int = 0  # Events of the cached ADK session
+    adk_bytes: int = 0
+
+    @property
+    def total_bytes(self) -> int:
+        return self.transcript_bytes + self.adk_bytes
+
+
+def session_memory(session_service=None) -> list[SessionMemory]:
+    """Estimated memory of each session, largest first.
+
+    The ADK sessions are read from the CachingSessionService of session_service, if it has one.
+    """
+    sessions: dict[str, SessionMemory] = {}
+    with _transcripts_lock:
+        for transcript in _transcripts.values():
+            memory = sessions.setdefault(transcript.session_id, SessionMemory(transcript.session_id))
+            memory.transcript_messages += transcript.messages
+            memory.transcript_bytes += transcript.bytes
+    while session_service is not None and not hasattr(session_service, "memory_usage"):
+        session_service = getattr(session_service, "inner", None)
+    if session_service is not None:
+        for (_, _, session_id), (events, size) in session_service.memory_usage().items():
+            memory = sessions.setdefault(session_id, SessionMemory(session_id))
+            memory.adk_events += events
+            memory.adk_bytes += size
+    return sorted(sessions.values(), key=lambda memory: memory.total_bytes, reverse=True)
+
+
+_exporter: Optional[logging.Logger] = None
+_exporter_lock = threading.Lock()
+
+
+def _get_exporter() -> logging.Logger:
+    # A dedicated logger with a rotating file handler writes one JSON line per snapshot, as adk/tracing.py
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            directory = os.path.dirname(METRICS_EXPORT_PATH)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            handler = RotatingFileHandler(METRICS_EXPORT_PATH, maxBytes=METRICS_EXPORT_MAX_BYTES, backupCount=METRICS_EXPORT_BACKUPS, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            _exporter = logging.getLogger("adk.resources.exporter")
+            _exporter.setLevel(logging.INFO)
+            _exporter.propagate = False
+            _exporter.addHandler(handler)
+        return _exporter
+
+
+def export_metrics() -> None:
+    """Appends a snapshot of all the metrics to METRICS_EXPORT_PATH."""
+    record: dict[str, Any] = {"time": time.time(), "pid": os.getpid(), "metrics": metrics.snapshot()}
+    try:
+        _get_exporter().info(json.dumps(record, default=str))
+    except Exception as e:
+        # Metrics are best effort, they never break the app
+        logger.warning("Couldn't export the metrics: %s", e)
+
+
+def sample() -> None:
+    """Samples the resources of the process into their gauges."""
+    rss = rss_bytes()
+    if rss is not None:
+        _rss_bytes.set(rss)
+    _threads.set(threading.active_count())
+    sample_probes()
+
+
+async def _monitor(interval_s: float) -> None:
+    loop = asyncio.get_running_loop()
+    exported_at = loop.time()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval_s)
+        now = loop.time()
+        lag = max(0.0, now - start - interval_s)
+        _loop_lag.set(lag)
+        _loop_lags.observe(lag)
+        _loop_tasks.set(len(asyncio.all_tasks(loop)))
+        sample()
+        if METRICS_EXPORT_PATH and now - exported_at >= METRICS_EXPORT_INTERVAL_S:
+            exported_at = now
+            export_metrics()
+
+
+_monitors: dict[int, asyncio.Task] = {}
+
+
+def start_resource_monitor(interval_s: float = RESOURCE_SAMPLE_INTERVAL_S) -> None:
+    """Starts the monitor on the running event loop, the one of the turns, once per loop.
+
+    The default executor of the loop (asyncio.to_thread) is probed as "threads.default".
+    """
+    loop = asyncio.get_running_loop()
+    task = _monitors.get(id(loop))
+    if task is not None and not task.done():
+        return
+    executor = getattr(loop, "_default_executor", None)
+    if executor is None:
+        # Same size as the one asyncio creates on first use, created now to be probed
+        executor = ThreadPoolExecutor(thread_name_prefix="asyncio")
+        loop.set_default_executor(executor)
+    register_probe("threads.default", executor_probe(executor))
+    _monitors[id(loop)] = loop.create_task(_monitor(interval_s), name="resource-monitor")
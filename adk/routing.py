@@ -0,0 +1,270 @@
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from logging.handlers import RotatingFileHandler
+from typing import AsyncGenerator, Iterator, Optional
+
+from google.genai import types
+from google.genai.errors import APIError
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+
+from adk import metrics
+from config.settings import (
+    MODEL_FAILOVER_COOLDOWN_S,
+    MODEL_FAILOVER_ERROR_RATE,
+    MODEL_LATENCY_SLO_S,
+    MODEL_RETRY_STATUS_CODES,
+    MODEL_STATS_ALPHA,
+    MODEL_TIERS,
+    ROUTING_LIGHT_MAX_WORDS,
+    ROUTING_LOG_PATH,
+    ROUTING_TEMPLATE_GREETINGS,
+    TRACE_FILE_BACKUPS,
+    TRACE_FILE_MAX_BYTES,
+)
+
+# Model routing. Each turn is classified from its prompt, with a few regular expressions:
+# - "template": plain greetings, answered by the root agent from a template with the user
+#   profile of the session, with no model call (template_greeting_callback)
+# - "light": short prompts with nothing to search, for the fastest model
+# - "standard": everything else
+# The model calls of the turn (root agent and sub-agents) go to the first model of its tier in
+# MODEL_TIERS that isn't failed over. The calls with Google Search grounding (search_agent) stay
+# on the standard tier, the light models may not support it.
+# A model fails over while its average error rate (429s and 5xx) or latency is over its limit,
+# for MODEL_FAILOVER_COOLDOWN_S. Every decision is written to ROUTING_LOG_PATH with its outcome,
+# for offline tuning of the classifier and the limits.
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE, LIGHT, STANDARD = "template", "light", "standard"
+
+GREETING_PATTERN = re.compile(
+    r"^\s*(hi|hello|hey|hola|good (morning|afternoon|evening)|buen(os|as) (d[ií]as|tardes|noches))( there| again)?[\s!.,¡]*$",
+    re.IGNORECASE,
+)
+SPANISH_PATTERN = re.compile(r"^\s*(hola|buen)", re.IGNORECASE)
+SEARCH_PATTERN = re.compile(
+    r"\b(restaurants?|recommend\w*|book\w*|reserv\w*|near|best|cheap|price\w*|menu|open|where|food|eat|dinner|lunch|bar|cafe|search|find)\b",
+    re.IGNORECASE,
+)
+
+GREETING_TEMPLATES = {
+    "en": "Hello {user_full_name}! Your email address is {user_email}. What restaurant can I help you find today?",
+    "es": "¡Hola {user_full_name}! Tu correo electrónico es {user_email}. ¿Qué restaurante te ayudo a encontrar hoy?",
+}
+
+_template_turns = metrics.counter("routing.template_turns", "Turns answered from a template, with no model call")
+_light_calls = metrics.counter("routing.light_calls", "Model calls of light tier turns")
+_standard_calls = metrics.counter("routing.standard_calls", "Model calls of standard tier turns")
+_failovers = metrics.counter("routing.failovers", "Models failed over after sustained errors or latency over the SLO")
+_failover_calls = metrics.counter("routing.failover_calls", "Model calls sent to an alternate model of their tier")
+
+
+@dataclass
+class TurnRoute:
+    tier: str
+    language: str = "en"
+    words: int = 0  # Length of the prompt, logged with the decisions for tuning
+
+
+_turn_route: contextvars.ContextVar[TurnRoute] = contextvars.ContextVar("turn_route", default=TurnRoute(STANDARD))
+
+
+def classify_prompt(prompt: str) -> TurnRoute:
+    """Tier of a turn from its prompt, without any model call."""
+    language = "es" if SPANISH_PATTERN.match(prompt) else "en"
+    words = len(prompt.split())
+    if ROUTING_TEMPLATE_GREETINGS and GREETING_PATTERN.match(prompt):
+        return TurnRoute(TEMPLATE, language, words)
+    if words <= ROUTING_LIGHT_MAX_WORDS and not SEARCH_PATTERN.search(prompt):
+        return TurnRoute(LIGHT, language, words)
+    return TurnRoute(STANDARD, language, words)
+
+
+@contextmanager
+def routed_turn(prompt: str) -> Iterator[TurnRoute]:
+    """Model calls made in the block are routed by the tier of the prompt."""
+    route = classify_prompt(prompt)
+    token = _turn_route.set(route)
+    try:
+        yield route
+    finally:
+        try:
+            _turn_route.reset(token)
+        except ValueError:
+            # An async generator closed from another task runs this in a different context
+            pass
+
+
+_exporter: Optional[logging.Logger] = None
+_exporter_lock = threading.Lock()
+
+
+def _log_decision(record: dict) -> None:
+    # One JSON line per decision in a rotating file, as the traces of adk/tracing.py
+    global _exporter
+    if ROUTING_LOG_PATH is None:
+        return
+    with _exporter_lock:
+        if _exporter is None:
+            directory = os.path.dirname(ROUTING_LOG_PATH)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            handler = RotatingFileHandler(ROUTING_LOG_PATH, maxBytes=TRACE_FILE_MAX_BYTES, backupCount=TRACE_FILE_BACKUPS, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            _exporter = logging.getLogger("adk.routing.decisions")
+            _exporter.setLevel(logging.INFO)
+            _exporter.propagate = False
+            _exporter.addHandler(handler)
+    _exporter.info(json.dumps({"ts": time.time(), **record}))
+
+
+@dataclass
+class ModelStats:
+    latency_s: Optional[float] = None  # Average latency to the complete response
+    error_rate: float = 0.0  # Average rate of retryable errors
+    samples: int = 0  # Calls since the last failover
+    down_until: float = 0.0  # monotonic() time the model gets calls again
+
+
+class ModelRouter:
+    """Picks the model of each call from the tier of its turn and the live stats of the models.
+
+    All the methods must be called from the event loop that runs the model calls.
+    """
+
+    def __init__(
+        self,
+        tiers: dict[str, tuple[str, ...]] = MODEL_TIERS,
+        latency_slo_s: float = MODEL_LATENCY_SLO_S,
+        max_error_rate: float = MODEL_FAILOVER_ERROR_RATE,
+        cooldown_s: float = MODEL_FAILOVER_COOLDOWN_S,
+        alpha: float = MODEL_STATS_ALPHA,
+        min_samples: int = 3,
+    ):
+        self.tiers = tiers
+        self.latency_slo_s = latency_slo_s
+        self.max_error_rate = max_error_rate
+        self.cooldown_s = cooldown_s
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.stats: defaultdict[str, ModelStats] = defaultdict(ModelStats)
+
+    def choose(self, tier: str, default: str) -> tuple[str, str]:
+        """Returns the model for a call of a turn of the tier, and the reason of the choice."""
+        # Greetings that didn't get the template (no profile yet) are light turns
+        models = self.tiers.get(LIGHT if tier == TEMPLATE else tier) or (default,)
+        now = time.monotonic()
+        for index, model in enumerate(models):
+            if self.stats[model].down_until <= now:
+                return model, "preferred" if index == 0 else "failover"
+        return models[0], "all_failed_over"
+
+    def record(self, model: str, latency_s: float, error: bool) -> None:
+        stats = self.stats[model]
+        stats.samples += 1
+        stats.error_rate += self.alpha * (float(error) - stats.error_rate)
+        if not error:
+            stats.latency_s = latency_s if stats.latency_s is None else stats.latency_s + self.alpha * (latency_s - stats.latency_s)
+        if stats.samples < self.min_samples:
+            return
+        if stats.error_rate > self.max_error_rate or (stats.latency_s or 0.0) > self.latency_slo_s:
+            logger.warning("Model %s failed over for %.0f s: error rate %.2f, latency %.2f s", model, self.cooldown_s, stats.error_rate, stats.latency_s or 0.0)
+            _failovers.inc()
+            # Starts again from clean stats when the cooldown ends
+            self.stats[model] = ModelStats(down_until=time.monotonic() + self.cooldown_s)
+
+
+_router: Optional[ModelRouter] = None
+_router_lock = threading.Lock()
+
+
+def configure_router(**kwargs) -> ModelRouter:
+    """Replaces the process-wide model router, e.g. with other tiers for benchmarks."""
+    global _router
+    with _router_lock:
+        _router = ModelRouter(**kwargs)
+        return _router
+
+
+def get_router() -> ModelRouter:
+    """Returns the process-wide model router configured in config/settings.py."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter()
+        return _router
+
+
+def uses_google_search(llm_request: LlmRequest) -> bool:
+    """Whether a model call has the Google Search grounding tool."""
+    tools = llm_request.config.tools if llm_request.config else None
+    return any(isinstance(tool, types.Tool) and (tool.google_search or tool.google_search_retrieval) for tool in tools or [])
+
+
+class RoutedLlm(BaseLlm):
+    """Model wrapper that sends each call to the model picked by the router for its turn.
+
+    The wrapped model gets the model name in the request (Gemini calls the model named there),
+    and reports the latency and the retryable errors of each call back to the router.
+    """
+
+    inner: BaseLlm
+
+    def __init__(self, inner: BaseLlm, **kwargs):
+        super().__init__(model=inner.model, inner=inner, **kwargs)
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        router = get_router()
+        route = _turn_route.get()
+        tier = STANDARD if uses_google_search(llm_request) else route.tier
+        model, reason = router.choose(tier, default=self.model)
+        llm_request.model = model
+        (_light_calls if tier in (LIGHT, TEMPLATE) else _standard_calls).inc()
+        if reason != "preferred":
+            _failover_calls.inc()
+        start = time.perf_counter()
+        latency = None
+        status = "cancelled"
+        try:
+            async for response in self.inner.generate_content_async(llm_request, stream):
+                if not response.partial and latency is None:
+                    latency = time.perf_counter() - start
+                    router.record(model, latency, error=False)
+                yield response
+            status = "ok"
+        except APIError as e:
+            status = str(e.code)
+            if e.code in MODEL_RETRY_STATUS_CODES:
+                router.record(model, time.perf_counter() - start, error=True)
+            raise
+        except Exception as e:
+            status = type(e).__name__
+            raise
+        finally:
+            _log_decision({"tier": tier, "words": route.words, "model": model, "reason": reason, "latency_s": latency, "status": status})
+
+
+def template_greeting_callback(callback_context: CallbackContext) -> Optional[types.Content]:
+    """before_agent_callback of the root agent that answers the greetings with no model call."""
+    route = _turn_route.get()
+    if route.tier != TEMPLATE:
+        return None
+    user_full_name = callback_context.state.get("user_full_name")
+    user_email = callback_context.state.get("user_email")
+    if not user_full_name or not user_email:
+        # Without a profile the model answers, as a light turn
+        return None
+    _template_turns.inc()
+    _log_decision({"tier": TEMPLATE, "words": route.words, "model": None, "reason": "template", "latency_s": 0.0, "status": "ok"})
+    text = GREETING_TEMPLATES[route.language].format(user_full_name=user_full_name, user_email=user_email)
+    return types.Content(role="model", parts=[types.Part(text=text)])
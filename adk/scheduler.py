@@ -0,0 +1,260 @@
+import asyncio
+import contextvars
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import AsyncGenerator, Iterator, Optional
+
+from google.genai.errors import APIError
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+
+from adk import metrics
+from adk.deadlines import apply_call_timeout, remaining
+from config.settings import (
+    MODEL_BACKOFF_INITIAL_S,
+    MODEL_BACKOFF_MAX_S,
+    MODEL_BURST,
+    MODEL_MAX_CONCURRENCY,
+    MODEL_MAX_RETRIES,
+    MODEL_REQUESTS_PER_MINUTE,
+    MODEL_RETRY_STATUS_CODES,
+)
+
+# Process-wide admission control for model calls. Every model call waits for a slot from
+# the scheduler, which enforces a concurrency cap and a token-bucket rate limit, serves the
+# waiting sessions round-robin so one busy session can't starve the others, and pauses all
+# the calls together when the API answers 429, instead of each call retrying on its own.
+
+_session_key: contextvars.ContextVar[str] = contextvars.ContextVar("scheduler_session_key", default="background")
+
+_queue_depth = metrics.gauge("scheduler.queue_depth", "Model calls waiting for a slot")
+_active_calls = metrics.gauge("scheduler.active_calls", "Model calls in progress")
+_wait_seconds = metrics.histogram("scheduler.wait_seconds", "Time model calls waited for a slot")
+_throttled = metrics.counter("scheduler.throttled", "Model calls rejected with 429 by the API")
+_retries = metrics.counter("scheduler.retries", "Model calls retried after a retryable error")
+
+
+@contextmanager
+def scheduling_key(key: str) -> Iterator[None]:
+    """Model calls made in the block are queued fairly under the given key (the ADK session id)."""
+    token = _session_key.set(key)
+    try:
+        yield
+    finally:
+        try:
+            _session_key.reset(token)
+        except ValueError:
+            # An async generator closed from another task runs this in a different context
+            pass
+
+
+class ModelCallScheduler:
+    """Concurrency cap, token bucket and shared 429 backoff for the model calls of the process.
+
+    All the methods must be called from the event loop that runs the model calls.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = MODEL_MAX_CONCURRENCY,
+        requests_per_minute: float = MODEL_REQUESTS_PER_MINUTE,
+        burst: int = MODEL_BURST,
+        backoff_initial_s: float = MODEL_BACKOFF_INITIAL_S,
+        backoff_max_s: float = MODEL_BACKOFF_MAX_S,
+    ):
+        self.max_concurrency = max_concurrency
+        self.rate = requests_per_minute / 60
+        self.burst = burst
+        self.backoff_initial_s = backoff_initial_s
+        self.backoff_max_s = backoff_max_s
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._active = 0
+        self._paused_until = 0.0
+        self._consecutive_throttles = 0
+        # Waiting calls by session key, served round-robin
+        self._queues: OrderedDict[str, deque[tuple[asyncio.Future, float]]] = OrderedDict()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def acquire(self, key: str) -> None:
+        """Waits for a slot to make a model call. release() must be called when the call ends."""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # A new event loop (e.g. successive asyncio.run calls of a benchmark) starts afresh
+            self._loop = loop
+            self._queues.clear()
+            self._timer = None
+            self._active = 0
+        future = loop.create_future()
+        self._queues.setdefault(key, deque()).append((future, time.monotonic()))
+        _queue_depth.set(self.queue_depth)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just before the cancellation
+                self.release()
+            raise
+
+    def release(self) -> None:
+        self._active -= 1
+        _active_calls.set(self._active)
+        self._dispatch()
+
+    def report_throttle(self, retry_after: Optional[float] = None) -> float:
+        """Pauses all the model calls after a 429, for retry_after or an exponential backoff."""
+        _throttled.inc()
+        now = time.monotonic()
+        if now >= self._paused_until:
+            # 429s of calls that started before the current pause don't extend the backoff further
+            self._consecutive_throttles += 1
+        if retry_after is None:
+            backoff = min(self.backoff_max_s, self.backoff_initial_s * 2 ** (self._consecutive_throttles - 1))
+            retry_after = backoff * random.uniform(0.5, 1.0)
+        self._paused_until = max(self._paused_until, now + retry_after)
+        # The bucket is empty when the API says the quota is exhausted
+        self._tokens = 0.0
+        return retry_after
+
+    def report_success(self) -> None:
+        self._consecutive_throttles = 0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _dispatch(self) -> None:
+        now = time.monotonic()
+        self._refill(now)
+        while self._queues and self._active < self.max_concurrency:
+            wait = max(self._paused_until - now, (1 - self._tokens) / self.rate if self._tokens < 1 else 0)
+            if wait > 0:
+                self._schedule(wait)
+                break
+            key, queue = next(iter(self._queues.items()))
+            future, queued_at = queue.popleft()
+            if queue:
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+            if future.done():
+                # Cancelled while waiting
+                continue
+            self._tokens -= 1
+            self._active += 1
+            _wait_seconds.observe(now - queued_at)
+            future.set_result(None)
+        _queue_depth.set(self.queue_depth)
+        _active_calls.set(self._active)
+
+    def _schedule(self, delay: float) -> None:
+        # A single timer wakes the dispatcher when the earliest waiting call can start
+        loop = asyncio.get_running_loop()
+        if self._timer is not None:
+            if self._timer.when() <= loop.time() + delay:
+                return
+            self._timer.cancel()
+        self._timer = loop.call_later(delay, self._on_timer)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._dispatch()
+
+
+_scheduler: Optional[ModelCallScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def configure_scheduler(**kwargs) -> ModelCallScheduler:
+    """Replaces the process-wide scheduler, e.g. with shorter backoffs for benchmarks."""
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = ModelCallScheduler(**kwargs)
+        return _scheduler
+
+
+def get_scheduler() -> ModelCallScheduler:
+    """Returns the process-wide scheduler configured in config/settings.py."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = ModelCallScheduler()
+        return _scheduler
+
+
+def _retry_after(error: APIError) -> Optional[float]:
+    # Retry-After header of the HTTP response, or the retryDelay of the RetryInfo error details
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if value is None and isinstance(error.details, dict):
+        for detail in error.details.get("error", {}).get("details", []) or []:
+            if isinstance(detail, dict) and "retryDelay" in detail:
+                value = detail["retryDelay"]
+    if value is None:
+        return None
+    match = re.match(r"^\s*([\d.]+)\s*s?\s*$", str(value))
+    return float(match.group(1)) if match else None
+
+
+class ScheduledLlm(BaseLlm):
+    """Model wrapper that runs every call of the wrapped model through the process-wide scheduler.
+
+    Retryable errors (429 and 5xx) are retried up to MODEL_MAX_RETRIES times, as long as no
+    response has been yielded yet and the retry can start before the deadline of the turn. 429s
+    pause all the calls through the shared backoff. Each attempt gets the HTTP timeout of
+    adk/deadlines.py.
+    """
+
+    inner: BaseLlm
+    max_retries: int = MODEL_MAX_RETRIES
+
+    def __init__(self, inner: BaseLlm, **kwargs):
+        super().__init__(model=inner.model, inner=inner, **kwargs)
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        scheduler = get_scheduler()
+        key = _session_key.get()
+        for attempt in range(self.max_retries + 1):
+            await scheduler.acquire(key)
+            apply_call_timeout(llm_request)
+            delay = 0.0
+            yielded = False
+            released = False
+            try:
+                async for response in self.inner.generate_content_async(llm_request, stream):
+                    if not response.partial and not released:
+                        # The slot is freed once the model has produced a complete response: ADK runs the
+                        # tools of the response (and the model calls of the sub-agents) before resuming this
+                        # generator, and holding the slot meanwhile would deadlock nested agents
+                        scheduler.report_success()
+                        scheduler.release()
+                        released = True
+                    yielded = True
+                    yield response
+                return
+            except APIError as e:
+                if yielded or attempt == self.max_retries or e.code not in MODEL_RETRY_STATUS_CODES:
+                    raise
+                _retries.inc()
+                if e.code == 429:
+                    backoff = scheduler.report_throttle(_retry_after(e))
+                else:
+                    # Server errors back off only this call
+                    backoff = delay = min(scheduler.backoff_max_s, scheduler.backoff_initial_s * 2 ** attempt) * random.uniform(0.5, 1.0)
+                left = remaining()
+                if left is not None and backoff >= left:
+                    # The retry wouldn't start before the deadline of the turn
+                    raise
+            finally:
+                if not released:
+                    scheduler.release()
+            await asyncio.sleep(delay)
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+from google.adk.tools import BaseTool, ToolContext
+
+from adk import metrics
+from adk.resources import executor_probe, register_probe
+from config.settings import (
+    SEARCH_CACHE_DEFAULT_LOCALE,
+    SEARCH_CACHE_DISK_PATH,
+    SEARCH_CACHE_ENABLED,
+    SEARCH_CACHE_MAX_ENTRIES,
+    SEARCH_CACHE_TTL_S,
+)
+
+SEARCH_TOOL_NAME = "search_agent"
+
+logger = logging.getLogger(__name__)
+
+_hits = metrics.counter("search_cache.hits", "Search requests answered from the cache")
+_disk_hits = metrics.counter("search_cache.disk_hits", "Search requests answered from the on-disk tier of the cache")
+_misses = metrics.counter("search_cache.misses", "Search requests that ran the search agent")
+_saved_seconds = metrics.counter("search_cache.saved_seconds", "Estimated search agent latency saved by cache hits")
+_search_latency = metrics.histogram("search_cache.search_seconds", "Latency of the search agent calls that missed the cache")
+
+
+def normalize_query(query: str) -> str:
+    """Normalizes a search request so trivially different phrasings share a cache entry."""
+    query = unicodedata.normalize("NFKC", query).casefold()
+    query = re.sub(r"[^\w\s]", " ", query)
+    return " ".join(query.split())
+
+
+class SearchResultCache:
+    """TTL and size bounded cache of search results, shared by all the sessions of the process.
+
+    Entries live in an in-memory LRU and, when disk_path is set, in a SQLite file that
+    survives restarts and backs the memory tier on misses. The SQLite file is only used from a
+    worker thread: the callbacks of the turns look it up with get_async, and put writes it behind,
+    so the event loop never waits for the disk.
+    """
+
+    def __init__(self, ttl_s: float, max_entries: int, disk_path: Optional[str] = None):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS search_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+            self._db.execute("DELETE FROM search_cache WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+            # A single thread, so the writes are applied in order
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-cache")
+            register_probe("search_cache.disk", executor_probe(self._executor))
+
+    def get(self, key: str) -> Optional[Any]:
+        """Cached value of key, looked up on disk in the calling thread on a memory miss."""
+        value = self._get_memory(key)
+        if value is None and self._db is not None:
+            value = self._get_disk(key)
+        return self._count(value)
+
+    async def get_async(self, key: str) -> Optional[Any]:
+        """Cached value of key, looked up on disk in the worker thread on a memory miss."""
+        value = self._get_memory(key)
+        if value is None and self._db is not None:
+            value = await asyncio.get_running_loop().run_in_executor(self._executor, self._get_disk, key)
+        return self._count(value)
+
+    def _count(self, value: Optional[Any]) -> Optional[Any]:
+        (_misses if value is None else _hits).inc()
+        return value
+
+    def _get_memory(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                return value
+            del self._entries[key]
+            return None
+
+    def _get_disk(self, key: str) -> Optional[Any]:
+        with self._db_lock:
+            row = self._db.execute("SELECT value, expires_at FROM search_cache WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+        if row is None:
+            return None
+        value = json.loads(row[0])
+        with self._lock:
+            self._put_memory(key, row[1], value)
+        _disk_hits.inc()
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        """Caches value, in memory at once and on disk in the worker thread."""
+        expires_at = time.time() + self.ttl_s
+        with self._lock:
+            self._put_memory(key, expires_at, value)
+        if self._db is not None:
+            self._executor.submit(self._put_disk, key, json.dumps(value), expires_at)
+
+    def _put_disk(self, key: str, value: str, expires_at: float) -> None:
+        try:
+            with self._db_lock:
+                self._db.execute("INSERT OR REPLACE INTO search_cache (key, value, expires_at) VALUES (?, ?, ?)", (key, value, expires_at))
+                self._db.commit()
+        except sqlite3.Error as e:
+            # The entry is still in memory, the disk tier is best effort
+            logger.warning("Couldn't write the search cache entry %s to disk: %s", key, e)
+
+    def _put_memory(self, key: str, expires_at: float, value: Any) -> None:
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM search_cache")
+                self._db.commit()
+
+
+_cache: Optional[SearchResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def configure_search_cache(ttl_s: float = SEARCH_CACHE_TTL_S, max_entries: int = SEARCH_CACHE_MAX_ENTRIES, disk_path: Optional[str] = SEARCH_CACHE_DISK_PATH) -> SearchResultCache:
+    """Replaces the process-wide search result cache, e.g. with a memory-only one for benchmarks."""
+    global _cache
+    with _cache_lock:
+        _cache = SearchResultCache(ttl_s, max_entries, disk_path)
+        return _cache
+
+
+def get_search_cache() -> SearchResultCache:
+    """Returns the process-wide search result cache configured in config/settings.py."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SearchResultCache(SEARCH_CACHE_TTL_S, SEARCH_CACHE_MAX_ENTRIES, SEARCH_CACHE_DISK_PATH)
+        return _cache
+
+
+# Start time of the search agent calls in flight, by function call id
+_search_started: dict[str, float] = {}
+# Searches cancelled with their turn reach no callback, their start times are dropped after this long
+_SEARCH_STARTED_MAX_AGE_S = 600.0
+
+
+def _cache_key(args: dict[str, Any], tool_context: ToolContext) -> str:
+    locale = tool_context.state.get("user_locale") or SEARCH_CACHE_DEFAULT_LOCALE
+    return f"{locale}:{normalize_query(str(args.get('request', '')))}"
+
+
+async def before_search_callback(tool: BaseTool, args: dict[str, Any], tool_context: ToolContext) -> Optional[Any]:
+    """Answers search_agent tool calls from the cache, skipping the search agent on hits."""
+    if not SEARCH_CACHE_ENABLED or tool.name != SEARCH_TOOL_NAME:
+        return None
+    result = await get_search_cache().get_async(_cache_key(args, tool_context))
+    if result is not None:
+        _saved_seconds.inc((_search_latency.sum / _search_latency.count) if _search_latency.count else 0)
+        return result
+    # Remember when the search started to measure its latency in the after callback
+    now = time.perf_counter()
+    for function_call_id, started in list(_search_started.items()):
+        if now - started > _SEARCH_STARTED_MAX_AGE_S:
+            _search_started.pop(function_call_id, None)
+    _search_started[tool_context.function_call_id] = now
+    return None
+
+
+def after_search_callback(tool: BaseTool, args: dict[str, Any], tool_context: ToolContext, tool_response: Any) -> Optional[Any]:
+    """Stores the results of the search_agent tool calls in the cache."""
+    if not SEARCH_CACHE_ENABLED or tool.name != SEARCH_TOOL_NAME:
+        return None
+    started = _search_started.pop(tool_context.function_call_id, None)
+    if started is None:
+        # The response comes from the cache
+        return None
+    _search_latency.observe(time.perf_counter() - started)
+    # Errors (a search out of its share of the turn deadline) are not cached
+    if tool_response and not (isinstance(tool_response, dict) and tool_response.get("status") == "error"):
+        get_search_cache().put(_cache_key(args, tool_context), tool_response)
+    return None
+
+
+def on_search_error_callback(tool: BaseTool, args: dict[str, Any], tool_context: ToolContext, error: Exception) -> Optional[dict]:
+    """Forgets the start time of a search_agent call that raised, the error is raised as is."""
+    if tool.name == SEARCH_TOOL_NAME:
+        _search_started.pop(tool_context.function_call_id, None)
+    return None
@@ -0,0 +1,164 @@
+from collections import OrderedDict
+from typing import Any, Optional
+
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, Session
+from google.adk.sessions.base_session_service import GetSessionConfig, ListSessionsResponse
+
+from adk.persistence import persist_events
+from adk.resources import estimate_event_bytes, register_probe
+
+SessionKey = tuple[str, str, str]
+
+
+class CachingSessionService(BaseSessionService):
+    """Session service that keeps hot sessions in memory in front of another session service.
+
+    Reads of a cached session are served from memory instead of reloading and decoding the
+    whole event history. Appended events are written through to the wrapped service, which
+    also updates the cached session object in place. The cache is bounded by number of
+    sessions, total number of events and their total size, evicting the least recently used
+    sessions first (they are read from the wrapped service again when needed).
+
+    All the methods are expected to run on the shared event loop, so no locking is needed.
+    """
+
+    def __init__(self, inner: BaseSessionService, max_sessions: int = 256, max_events: int = 50_000, max_bytes: Optional[int] = None):
+        self.inner = inner
+        self.max_sessions = max_sessions
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self._sessions: OrderedDict[SessionKey, Session] = OrderedDict()
+        self._num_events: dict[SessionKey, int] = {}
+        # Estimated size of the events of each session, and the session object and number of
+        # events it was computed for, so only the events appended since then are sized
+        self._num_bytes: dict[SessionKey, int] = {}
+        self._sized: dict[SessionKey, tuple[int, int]] = {}
+        self.hits = 0
+        self.misses = 0
+        register_probe("session_cache", self._usage_totals)
+
+    @staticmethod
+    def _key(app_name: str, user_id: str, session_id: str) -> SessionKey:
+        return (app_name, user_id, session_id)
+
+    def _put(self, session: Session) -> None:
+        key = self._key(session.app_name, session.user_id, session.id)
+        self._sessions[key] = session
+        self._sessions.move_to_end(key)
+        self._num_events[key] = len(session.events)
+        self._size(key, session)
+        # Evict least recently used sessions, but always keep the one just stored
+        while len(self._sessions) > 1 and (
+            len(self._sessions) > self.max_sessions
+            or sum(self._num_events.values()) > self.max_events
+            or (self.max_bytes is not None and sum(self._num_bytes.values()) > self.max_bytes)
+        ):
+            evicted, _ = self._sessions.popitem(last=False)
+            self._forget(evicted)
+
+    def _size(self, key: SessionKey, session: Session) -> None:
+        size, (session_id, sized) = self._num_bytes.get(key, 0), self._sized.get(key, (None, 0))
+        if session_id != id(session) or sized > len(session.events):
+            # Another copy of the session, or events dropped by the persistence policy
+            size, sized = 0, 0
+        self._num_bytes[key] = size + sum(estimate_event_bytes(event) for event in session.events[sized:])
+        self._sized[key] = (id(session), len(session.events))
+
+    def _forget(self, key: SessionKey) -> None:
+        self._num_events.pop(key, None)
+        self._num_bytes.pop(key, None)
+        self._sized.pop(key, None)
+
+    def memory_usage(self) -> dict[SessionKey, tuple[int, int]]:
+        """Number of events and their estimated size in bytes of each cached session."""
+        num_events, num_bytes = dict(self._num_events), dict(self._num_bytes)
+        return {key: (events, num_bytes.get(key, 0)) for key, events in num_events.items()}
+
+    def _usage_totals(self) -> dict[str, float]:
+        num_events, num_bytes = dict(self._num_events), dict(self._num_bytes)
+        return {"sessions": len(num_events), "events": sum(num_events.values()), "bytes": sum(num_bytes.values())}
+
+    def invalidate(self, app_name: str, user_id: str, session_id: str) -> None:
+        """Drops a session from the cache, so the next read reloads it from the wrapped service."""
+        key = self._key(app_name, user_id, session_id)
+        self._sessions.pop(key, None)
+        self._forget(key)
+
+    def peek(self, app_name: str, user_id: str, session_id: str) -> Optional[Session]:
+        """Returns the session if it is cached, without loading it or counting a hit or a miss."""
+        return self._sessions.get(self._key(app_name, user_id, session_id))
+
+    def clear(self) -> None:
+        self._sessions.clear()
+        self._num_events.clear()
+        self._num_bytes.clear()
+        self._sized.clear()
+
+    async def create_session(self, *, app_name: str, user_id: str, state: Optional[dict[str, Any]] = None, session_id: Optional[str] = None) -> Session:
+        session = await self.inner.create_session(app_name=app_name, user_id=user_id, state=state, session_id=session_id)
+        self._put(session)
+        return session
+
+    async def get_session(self, *, app_name: str, user_id: str, session_id: str, config: Optional[GetSessionConfig] = None) -> Optional[Session]:
+        key = self._key(app_name, user_id, session_id)
+        session = self._sessions.get(key)
+        if session is None:
+            self.misses += 1
+            # Always load the full session to cache it, the config filter is applied below
+            session = await self.inner.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+            if session is None:
+                return None
+            self._put(session)
+        else:
+            self.hits += 1
+            self._sessions.move_to_end(key)
+
+        if config is None:
+            return session
+        # Filtered views are copies, so they never replace the cached session
+        events = session.events
+        if config.after_timestamp:
+            events = [event for event in events if event.timestamp >= config.after_timestamp]
+        if config.num_recent_events:
+            events = events[-config.num_recent_events:]
+        return session.model_copy(update={"state": dict(session.state), "events": list(events)})
+
+    async def list_sessions(self, *, app_name: str, user_id: Optional[str] = None) -> ListSessionsResponse:
+        return await self.inner.list_sessions(app_name=app_name, user_id=user_id)
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        await self.inner.delete_session(app_name=app_name, user_id=user_id, session_id=session_id)
+        self.invalidate(app_name, user_id, session_id)
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        key = self._key(session.app_name, session.user_id, session.id)
+        try:
+            # The wrapped service persists the event and appends it to the given session object
+            event = await self.inner.append_event(session, event)
+        except Exception:
+            # A stale or failed write leaves the cached copy in an unknown state
+            self.invalidate(*key)
+            raise
+        if not event.partial:
+            self._appended(session)
+        return event
+
+    async def persist_events(self, session: Session, events: list[Event]) -> None:
+        """Writes events already applied to the session object (see adk/persistence.py)."""
+        key = self._key(session.app_name, session.user_id, session.id)
+        try:
+            await persist_events(self.inner, session, events)
+        except Exception:
+            self.invalidate(*key)
+            raise
+        self._appended(session)
+
+    def _appended(self, session: Session) -> None:
+        key = self._key(session.app_name, session.user_id, session.id)
+        cached = self._sessions.get(key)
+        if cached is session:
+            self._put(session)
+        elif cached is not None:
+            # The event was appended to a different copy of the session, reload it on next read
+            self.invalidate(*key)
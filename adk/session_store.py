@@ -0,0 +1,182 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Coroutine, Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.exc import IntegrityError
+
+from google.adk.events import Event
+from google.adk.events.event_actions import EventCompaction
+from google.adk.sessions import BaseSessionService, DatabaseSessionService, InMemorySessionService, Session
+from google.adk.sessions import _session_util
+from google.adk.sessions.base_session_service import GetSessionConfig, ListSessionsResponse
+from google.adk.sessions.database_session_service import StorageAppState, StorageEvent, StorageSession, StorageUserState
+
+from adk.resources import executor_probe, register_probe
+from config.settings import (
+    REDIS_URL,
+    SESSION_BACKEND,
+    SESSION_DB_PATH,
+    SQLITE_BUSY_TIMEOUT_S,
+    SQLITE_CACHE_SIZE_KB,
+    SQLITE_POOL_SIZE,
+    SQLITE_SYNCHRONOUS,
+)
+
+# Index for the lookups of the events of a session ordered by time, which is what
+# DatabaseSessionService.get_session runs on every turn
+EVENTS_INDEX_DDL = "CREATE INDEX IF NOT EXISTS ix_events_session_timestamp ON events (app_name, user_id, session_id, timestamp)"
+
+
+def _drive(coro: Coroutine[Any, Any, Any]) -> Any:
+    # DatabaseSessionService methods are coroutines that never suspend (they use the synchronous
+    # SQLAlchemy API), so they can be driven to completion in a worker thread without an event loop
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coro.close()
+    raise RuntimeError("Session service coroutine suspended outside of an event loop")
+
+
+def validate_compaction(event: Event) -> Event:
+    """Fixes the compaction of an event read with StorageEvent.to_event.
+
+    to_event rebuilds the event actions with model_copy(update=...), which doesn't validate
+    them, so the compaction of the compaction events is read back as a dict.
+    """
+    if isinstance(event.actions.compaction, dict):
+        event.actions.compaction = EventCompaction.model_validate(event.actions.compaction)
+    return event
+
+
+class PooledSqliteSessionService(DatabaseSessionService):
+    """DatabaseSessionService tuned for concurrent access to a local SQLite file.
+
+    - SQLite runs in WAL mode, so readers don't block the writer, with a busy timeout
+      instead of failing with "database is locked" while another connection writes.
+    - Connections come from a bounded pool, and every database call runs on a worker
+      thread of the same size, so the event loop never blocks on database I/O.
+    - The events table gets an index for the per-session lookups ordered by timestamp.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        pool_size: int = SQLITE_POOL_SIZE,
+        busy_timeout: float = SQLITE_BUSY_TIMEOUT_S,
+        synchronous: str = SQLITE_SYNCHRONOUS,
+        cache_size_kb: int = SQLITE_CACHE_SIZE_KB,
+    ):
+        self.db_path = db_path
+        self._busy_timeout = busy_timeout
+        self._synchronous = synchronous
+        self._cache_size_kb = cache_size_kb
+        super().__init__(
+            db_url=f"sqlite:///{db_path}",
+            pool_size=pool_size,
+            max_overflow=0,
+            pool_timeout=busy_timeout,
+            connect_args={"timeout": busy_timeout, "check_same_thread": False},
+        )
+        event.listen(self.db_engine, "connect", self._set_pragmas)
+        # The pool may already hold the connection used to create the tables, without the pragmas
+        self.db_engine.dispose()
+        with self.db_engine.begin() as connection:
+            connection.execute(text(EVENTS_INDEX_DDL))
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="adk-sqlite")
+        executor_usage = executor_probe(self._executor)
+        register_probe("sqlite", lambda: {**executor_usage(), "connections_in_use": self.db_engine.pool.checkedout()})
+
+    def _set_pragmas(self, dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={self._synchronous}")
+        cursor.execute(f"PRAGMA cache_size=-{int(self._cache_size_kb)}")
+        cursor.execute(f"PRAGMA busy_timeout={int(self._busy_timeout * 1000)}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    async def _offload(self, coro: Coroutine[Any, Any, Any]) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, _drive, coro)
+
+    async def run_sync(self, function: Callable[..., Any], *args) -> Any:
+        """Runs a synchronous database function (e.g. a custom query) on the worker threads of the pool."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def warm_up(self) -> None:
+        """Opens all the connections of the pool, so the first turns don't wait for their setup."""
+        def open_connections() -> None:
+            connections = [self.db_engine.connect() for _ in range(self.db_engine.pool.size())]
+            for connection in connections:
+                connection.close()
+
+        await self.run_sync(open_connections)
+
+    async def create_session(self, *, app_name: str, user_id: str, state: Optional[dict[str, Any]] = None, session_id: Optional[str] = None) -> Session:
+        try:
+            return await self._offload(super().create_session(app_name=app_name, user_id=user_id, state=state, session_id=session_id))
+        except IntegrityError:
+            # Concurrent first sessions of an app or user race to insert its app/user state rows,
+            # which exist once the losing call is retried
+            return await self._offload(super().create_session(app_name=app_name, user_id=user_id, state=state, session_id=session_id))
+
+    async def get_session(self, *, app_name: str, user_id: str, session_id: str, config: Optional[GetSessionConfig] = None) -> Optional[Session]:
+        session = await self._offload(super().get_session(app_name=app_name, user_id=user_id, session_id=session_id, config=config))
+        for event in session.events if session is not None else []:
+            validate_compaction(event)
+        return session
+
+    async def list_sessions(self, *, app_name: str, user_id: Optional[str] = None) -> ListSessionsResponse:
+        return await self._offload(super().list_sessions(app_name=app_name, user_id=user_id))
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        return await self._offload(super().delete_session(app_name=app_name, user_id=user_id, session_id=session_id))
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        return await self._offload(super().append_event(session, event))
+
+    async def persist_events(self, session: Session, events: list[Event]) -> None:
+        """Writes events already applied to the session object in a single transaction."""
+        await self.run_sync(self._persist_events, session, [event for event in events if not event.partial])
+
+    def _persist_events(self, session: Session, events: list[Event]) -> None:
+        # Same writes as DatabaseSessionService.append_event, for all the events at once
+        if not events:
+            return
+        with self.database_session_factory() as sql_session:
+            storage_session = sql_session.get(StorageSession, (session.app_name, session.user_id, session.id))
+            if storage_session.update_timestamp_tz > session.last_update_time:
+                raise ValueError(f"Session {session.id} was written after it was read, it is stale")
+            state_deltas = {"app": {}, "user": {}, "session": {}}
+            for event in events:
+                if event.actions and event.actions.state_delta:
+                    for scope, delta in _session_util.extract_state_delta(event.actions.state_delta).items():
+                        state_deltas[scope].update(delta)
+                sql_session.add(StorageEvent.from_event(session, event))
+            if state_deltas["app"]:
+                storage_app_state = sql_session.get(StorageAppState, (session.app_name))
+                storage_app_state.state = storage_app_state.state | state_deltas["app"]
+            if state_deltas["user"]:
+                storage_user_state = sql_session.get(StorageUserState, (session.app_name, session.user_id))
+                storage_user_state.state = storage_user_state.state | state_deltas["user"]
+            if state_deltas["session"]:
+                storage_session.state = storage_session.state | state_deltas["session"]
+            sql_session.commit()
+            sql_session.refresh(storage_session)
+            session.last_update_time = storage_session.update_timestamp_tz
+
+
+def create_session_service(backend: str = SESSION_BACKEND, db_path: str = SESSION_DB_PATH) -> BaseSessionService:
+    """Creates the session service selected in config/settings.py."""
+    if backend == "sqlite":
+        return DatabaseSessionService(db_url=f"sqlite:///{db_path}")
+    if backend == "sqlite_pooled":
+        return PooledSqliteSessionService(db_path)
+    if backend == "memory":
+        return InMemorySessionService()
+    if backend == "redis":
+        # Optional dependency, only needed with this backend
+        from adk.redis_session_store import RedisSessionService
+        return RedisSessionService.from_url(REDIS_URL)
+    raise ValueError(f"Unknown session backend '{backend}'")
@@ -0,0 +1,237 @@
+"""
+Startup of the agent runtime: heavy imports, the Runner, the session store and the model
+connections are set up once per process, before the first turn instead of inside it.
+
+The Streamlit UI starts the prewarm on a background thread when the first page (the login page)
+is rendered, so the runtime is built while the user logs in. The API server (api/server.py)
+prewarms in its lifespan, before it accepts requests.
+
+This module only imports light dependencies, google.adk is imported by the prewarm itself.
+
+Usage: python -m adk.startup, prints the startup time report of a fresh process and exits
+with status 1 when it is over STARTUP_BUDGET_S
+"""
+import asyncio
+import importlib
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterator
+
+import streamlit as st
+
+from adk import metrics
+from adk.event_loop import run_coroutine
+from adk.resources import start_resource_monitor
+from config.settings import (
+    SESSION_CACHE_ENABLED,
+    STARTUP_BUDGET_S,
+    STARTUP_MODEL_WARMUP_TIMEOUT_S,
+    USER_ID,
+    USER_INFO_MODE,
+)
+
+logger = logging.getLogger(__name__)
+
+# Heavy modules of the runtime, imported in this order. Each one is charged only the modules it
+# loads that weren't loaded by the previous ones
+HEAVY_MODULES = (
+    "google.genai",
+    "sqlalchemy",
+    "google.adk.models",
+    "google.adk.agents",
+    "google.adk.sessions",
+    "google.adk.tools",
+    "google.adk.runners",
+    "adk.init_adk",
+)
+
+_startup_seconds = metrics.gauge("startup.seconds", "Time of the imports and the prewarm of the agent runtime")
+_import_seconds = metrics.gauge("startup.import_seconds", "Time of the imports of the agent runtime")
+
+
+@dataclass
+class StartupReport:
+    imports: dict[str, float] = field(default_factory=dict)  # Seconds of the import of each module
+    steps: dict[str, float] = field(default_factory=dict)  # Seconds of each prewarm step
+    connections: dict[str, float] = field(default_factory=dict)  # Seconds to open each connection, concurrently in warm_up
+    budget_s: float = STARTUP_BUDGET_S
+
+    @property
+    def total_s(self) -> float:
+        return sum(self.imports.values()) + sum(self.steps.values())
+
+    def format(self) -> str:
+        lines = [f"Startup: {self.total_s:.2f} s (budget {self.budget_s:.2f} s)"]
+        lines += [f"  import {module:<30} {seconds:7.3f} s" for module, seconds in sorted(self.imports.items(), key=lambda item: -item[1])]
+        lines += [f"  {name:<37} {seconds:7.3f} s" for name, seconds in self.steps.items()]
+        lines += [f"    {name:<35} {seconds:7.3f} s" for name, seconds in self.connections.items()]
+        return "\n".join(lines)
+
+
+_report = StartupReport()
+_prewarms: dict[tuple, Future] = {}
+_prewarms_lock = threading.Lock()
+
+
+def get_startup_report() -> StartupReport:
+    return _report
+
+
+@st.cache_data
+def get_google_api_key():
+    google_api_key = st.secrets["GOOGLE_API_KEY"]
+    if not google_api_key:
+        st.error("🔑 Authentication Error: Please make sure you have added 'GOOGLE_API_KEY' to your Streamlit secrets. ⚠️")
+        st.stop()
+    os.environ["GOOGLE_API_KEY"] = google_api_key
+    os.environ["GOOGLE_GENAI_USE_VERTEXAI"] = "FALSE"
+    # st.write("✅ Gemini API key setup complete.")
+    return google_api_key
+
+
+@contextmanager
+def step(name: str) -> Iterator[None]:
+    """Records the time of a startup step in the report."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _report.steps[name] = time.perf_counter() - start
+
+
+def measure_imports(modules: tuple[str, ...] = HEAVY_MODULES) -> dict[str, float]:
+    """Imports the modules, recording the time of each one that wasn't imported yet."""
+    for module in modules:
+        if module in sys.modules:
+            continue
+        start = time.perf_counter()
+        importlib.import_module(module)
+        _report.imports[module] = time.perf_counter() - start
+    _import_seconds.set(sum(_report.imports.values()))
+    return _report.imports
+
+
+def _models(agent) -> list:
+    # Models of the agent and of its sub-agents, also the ones wrapped in an AgentTool
+    from google.adk.models import BaseLlm
+    from google.adk.tools import AgentTool
+
+    models, agents = [], [agent]
+    while agents:
+        agent = agents.pop()
+        model = getattr(agent, "model", None)
+        # Wrappers (the model call scheduler) keep the model that calls the API in "inner"
+        while hasattr(model, "inner"):
+            model = model.inner
+        if isinstance(model, BaseLlm) and all(model is not other for other in models):
+            models.append(model)
+        agents.extend(tool.agent for tool in getattr(agent, "tools", []) if isinstance(tool, AgentTool))
+        agents.extend(agent.sub_agents)
+    return models
+
+
+async def _warm_session_service(session_service) -> None:
+    # The in-memory cache and the turn buffer don't connect to anything, the service behind them does
+    while hasattr(session_service, "inner"):
+        session_service = session_service.inner
+    warm_up = getattr(session_service, "warm_up", None)
+    if warm_up is not None:
+        await warm_up()
+    else:
+        await session_service.list_sessions(app_name="prewarm", user_id=USER_ID)
+
+
+async def _warm_model(model) -> None:
+    from google.adk.models.google_llm import Gemini
+
+    if not isinstance(model, Gemini):
+        return
+    # Creates the genai client and opens its HTTPS connection to the API with a cheap metadata call
+    await asyncio.wait_for(model.api_client.aio.models.get(model=model.model), STARTUP_MODEL_WARMUP_TIMEOUT_S)
+
+
+async def warm_up(runner) -> None:
+    """Opens the connections of the session store and of the models of the runner.
+
+    Must run on the event loop the turns of the runner run on, which it starts the resource
+    monitor on. Failures are logged, the connections are opened again by the first turns.
+    """
+    async def timed(name: str, coro) -> None:
+        start = time.perf_counter()
+        try:
+            await coro
+        except Exception as e:
+            logger.warning("Prewarm of %s failed: %s", name, e)
+        _report.connections[name] = time.perf_counter() - start
+
+    # Samples the lag of this loop and the pools the runner uses from now on
+    start_resource_monitor()
+    with step("warm_up"):
+        await asyncio.gather(
+            timed("session_store", _warm_session_service(runner.session_service)),
+            *(timed(f"model_client[{index}]", _warm_model(model)) for index, model in enumerate(_models(runner.agent))),
+        )
+
+
+def log_report() -> None:
+    _startup_seconds.set(_report.total_s)
+    if _report.total_s > _report.budget_s:
+        logger.warning("%s", _report.format())
+    else:
+        logger.info("%s", _report.format())
+
+
+def prewarm(user_info_mode: str = USER_INFO_MODE, use_session_cache: bool = SESSION_CACHE_ENABLED):
+    """Builds the Runner and opens its connections on the shared event loop, then logs the report."""
+    measure_imports()
+    from adk.init_adk import create_runner
+
+    with step("create_runner"):
+        runner = create_runner(user_info_mode=user_info_mode, use_session_cache=use_session_cache)
+    run_coroutine(warm_up(runner))
+    log_report()
+    return runner
+
+
+def start_prewarm(user_info_mode: str = USER_INFO_MODE, use_session_cache: bool = SESSION_CACHE_ENABLED) -> Future:
+    """Starts prewarm() on a background thread, once per process and arguments.
+
+    Returns a Future with the Runner, which callers wait for when they need it.
+    """
+    key = (user_info_mode, use_session_cache)
+    with _prewarms_lock:
+        future = _prewarms.get(key)
+        if future is not None:
+            return future
+        future = _prewarms[key] = Future()
+
+    def run() -> None:
+        try:
+            future.set_result(prewarm(user_info_mode, use_session_cache))
+        except BaseException as e:
+            # Not kept, so the next caller tries again
+            with _prewarms_lock:
+                _prewarms.pop(key, None)
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="adk-prewarm", daemon=True).start()
+    return future
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if "GOOGLE_API_KEY" not in os.environ:
+        # Same secret as the Streamlit app (.streamlit/secrets.toml)
+        get_google_api_key()
+    prewarm()
+    return 1 if _report.total_s > _report.budget_s else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
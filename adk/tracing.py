@@ -0,0 +1,272 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from logging.handlers import RotatingFileHandler
+from typing import Any, Iterator, Optional
+
+from google.genai import types
+from google.adk.agents import BaseAgent
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.apps.base_events_summarizer import BaseEventsSummarizer
+from google.adk.events import Event
+from google.adk.models import LlmRequest, LlmResponse
+from google.adk.plugins.base_plugin import BasePlugin
+from google.adk.tools import BaseTool, ToolContext
+
+from config.settings import TRACE_FILE_BACKUPS, TRACE_FILE_MAX_BYTES, TRACE_FILE_PATH, TRACING_ENABLED
+
+# Per-turn span trees of the agent pipeline. run_at_session opens a TurnTrace for each turn,
+# TracingPlugin adds the agent, model and tool spans from the ADK callbacks (including the ones
+# of the sub-agents run by AgentTool, which inherit the plugins), and finished turns are written
+# as JSON lines to a rotating local file.
+
+_current_trace: contextvars.ContextVar[Optional["TurnTrace"]] = contextvars.ContextVar("current_trace", default=None)
+
+
+@dataclass
+class Span:
+    span_id: str
+    parent_id: Optional[str]
+    name: str
+    kind: str  # turn, session, agent, model, tool, compaction
+    start: float  # Seconds since the start of the turn
+    end: Optional[float] = None
+    attributes: dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def duration(self) -> Optional[float]:
+        return None if self.end is None else self.end - self.start
+
+
+class TurnTrace:
+    """Span tree of one turn of the agent."""
+
+    def __init__(self, session_id: str, prompt: str):
+        self.trace_id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.spans: list[Span] = []
+        self.events: list[dict[str, Any]] = []
+        # Open spans by callback key, to close them from the matching after callback
+        self._open: dict[Any, Span] = {}
+        self.root = self.start_span("turn", "turn", None, prompt_chars=len(prompt))
+
+    def now(self) -> float:
+        return time.perf_counter() - self._t0
+
+    def start_span(self, name: str, kind: str, parent: Optional[Span], key: Any = None, **attributes) -> Span:
+        span = Span(uuid.uuid4().hex[:16], parent.span_id if parent else None, name, kind, self.now(), attributes=attributes)
+        self.spans.append(span)
+        if key is not None:
+            self._open[key] = span
+        return span
+
+    def end_span(self, key: Any, **attributes) -> Optional[Span]:
+        span = self._open.pop(key, None)
+        if span is not None:
+            span.end = self.now()
+            span.attributes.update(attributes)
+        return span
+
+    def open_span(self, key: Any) -> Optional[Span]:
+        return self._open.get(key)
+
+    @contextmanager
+    def span(self, name: str, kind: str, **attributes) -> Iterator[Span]:
+        span = self.start_span(name, kind, self.root, **attributes)
+        try:
+            yield span
+        finally:
+            span.end = self.now()
+
+    def record_event(self, event: Event) -> None:
+        """Records the arrival time of an event yielded by the runner."""
+        if event.partial:
+            kind = "partial"
+        elif event.get_function_calls():
+            kind = "function_call"
+        elif event.get_function_responses():
+            kind = "function_response"
+        elif event.is_final_response():
+            kind = "final"
+        else:
+            kind = "other"
+        self.events.append({"t": self.now(), "author": event.author, "kind": kind})
+        if kind in ("partial", "final") and "first_text_s" not in self.root.attributes:
+            self.root.attributes["first_text_s"] = self.now()
+
+    def finish(self, **attributes) -> None:
+        self.root.end = self.now()
+        self.root.attributes.update(attributes)
+        # Spans left open by errors or cancellation end with the turn
+        for key in list(self._open):
+            self.end_span(key, unfinished=True)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "session_id": self.session_id,
+            "started_at": self.started_at,
+            "spans": [asdict(span) for span in self.spans],
+            "events": self.events,
+        }
+
+
+def current_trace() -> Optional[TurnTrace]:
+    return _current_trace.get()
+
+
+# Last trace of each session, for the latency breakdown panel of the UI
+_last_traces: OrderedDict[str, TurnTrace] = OrderedDict()
+_last_traces_lock = threading.Lock()
+_MAX_LAST_TRACES = 1024
+
+_exporter: Optional[logging.Logger] = None
+_exporter_lock = threading.Lock()
+
+
+def _get_exporter() -> logging.Logger:
+    # A dedicated logger with a rotating file handler writes one JSON line per record
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            directory = os.path.dirname(TRACE_FILE_PATH)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            handler = RotatingFileHandler(TRACE_FILE_PATH, maxBytes=TRACE_FILE_MAX_BYTES, backupCount=TRACE_FILE_BACKUPS, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            _exporter = logging.getLogger("adk.tracing.exporter")
+            _exporter.setLevel(logging.INFO)
+            _exporter.propagate = False
+            _exporter.addHandler(handler)
+        return _exporter
+
+
+def export(record: dict[str, Any]) -> None:
+    if TRACING_ENABLED:
+        _get_exporter().info(json.dumps(record, default=str))
+
+
+@contextmanager
+def trace_turn(session_id: str, prompt: str) -> Iterator[TurnTrace]:
+    """Traces a turn: the spans recorded while the block runs are added to the returned trace."""
+    trace = TurnTrace(session_id, prompt)
+    token = _current_trace.set(trace)
+    status = "ok"
+    try:
+        yield trace
+    except BaseException as e:
+        status = type(e).__name__
+        raise
+    finally:
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            # An async generator closed from another task runs this in a different context
+            pass
+        trace.finish(status=status)
+        with _last_traces_lock:
+            _last_traces[session_id] = trace
+            _last_traces.move_to_end(session_id)
+            while len(_last_traces) > _MAX_LAST_TRACES:
+                _last_traces.popitem(last=False)
+        export(trace.to_dict())
+
+
+def get_last_trace(session_id: str) -> Optional[TurnTrace]:
+    with _last_traces_lock:
+        return _last_traces.get(session_id)
+
+
+def _usage(usage: Optional[types.GenerateContentResponseUsageMetadata]) -> dict[str, Any]:
+    if usage is None:
+        return {}
+    return {
+        "prompt_tokens": usage.prompt_token_count,
+        "output_tokens": usage.candidates_token_count,
+        "total_tokens": usage.total_token_count,
+    }
+
+
+class TracingPlugin(BasePlugin):
+    """Adds agent, model and tool spans to the trace of the current turn."""
+
+    def __init__(self, name: str = "tracing"):
+        super().__init__(name=name)
+
+    @staticmethod
+    def _agent_parent(trace: TurnTrace, agent_name: str) -> Span:
+        # A sub-agent run by AgentTool is a child of the open tool span named after it
+        for span in reversed(trace.spans):
+            if span.kind == "tool" and span.name == agent_name and span.end is None:
+                return span
+        return trace.root
+
+    async def before_agent_callback(self, *, agent: BaseAgent, callback_context: CallbackContext) -> None:
+        if trace := current_trace():
+            parent = self._agent_parent(trace, agent.name)
+            trace.start_span(agent.name, "agent", parent, key=("agent", callback_context.invocation_id, agent.name))
+
+    async def after_agent_callback(self, *, agent: BaseAgent, callback_context: CallbackContext) -> None:
+        if trace := current_trace():
+            trace.end_span(("agent", callback_context.invocation_id, agent.name))
+
+    async def before_model_callback(self, *, callback_context: CallbackContext, llm_request: LlmRequest) -> None:
+        if trace := current_trace():
+            parent = trace.open_span(("agent", callback_context.invocation_id, callback_context.agent_name)) or trace.root
+            trace.start_span(f"{callback_context.agent_name} model call", "model", parent, key=("model", callback_context.invocation_id, callback_context.agent_name), model=llm_request.model)
+
+    async def after_model_callback(self, *, callback_context: CallbackContext, llm_response: LlmResponse) -> None:
+        if trace := current_trace():
+            key = ("model", callback_context.invocation_id, callback_context.agent_name)
+            if llm_response.partial:
+                # Streamed chunk, the call ends with the aggregated response
+                span = trace.open_span(key)
+                if span is not None and "first_chunk_s" not in span.attributes:
+                    span.attributes["first_chunk_s"] = trace.now() - span.start
+                return None
+            trace.end_span(key, **_usage(llm_response.usage_metadata))
+
+    async def on_model_error_callback(self, *, callback_context: CallbackContext, llm_request: LlmRequest, error: Exception) -> None:
+        if trace := current_trace():
+            trace.end_span(("model", callback_context.invocation_id, callback_context.agent_name), error=f"{type(error).__name__}: {error}")
+
+    async def before_tool_callback(self, *, tool: BaseTool, tool_args: dict[str, Any], tool_context: ToolContext) -> None:
+        if trace := current_trace():
+            parent = trace.open_span(("agent", tool_context.invocation_id, tool_context.agent_name)) or trace.root
+            trace.start_span(tool.name, "tool", parent, key=("tool", tool_context.function_call_id))
+
+    async def after_tool_callback(self, *, tool: BaseTool, tool_args: dict[str, Any], tool_context: ToolContext, result: dict) -> None:
+        if trace := current_trace():
+            trace.end_span(("tool", tool_context.function_call_id))
+
+    async def on_tool_error_callback(self, *, tool: BaseTool, tool_args: dict[str, Any], tool_context: ToolContext, error: Exception) -> None:
+        if trace := current_trace():
+            trace.end_span(("tool", tool_context.function_call_id), error=f"{type(error).__name__}: {error}")
+
+
+class TracedEventsSummarizer(BaseEventsSummarizer):
+    """Events summarizer that records the compaction runs in the trace of the turn that started them."""
+
+    def __init__(self, inner: BaseEventsSummarizer):
+        self.inner = inner
+
+    async def maybe_summarize_events(self, *, events: list[Event]) -> Optional[Event]:
+        trace = current_trace()
+        if trace is None:
+            return await self.inner.maybe_summarize_events(events=events)
+        # Compaction runs in the background after the turn, so its span is exported on its own
+        span = trace.start_span("compaction", "compaction", trace.root, events=len(events))
+        try:
+            return await self.inner.maybe_summarize_events(events=events)
+        finally:
+            span.end = trace.now()
+            export({"trace_id": trace.trace_id, "session_id": trace.session_id, "spans": [asdict(span)]})
@@ -0,0 +1,171 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Optional
+
+from sqlalchemy import and_, or_, select, text
+from sqlalchemy.orm import Session as DatabaseSession
+
+from google.genai import types
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, DatabaseSessionService
+from google.adk.sessions.database_session_service import StorageEvent, StorageSession
+
+from adk import metrics
+from adk.persistence import TurnBufferedSessionService
+from adk.session_cache import CachingSessionService
+from config.settings import TRANSCRIPT_CACHE_MAX_PAGES
+
+# Rebuilds the chat transcript shown in the UI from the events of the persisted ADK session,
+# newest messages first, one page at a time. With a database session service only the user
+# messages and the final text responses of the agent are read, with a SQL projection that skips
+# the tool calls, the compaction events and the pickled event actions.
+
+# Position of a message in the session: (event timestamp, event id), pages go backwards from it
+Cursor = tuple[float, str]
+
+_cache_hits = metrics.counter("transcript.cache_hits", "Transcript pages served from the cache")
+_load_seconds = metrics.histogram("transcript.load_seconds", "Latency of the transcript pages read from the session service")
+
+# Text parts that aren't thoughts, in content that has no function calls or responses: the events
+# that are chat messages (also kept by the pruning of adk/maintenance.py)
+TEXT_EVENTS_FILTER = text(
+    "EXISTS (SELECT 1 FROM json_each(events.content, '$.parts') AS part"
+    " WHERE json_type(part.value, '$.text') = 'text' AND NOT coalesce(json_extract(part.value, '$.thought'), 0))"
+    " AND NOT EXISTS (SELECT 1 FROM json_each(events.content, '$.parts') AS part"
+    " WHERE json_type(part.value, '$.function_call') IS NOT NULL OR json_type(part.value, '$.function_response') IS NOT NULL)"
+)
+
+
+@dataclass
+class TranscriptPage:
+    messages: list[dict[str, str]] = field(default_factory=list)  # Oldest first, as st.session_state.messages
+    before: Optional[Cursor] = None  # Cursor of the previous page, None if this page starts the session
+
+
+def _message(author: str, content: types.Content) -> Optional[dict[str, str]]:
+    if any(part.function_call or part.function_response for part in content.parts or []):
+        return None
+    message = "".join(part.text for part in content.parts or [] if part.text and part.text != "None" and not part.thought)
+    if not message:
+        return None
+    return {"role": "user" if author == "user" else "assistant", "content": message}
+
+
+def _page(rows: list[tuple[str, str, float, types.Content]], limit: int) -> TranscriptPage:
+    # rows are (event id, author, timestamp, content), newest first, with one extra row if there are more
+    page = TranscriptPage()
+    for event_id, author, timestamp, content in rows[:limit]:
+        if message := _message(author, content):
+            page.messages.append(message)
+            page.before = (timestamp, event_id)
+    if len(rows) <= limit:
+        page.before = None
+    page.messages.reverse()
+    return page
+
+
+def _events_page(events: list[Event], limit: int, before: Optional[Cursor]) -> TranscriptPage:
+    rows = [
+        (event.id, event.author, event.timestamp, event.content)
+        for event in sorted(events, key=lambda event: (event.timestamp, event.id), reverse=True)
+        if event.content and not event.partial and (before is None or (event.timestamp, event.id) < before)
+        and _message(event.author, event.content)
+    ]
+    return _page(rows[:limit + 1], limit)
+
+
+# Pages by (app name, user id, session id, limit, cursor), with the update time of the session they were read at
+_pages: OrderedDict[tuple, tuple[Any, TranscriptPage]] = OrderedDict()
+_pages_lock = threading.Lock()
+
+
+def _cached(key: tuple, update_time: Any) -> Optional[TranscriptPage]:
+    with _pages_lock:
+        entry = _pages.get(key)
+        if entry is None or entry[0] != update_time:
+            return None
+        _pages.move_to_end(key)
+    _cache_hits.inc()
+    return entry[1]
+
+
+def _store(key: tuple, update_time: Any, page: TranscriptPage) -> None:
+    with _pages_lock:
+        _pages[key] = (update_time, page)
+        _pages.move_to_end(key)
+        while len(_pages) > TRANSCRIPT_CACHE_MAX_PAGES:
+            _pages.popitem(last=False)
+
+
+def _query_page(service: DatabaseSessionService, key: tuple, limit: int, before: Optional[Cursor]) -> TranscriptPage:
+    app_name, user_id, session_id = key[:3]
+    with DatabaseSession(service.db_engine) as db:
+        # The cached page is valid while the update time of the session doesn't change
+        update_time = db.execute(
+            select(StorageSession.update_time).where(StorageSession.app_name == app_name, StorageSession.user_id == user_id, StorageSession.id == session_id)
+        ).scalar()
+        if update_time is None:
+            return TranscriptPage()
+        if (page := _cached(key, update_time)) is not None:
+            return page
+        query = select(StorageEvent.id, StorageEvent.author, StorageEvent.timestamp, StorageEvent.content).where(
+            StorageEvent.app_name == app_name,
+            StorageEvent.user_id == user_id,
+            StorageEvent.session_id == session_id,
+            StorageEvent.content.is_not(None),
+            StorageEvent.partial.is_not(True),
+            TEXT_EVENTS_FILTER,
+        )
+        if before is not None:
+            # Keyset pagination on the (timestamp, id) order of the session events index
+            before_time = datetime.fromtimestamp(before[0])
+            query = query.where(or_(StorageEvent.timestamp < before_time, and_(StorageEvent.timestamp == before_time, StorageEvent.id < before[1])))
+        query = query.order_by(StorageEvent.timestamp.desc(), StorageEvent.id.desc()).limit(limit + 1)
+        rows = [(row.id, row.author, row.timestamp.timestamp(), types.Content.model_validate(row.content)) for row in db.execute(query)]
+    page = _page(rows, limit)
+    _store(key, update_time, page)
+    return page
+
+
+async def load_transcript(session_service: BaseSessionService, app_name: str, user_id: str, session_id: str, limit: int, before: Optional[Cursor] = None) -> TranscriptPage:
+    """Returns the last `limit` chat messages of a session before the `before` cursor.
+
+    Pages are cached by the update time of the session, so reloading an unchanged
+    conversation is served from memory.
+    """
+    key = (app_name, user_id, session_id, limit, before)
+    start = time.perf_counter()
+    # The turn buffer keeps no events between turns, the services behind it have them all
+    if isinstance(session_service, TurnBufferedSessionService):
+        session_service = session_service.inner
+    # A session cached in memory has its events already decoded
+    if isinstance(session_service, CachingSessionService):
+        session = session_service.peek(app_name, user_id, session_id)
+        if session is not None:
+            page = _cached(key, session.last_update_time)
+            if page is None:
+                page = _events_page(session.events, limit, before)
+                _store(key, session.last_update_time, page)
+            return page
+        session_service = session_service.inner
+
+    if isinstance(session_service, DatabaseSessionService) and session_service.db_engine.dialect.name == "sqlite":
+        run_sync = getattr(session_service, "run_sync", None) or asyncio.to_thread
+        page = await run_sync(_query_page, session_service, key, limit, before)
+        _load_seconds.observe(time.perf_counter() - start)
+        return page
+
+    # Other session services load the whole session
+    session = await session_service.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+    if session is None:
+        return TranscriptPage()
+    page = _cached(key, session.last_update_time)
+    if page is None:
+        page = _events_page(session.events, limit, before)
+        _store(key, session.last_update_time, page)
+        _load_seconds.observe(time.perf_counter() - start)
+    return page
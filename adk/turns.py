@@ -0,0 +1,98 @@
+import asyncio
+import time
+from typing import AsyncIterator, Callable, Optional
+
+from adk import metrics
+from config.settings import TURN_CANCEL_SUPERSEDED, TURN_COALESCE_WINDOW_S
+
+# Per-session turn coordinator. Each turn runs in its own task and its text deltas are kept, so the
+# callers that asked for it (subscribers) can come and go: a Streamlit rerun or a dropped HTTP
+# connection stops following the turn but doesn't cancel it.
+#
+# - A prompt identical to the turn of its session in flight (a double submit, or a rerun of the
+#   script while the turn runs) attaches to that turn, replaying the deltas so far, instead of
+#   running the agents again. Finished turns are replayed for TURN_COALESCE_WINDOW_S.
+# - A different prompt cancels the turn in flight (TURN_CANCEL_SUPERSEDED), the cancellation
+#   goes through the runner, the sub-agents and the model calls waiting or in progress.
+# - Only one turn writes to a session at a time: the turn body holds the session lock of
+#   adk/compaction.py (session_turn), so a new turn starts once the superseded one has unwound.
+
+_started = metrics.counter("turns.started", "Turns started by the turn coordinator")
+_coalesced = metrics.counter("turns.coalesced", "Prompts attached to an identical turn of their session instead of starting one")
+_superseded = metrics.counter("turns.superseded", "Turns cancelled by a newer prompt of their session")
+
+
+class TurnSuperseded(Exception):
+    """Raised to the subscribers of a turn cancelled by a newer prompt of its session."""
+
+
+class _Turn:
+    def __init__(self, prompt: str):
+        self.prompt = prompt
+        self.deltas: list[str] = []
+        self.error: Optional[BaseException] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self) -> None:
+        # Wakes up the subscribers waiting for this change, the next ones wait for a new event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def produce(self, run: Callable[[], AsyncIterator[str]]) -> None:
+        try:
+            async for text in run():
+                self.deltas.append(text)
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = TurnSuperseded("The turn was cancelled by a newer prompt of the session")
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished_at = time.monotonic()
+            self._notify()
+
+    async def follow(self) -> AsyncIterator[str]:
+        index = 0
+        while True:
+            changed = self._changed
+            while index < len(self.deltas):
+                yield self.deltas[index]
+                index += 1
+            if self.finished_at is not None:
+                break
+            await changed.wait()
+        if self.error is not None:
+            raise self.error
+
+
+# Last turn of each session, in flight or finished within the coalescing window
+_turns: dict[str, _Turn] = {}
+
+
+def _forget(session_id: str, turn: _Turn) -> None:
+    if _turns.get(session_id) is turn:
+        del _turns[session_id]
+
+
+async def coordinate_turn(session_id: str, prompt: str, run: Callable[[], AsyncIterator[str]], cancel_superseded: bool = TURN_CANCEL_SUPERSEDED) -> AsyncIterator[str]:
+    """Yields the text deltas of the turn of a session for a prompt, run by `run` at most once.
+
+    Must run on the event loop of the turns (the shared loop, or the API server loop).
+    """
+    prompt = prompt.strip()
+    turn = _turns.get(session_id)
+    if turn is not None and turn.prompt == prompt and turn.error is None:
+        _coalesced.inc()
+    else:
+        if turn is not None and turn.finished_at is None and cancel_superseded:
+            turn.task.cancel()
+            _superseded.inc()
+        turn = _turns[session_id] = _Turn(prompt)
+        turn.task = asyncio.create_task(turn.produce(run))
+        turn.task.add_done_callback(lambda _: asyncio.get_running_loop().call_later(TURN_COALESCE_WINDOW_S, _forget, session_id, turn))
+        _started.inc()
+    async for text in turn.follow():
+        yield text
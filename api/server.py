@@ -0,0 +1,149 @@
+"""
+Headless HTTP/SSE entry point of the agent, alongside the Streamlit UI.
+
+Serves the same agent graph (create_runner) and turn logic (run_at_session) as the UI:
+
+- POST /sessions/{session_id}/turns   runs a turn, streaming the response as server-sent events:
+                                      "delta" events with the text as it is generated, then a
+                                      "done" event with the whole response, or an "error" event
+- GET  /sessions/{session_id}/messages  pages of the chat transcript of the session, newest last
+- GET  /metrics                        snapshot of the process metrics
+- GET  /metrics/sessions               estimated memory of the sessions cached by the process, largest first
+- GET  /healthz
+
+Requests need an "Authorization: Bearer <AGENT_API_TOKEN>" header when AGENT_API_TOKEN is set.
+The API binds AGENT_API_HOST, the loopback by default, and refuses to listen on other hosts
+without a token: session ids are emails, anyone reaching it could read and run any user's chat.
+
+Usage: python -m api.server, or uvicorn api.server:app --workers 4
+"""
+import hmac
+import ipaddress
+import json
+import os
+import sys
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from typing import AsyncIterator, Optional
+
+import uvicorn
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ConfigDict
+
+from adk import metrics
+from adk.init_adk import create_runner, run_at_session
+from adk.resources import sample, session_memory
+from adk.startup import get_google_api_key, log_report, step, warm_up
+from adk.transcript import load_transcript
+from config.settings import (
+    AGENT_API_HOST,
+    AGENT_API_PORT,
+    AGENT_API_SESSION_CACHE,
+    AGENT_API_TOKEN,
+    AGENT_API_WORKERS,
+    STREAMING_ENABLED,
+    USER_ID,
+)
+
+
+class UserProfile(BaseModel):
+    """Profile of the user, written to the session state. Other keys are rejected, they could
+    overwrite any state, including the app: and user: state shared with other sessions."""
+
+    model_config = ConfigDict(extra="forbid")
+
+    user_email: Optional[str] = None
+    user_full_name: Optional[str] = None
+    user_locale: Optional[str] = None
+
+
+class TurnRequest(BaseModel):
+    prompt: str
+    user_profile: Optional[UserProfile] = None
+    streaming: bool = STREAMING_ENABLED
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if "GOOGLE_API_KEY" not in os.environ:
+        # Same secret as the Streamlit app (.streamlit/secrets.toml)
+        get_google_api_key()
+    # Each worker process builds its own runner, sharing the session database with the others,
+    # and opens its connections before it accepts requests
+    with step("create_runner"):
+        app.state.runner = create_runner(use_session_cache=AGENT_API_SESSION_CACHE)
+    await warm_up(app.state.runner)
+    log_report()
+    yield
+
+
+app = FastAPI(title="Personal restaurant recommender agent", lifespan=lifespan)
+
+
+def check_token(authorization: Optional[str] = Header(default=None)) -> None:
+    if AGENT_API_TOKEN and not hmac.compare_digest(authorization or "", f"Bearer {AGENT_API_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid or missing API token")
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/sessions/{session_id}/turns", dependencies=[Depends(check_token)])
+async def run_turn(session_id: str, turn: TurnRequest, request: Request) -> StreamingResponse:
+    runner = request.app.state.runner
+
+    user_profile = turn.user_profile.model_dump(exclude_unset=True) if turn.user_profile is not None else None
+
+    async def events() -> AsyncIterator[str]:
+        response = ""
+        try:
+            async for delta in run_at_session(runner, turn.prompt, session_id, user_profile, streaming=turn.streaming):
+                response += delta
+                yield _sse("delta", {"text": delta})
+        except Exception as e:
+            # The status line is already sent, so errors are reported in the stream
+            yield _sse("error", {"message": f"{type(e).__name__}: {e}"})
+            return
+        yield _sse("done", {"text": response})
+
+    # No buffering by reverse proxies, so the deltas reach the client as they are generated
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/sessions/{session_id}/messages", dependencies=[Depends(check_token)])
+async def get_messages(session_id: str, request: Request, limit: int = 20, before_ts: Optional[float] = None, before_id: Optional[str] = None) -> dict:
+    runner = request.app.state.runner
+    before = (before_ts, before_id) if before_ts is not None and before_id is not None else None
+    page = await load_transcript(runner.session_service, runner.app_name, USER_ID, session_id, limit, before)
+    return {"messages": page.messages, "before": page.before}
+
+
+@app.get("/metrics", dependencies=[Depends(check_token)])
+async def get_metrics() -> dict:
+    sample()
+    return metrics.snapshot()
+
+
+@app.get("/metrics/sessions", dependencies=[Depends(check_token)])
+async def get_session_memory(request: Request, limit: int = 50) -> list[dict]:
+    return [{**asdict(memory), "total_bytes": memory.total_bytes} for memory in session_memory(request.app.state.runner.session_service)[:limit]]
+
+
+@app.get("/healthz")
+async def healthz() -> dict:
+    return {"status": "ok"}
+
+
+def is_loopback(host: str) -> bool:
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == "localhost"
+
+
+if __name__ == "__main__":
+    if not AGENT_API_TOKEN and not is_loopback(AGENT_API_HOST):
+        sys.exit(f"Refusing to serve the API on {AGENT_API_HOST} without AGENT_API_TOKEN, set it or bind 127.0.0.1")
+    uvicorn.run("api.server:app", host=AGENT_API_HOST, port=AGENT_API_PORT, workers=AGENT_API_WORKERS)
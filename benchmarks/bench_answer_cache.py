@@ -0,0 +1,84 @@
+"""
+Hits, misses and lookup latency of the answer cache (adk/answer_cache.py).
+
+Caches the answers of a few prompts and looks up paraphrases of them, which must hit, and
+prompts with another cuisine, place, price, day or a negation, which must miss (a hit would
+answer them with the answer of another question). Then fills the cache with synthetic prompts
+and reports the latency of the lookups at that size.
+
+Exits with status 1 when a paraphrase misses or a different question hits.
+
+Usage: python -m benchmarks.bench_answer_cache [--entries 2048] [--lookups 5000]
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+
+from adk.answer_cache import AnswerCache
+from config.settings import ANSWER_CACHE_THRESHOLD
+
+CACHED = [
+    "cheap sushi near Sol",
+    "best restaurants in central Madrid open late",
+    "which restaurants are open on Sunday in Malasaña",
+    "pizza places with gluten free options",
+]
+# Prompt looked up, and the cached prompt it must be answered with (None for a miss)
+LOOKUPS = [
+    ("affordable sushi around Puerta del Sol", "cheap sushi near Sol"),
+    ("cheap sushi restaurants near Sol", "cheap sushi near Sol"),
+    ("top restaurants in central Madrid open late", "best restaurants in central Madrid open late"),
+    ("which restaurants open on Sundays in Malasaña", "which restaurants are open on Sunday in Malasaña"),
+    ("pizza places with gluten-free options", "pizza places with gluten free options"),
+    ("cheap ramen near Sol", None),
+    ("expensive sushi near Sol", None),
+    ("cheap vegan sushi near Sol", None),
+    ("cheap sushi near Chueca", None),
+    ("best restaurants in central Barcelona open late", None),
+    ("which restaurants are open on Monday in Malasaña", None),
+    ("pizza places without gluten free options", None),
+]
+WORDS = "cheap best vegan sushi ramen tapas pizza italian japanese open late sunday near sol chueca malasaña retiro madrid terrace view".split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=2048, help="Prompts cached for the latency run")
+    parser.add_argument("--lookups", type=int, default=5000, help="Lookups of the latency run")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    cache = AnswerCache(ttl_s=3600, max_entries=args.entries, threshold=ANSWER_CACHE_THRESHOLD)
+    for prompt in CACHED:
+        cache.put(prompt, "en", prompt)
+    wrong = 0
+    print(f"{'prompt':<52}{'expected':>10}{'result':>8}{'similarity':>12}")
+    for prompt, expected in LOOKUPS:
+        cached = cache.get(prompt, "en")
+        result = cached.answer if cached is not None else None
+        wrong += result != expected
+        print(f"{prompt:<52}{'hit' if expected else 'miss':>10}{'hit' if result else 'miss':>8}{cached.similarity if cached else 0:>12.3f}"
+              + ("" if result == expected else "  WRONG"))
+
+    for i in range(args.entries):
+        cache.put(" ".join(rng.sample(WORDS, rng.randint(3, 6))) + f" {i}", "en", str(i))
+    latencies = []
+    for _ in range(args.lookups):
+        prompt = " ".join(rng.sample(WORDS, rng.randint(3, 6)))
+        start = time.perf_counter()
+        cache.get(prompt, "en")
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print(f"lookups:          {len(latencies)} over {args.entries} entries")
+    print(f"latency:          mean {statistics.mean(latencies) * 1e3:.3f} ms, p50 {latencies[len(latencies) // 2] * 1e3:.3f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1e3:.3f} ms")
+    if wrong:
+        print(f"{wrong} wrong lookups")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
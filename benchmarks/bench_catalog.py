@@ -0,0 +1,84 @@
+"""
+Query latency of the local restaurant catalog (adk/catalog.py).
+
+Generates a synthetic catalog of restaurants around the center of Madrid, writes it as CSV (the
+format of RESTAURANT_CATALOG_PATH), loads it and runs a mix of filter-and-rank queries like the
+ones of the root agent: by cuisine, price, rating, neighborhood and distance to a place. Reports
+the load time and the latency percentiles of the queries, which should be well under a
+millisecond, against the seconds of a search_agent round trip.
+
+Usage: python -m benchmarks.bench_catalog [--restaurants 50000] [--queries 10000]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from adk.catalog import RestaurantCatalog
+
+CENTER = (40.4168, -3.7038)  # Puerta del Sol
+CUISINES = ["spanish", "tapas", "japanese", "italian", "mexican", "chinese", "indian", "peruvian", "vegan", "seafood", "burgers", "korean"]
+NEIGHBORHOODS = ["Sol", "Malasaña", "Chueca", "La Latina", "Lavapiés", "Salamanca", "Chamberí", "Retiro", "Arganzuela", "Tetuán"]
+
+
+def write_catalog(path: str, size: int, rng: random.Random) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("name,cuisine,price,rating,latitude,longitude,neighborhood,address\n")
+        for i in range(size):
+            cuisines = ";".join(rng.sample(CUISINES, rng.choice((1, 1, 2))))
+            f.write(
+                f"Restaurant {i},{cuisines},{rng.randint(1, 4)},{rng.uniform(2.5, 5.0):.1f},"
+                f"{CENTER[0] + rng.gauss(0, 0.03):.6f},{CENTER[1] + rng.gauss(0, 0.04):.6f},"
+                f"{rng.choice(NEIGHBORHOODS)},Calle {i % 500} {i % 97}\n"
+            )
+
+
+def random_query(rng: random.Random) -> dict:
+    query = {}
+    if rng.random() < 0.8:
+        query["cuisine"] = rng.choice(CUISINES)
+    if rng.random() < 0.5:
+        query["max_price"] = rng.randint(1, 4)
+    if rng.random() < 0.5:
+        query["min_rating"] = rng.choice((3.5, 4.0, 4.5))
+    if rng.random() < 0.3:
+        query["neighborhood"] = rng.choice(NEIGHBORHOODS)
+    elif rng.random() < 0.8:
+        query["latitude"] = CENTER[0] + rng.gauss(0, 0.02)
+        query["longitude"] = CENTER[1] + rng.gauss(0, 0.02)
+        query["radius_km"] = rng.choice((0.5, 1.0, 2.0))
+    return query
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--restaurants", type=int, default=50_000, help="Restaurants in the generated catalog")
+    parser.add_argument("--queries", type=int, default=10_000, help="Queries to run")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "catalog.csv")
+        write_catalog(path, args.restaurants, rng)
+        start = time.perf_counter()
+        catalog = RestaurantCatalog.load(path)
+        load_s = time.perf_counter() - start
+
+    queries = [random_query(rng) for _ in range(args.queries)]
+    latencies, results = [], 0
+    for query in queries:
+        start = time.perf_counter()
+        results += bool(catalog.search(**query))
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print(f"catalog:          {len(catalog)} restaurants, loaded in {load_s:.2f} s")
+    print(f"queries:          {len(latencies)} ({results / len(latencies):.0%} with results)")
+    print(f"latency:          mean {statistics.mean(latencies) * 1e3:.3f} ms, p50 {latencies[len(latencies) // 2] * 1e3:.3f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1e3:.3f} ms, max {latencies[-1] * 1e3:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Turn latency of personalized questions with sequential and parallel tool calls.
+
+Questions like "recommend me a restaurant near my office" need the user's profile and a search.
+Called one after the other, the turn pays a root model call per tool plus the latency of each
+tool. Called in the same model response (PARALLEL_TOOL_CALLS), ADK runs them concurrently and
+the turn pays for the slowest one.
+
+Runs the same prompts with MockGemini models that make the tool calls of a turn one per
+response (sequential) or all in the first response (parallel), with the given latency per
+model call, and reports the turn latency and model calls of each.
+
+The mock is told which of the two to do, it doesn't read the instruction. So the result is
+the ceiling of the saving, for a model that always batches the calls, not a measurement of
+how well PARALLEL_TOOLS_RULES gets a real model to batch them.
+
+Usage: python -m benchmarks.bench_parallel_tools [--repeat 5] [--latency 0.5] [--user-info-mode agent_tool]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from google.adk.sessions import InMemorySessionService
+
+from adk.init_adk import USER_INFO_RULES, create_runner, run_at_session
+from adk.scheduler import configure_scheduler
+from adk.search_cache import configure_search_cache
+from benchmarks.mock_gemini import MockGemini
+
+PROMPTS = [
+    "Recommend me a restaurant near my office",
+    "Best ramen near my home for me and my family",
+    "Book me the best tapas restaurant for my birthday",
+]
+USER_PROFILE = {"user_email": "bob@smith.com", "user_full_name": "Bob Smith"}
+
+
+async def bench(sequential: bool, user_info_mode: str, repeat: int, latency: float) -> tuple[list[float], int]:
+    models: list[MockGemini] = []
+
+    def model_factory() -> MockGemini:
+        models.append(MockGemini(latency_s=latency, latency_jitter_s=0, sequential_tool_calls=sequential))
+        return models[-1]
+
+    runner = create_runner(
+        user_info_mode=user_info_mode,
+        use_session_cache=False,
+        session_service=InMemorySessionService(),
+        model_factory=model_factory,
+        parallel_tool_calls=not sequential,
+    )
+    latencies = []
+    for i in range(repeat):
+        for prompt in PROMPTS:
+            start = time.perf_counter()
+            async for _ in run_at_session(runner, prompt, f"{'sequential' if sequential else 'parallel'}_{i}", USER_PROFILE, streaming=False):
+                pass
+            latencies.append(time.perf_counter() - start)
+    return latencies, sum(model.calls for model in models)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="Times each prompt is run per mode")
+    parser.add_argument("--latency", type=float, default=0.5, help="Latency of each mock model call in seconds")
+    parser.add_argument("--user-info-mode", default="agent_tool", choices=[mode for mode in USER_INFO_RULES if mode != "session_state"])
+    args = parser.parse_args()
+    # Every turn runs the tools, instead of reusing the search results of the previous repeats
+    configure_search_cache(ttl_s=0, disk_path=None)
+    configure_scheduler()
+
+    results = {}
+    print(f"{'tool calls':<12}{'turns':>7}{'calls/turn':>12}{'mean s':>9}{'p50 s':>8}{'max s':>8}")
+    for sequential in (True, False):
+        latencies, calls = asyncio.run(bench(sequential, args.user_info_mode, args.repeat, args.latency))
+        name = "sequential" if sequential else "parallel"
+        results[name] = statistics.mean(latencies)
+        print(f"{name:<12}{len(latencies):>7}{calls / len(latencies):>12.1f}{results[name]:>9.2f}{statistics.median(latencies):>8.2f}{max(latencies):>8.2f}")
+    print(f"Parallel tool calls cut the mean turn latency by up to {1 - results['parallel'] / results['sequential']:.0%} (all calls batched by the mock model)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Session store benchmark: append/get throughput of the session backends at 1, 8 and 64
+concurrent sessions.
+
+Usage: python -m benchmarks.bench_session_store [--events 50] [--concurrency 1 8 64]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from google.genai import types
+from google.adk.events import Event, EventActions
+
+from adk.session_store import create_session_service
+
+APP_NAME = "bench_app"
+USER_ID = "bench_user"
+
+
+def make_event(i: int) -> Event:
+    author = "user" if i % 2 == 0 else "root_agent"
+    content = types.Content(role="user" if author == "user" else "model", parts=[types.Part(text=f"message {i} " + "lorem ipsum " * 20)])
+    return Event(author=author, invocation_id=f"inv_{i // 2}", content=content, actions=EventActions(state_delta={"turn": i // 2}))
+
+
+async def append_events(session_service, session, num_events: int) -> None:
+    for i in range(num_events):
+        await session_service.append_event(session, make_event(i))
+
+
+async def get_sessions(session_service, session_id: str, num_gets: int) -> None:
+    for _ in range(num_gets):
+        await session_service.get_session(app_name=APP_NAME, user_id=USER_ID, session_id=session_id)
+
+
+async def bench(backend: str, concurrency: int, num_events: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        session_service = create_session_service(backend, db_path)
+        sessions = [await session_service.create_session(app_name=APP_NAME, user_id=USER_ID, session_id=f"session_{i}") for i in range(concurrency)]
+        # Each phase is timed on its own, all the sessions running it concurrently
+        start = time.perf_counter()
+        await asyncio.gather(*(append_events(session_service, session, num_events) for session in sessions))
+        append_time = time.perf_counter() - start
+        start = time.perf_counter()
+        await asyncio.gather(*(get_sessions(session_service, session.id, num_events // 5) for session in sessions))
+        get_time = time.perf_counter() - start
+        if hasattr(session_service, "db_engine"):
+            session_service.db_engine.dispose()
+    return {
+        "backend": backend,
+        "sessions": concurrency,
+        "appends_per_s": concurrency * num_events / append_time,
+        "gets_per_s": concurrency * (num_events // 5) / get_time,
+        "elapsed_s": append_time + get_time,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=50, help="Events appended per session")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 64], help="Numbers of concurrent sessions")
+    parser.add_argument("--backends", nargs="+", default=["sqlite", "sqlite_pooled"])
+    args = parser.parse_args()
+
+    print(f"{'backend':<15}{'sessions':>10}{'appends/s':>12}{'gets/s':>10}{'elapsed s':>11}")
+    for backend in args.backends:
+        for concurrency in args.concurrency:
+            result = asyncio.run(bench(backend, concurrency, args.events))
+            print(f"{result['backend']:<15}{result['sessions']:>10}{result['appends_per_s']:>12.1f}{result['gets_per_s']:>10.1f}{result['elapsed_s']:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Latency comparison of the USER_INFO_MODE options for profile questions.
+
+Runs the same profile prompts through runners built with each user info mode and
+reports the turn latency. Calls the Gemini API, so GOOGLE_API_KEY must be set, unless
+--mock is given to use MockGemini models with the given latency per model call.
+
+Usage: python -m benchmarks.bench_user_info_modes [--repeat 5] [--mock 0.5]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from google.adk.sessions import InMemorySessionService
+
+from adk.init_adk import USER_INFO_RULES, create_gemini_model, create_runner, run_at_session
+from benchmarks.mock_gemini import mock_model_factory
+
+PROMPTS = ["Hello!", "What is my email address?", "What is my full name?"]
+USER_PROFILE = {"user_email": "bob@smith.com", "user_full_name": "Bob Smith"}
+
+
+async def bench(user_info_mode: str, repeat: int, model_factory) -> list[float]:
+    runner = create_runner(user_info_mode=user_info_mode, use_session_cache=False, session_service=InMemorySessionService(), model_factory=model_factory)
+    latencies = []
+    for i in range(repeat):
+        for prompt in PROMPTS:
+            start = time.perf_counter()
+            response = "".join([text async for text in run_at_session(runner, prompt, f"{user_info_mode}_{i}", USER_PROFILE, streaming=False)])
+            latencies.append(time.perf_counter() - start)
+            if model_factory is create_gemini_model and USER_PROFILE["user_email"] not in response and USER_PROFILE["user_full_name"] not in response:
+                print(f"  [{user_info_mode}] profile missing in the answer to {prompt!r}: {response!r}")
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="Times each prompt is run per mode")
+    parser.add_argument("--modes", nargs="+", default=list(USER_INFO_RULES))
+    parser.add_argument("--mock", type=float, metavar="LATENCY", help="Use MockGemini models with this mean latency instead of the Gemini API")
+    args = parser.parse_args()
+    model_factory = create_gemini_model if args.mock is None else mock_model_factory(latency_s=args.mock, latency_jitter_s=0)
+
+    print(f"{'mode':<15}{'turns':>7}{'mean s':>9}{'p50 s':>8}{'max s':>8}")
+    for mode in args.modes:
+        latencies = asyncio.run(bench(mode, args.repeat, model_factory))
+        print(f"{mode:<15}{len(latencies):>7}{statistics.mean(latencies):>9.2f}{statistics.median(latencies):>8.2f}{max(latencies):>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
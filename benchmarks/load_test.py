@@ -0,0 +1,153 @@
+"""
+Offline load test of run_at_session with a mock Gemini backend.
+
+Builds the real Runner with create_runner (same agent graph, session service backend and
+compaction as the app) but with MockGemini models, and drives N concurrent
+simulated users through it. Reports the turn latency percentiles, turns per second,
+failed turns, the lag of the event loop and the growth of the session database.
+
+Usage: python -m benchmarks.load_test [--users 16] [--turns 5] [--latency 0.5] [--rate-limit 0.0] [--max-concurrency 16]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from adk import metrics
+from adk.init_adk import create_runner, run_at_session
+from adk.persistence import POLICIES
+from adk.resources import start_resource_monitor
+from adk.scheduler import configure_scheduler
+from adk.search_cache import configure_search_cache
+from adk.session_store import create_session_service
+from benchmarks.mock_gemini import MockGemini
+from config.settings import MODEL_BACKOFF_INITIAL_S, MODEL_MAX_CONCURRENCY, MODEL_REQUESTS_PER_MINUTE, PERSISTENCE_BATCH_TURNS, PERSISTENCE_POLICY, SESSION_BACKEND, USER_INFO_MODE
+
+PROMPTS = [
+    "Hello!",
+    "What is my email address?",
+    "Best ramen in Madrid",
+    "Cheap sushi near Puerta del Sol",
+    "Which tapas bars open late in La Latina?",
+    "Recommend a vegetarian restaurant for a birthday dinner",
+    "Is it worth booking Botin in advance?",
+]
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def db_size(db_path: str) -> int:
+    # SQLite in WAL mode keeps recent writes in the -wal file
+    return sum(os.path.getsize(path) for path in (db_path, db_path + "-wal") if os.path.exists(path))
+
+
+async def simulate_user(runner, user: int, turns: int, think_time: float, streaming: bool, latencies: list[float], errors: list[str]) -> None:
+    profile = {"user_email": f"user{user}@example.com", "user_full_name": f"User {user}", "user_locale": "en-US"}
+    for _ in range(turns):
+        prompt = random.choice(PROMPTS)
+        start = time.perf_counter()
+        try:
+            async for _ in run_at_session(runner, prompt, profile["user_email"], profile, streaming=streaming):
+                pass
+            latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+        await asyncio.sleep(random.uniform(0, 2 * think_time))
+
+
+async def load_test(args) -> dict:
+    configure_search_cache(disk_path=None)
+    configure_scheduler(max_concurrency=args.max_concurrency, requests_per_minute=args.rpm, backoff_initial_s=args.backoff)
+    models: list[MockGemini] = []
+
+    def model_factory() -> MockGemini:
+        model = MockGemini(latency_s=args.latency, latency_jitter_s=args.latency / 5, output_tokens=args.tokens, rate_limit_probability=args.rate_limit)
+        models.append(model)
+        return model
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "load_test.db")
+        session_service = create_session_service(args.backend, db_path)
+        persistence_policy = None if args.persistence_policy == "none" else args.persistence_policy
+        runner = create_runner(user_info_mode=args.user_info_mode, session_service=session_service, model_factory=model_factory, persistence_policy=persistence_policy)
+        initial_db_size = db_size(db_path)
+        start_resource_monitor(interval_s=0.05)
+
+        latencies: list[float] = []
+        errors: list[str] = []
+        start = time.perf_counter()
+        await asyncio.gather(*(simulate_user(runner, user, args.turns, args.think_time, not args.no_streaming, latencies, errors) for user in range(args.users)))
+        elapsed = time.perf_counter() - start
+        # Let the compaction tasks started by the last turns finish before measuring the database
+        await asyncio.sleep(args.latency * 2)
+        final_db_size = db_size(db_path)
+
+    return {
+        "latencies": latencies,
+        "errors": errors,
+        "elapsed": elapsed,
+        "model_calls": sum(model.calls for model in models),
+        "rate_limited_calls": sum(model.rate_limited_calls for model in models),
+        "db_growth": final_db_size - initial_db_size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=16, help="Concurrent simulated users")
+    parser.add_argument("--turns", type=int, default=5, help="Turns per user")
+    parser.add_argument("--think-time", type=float, default=0.5, help="Mean seconds between the turns of a user")
+    parser.add_argument("--latency", type=float, default=0.5, help="Mean seconds of a mock model call")
+    parser.add_argument("--tokens", type=int, default=60, help="Tokens of the mock text responses")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Probability of a 429 error in each model call")
+    parser.add_argument("--max-concurrency", type=int, default=MODEL_MAX_CONCURRENCY, help="Model calls in progress at once")
+    parser.add_argument("--rpm", type=float, default=MODEL_REQUESTS_PER_MINUTE, help="Model calls per minute")
+    parser.add_argument("--backoff", type=float, default=MODEL_BACKOFF_INITIAL_S, help="Initial seconds of the shared 429 backoff")
+    parser.add_argument("--backend", default=SESSION_BACKEND, help="Session service backend")
+    parser.add_argument("--user-info-mode", default=USER_INFO_MODE)
+    parser.add_argument("--no-streaming", action="store_true", help="Run the turns without SSE streaming")
+    parser.add_argument("--persistence-policy", default=PERSISTENCE_POLICY if PERSISTENCE_BATCH_TURNS else "none", choices=POLICIES + ("none",),
+                        help="Events of each turn written in one batch at its end, none to write them one by one")
+    args = parser.parse_args()
+
+    result = asyncio.run(load_test(args))
+    latencies = result["latencies"]
+    print(f"users={args.users} turns/user={args.turns} backend={args.backend} user_info_mode={args.user_info_mode}")
+    print(f"completed turns:    {len(latencies)}")
+    print(f"failed turns:       {len(result['errors'])}")
+    print(f"turns/s:            {len(latencies) / result['elapsed']:.2f}")
+    if latencies:
+        print(f"latency mean:       {statistics.mean(latencies):.3f} s")
+        for p in (50, 95, 99):
+            print(f"latency p{p}:        {percentile(latencies, p):.3f} s")
+    print(f"model calls:        {result['model_calls']} ({result['rate_limited_calls']} rate limited)")
+    values = metrics.snapshot()
+    wait = values["scheduler.wait_seconds"]
+    if wait["count"]:
+        print(f"scheduler wait:     p50 {wait['p50']:.3f} s, p95 {wait['p95']:.3f} s, max {wait['max']:.3f} s")
+    print(f"scheduler retries:  {values['scheduler.retries']:g} ({values['scheduler.throttled']:g} after 429)")
+    print(f"compactions:        {values['compaction.runs']:g} ({values['compaction.cancelled']:g} cancelled), "
+          f"~{values['compaction.context_tokens_saved']:g} context tokens saved for ~{values['compaction.summary_tokens']:g} summary tokens")
+    lag = values["event_loop.lag"]
+    if lag["count"]:
+        print(f"event loop lag:     p50 {lag['p50'] * 1e3:.1f} ms, p99 {lag['p99'] * 1e3:.1f} ms, max {lag['max'] * 1e3:.1f} ms")
+    if "session_cache.bytes" in values:
+        print(f"session cache:      {values['session_cache.sessions']:g} sessions, {values['session_cache.events']:g} events, "
+              f"~{values['session_cache.bytes'] / 1024:.0f} KiB")
+    print(f"DB growth:          {result['db_growth'] / 1024:.1f} KiB")
+    if values["persistence.turn_rows"]["count"]:
+        rows, written = values["persistence.turn_rows"], values["persistence.turn_bytes"]
+        print(f"DB writes per turn: {rows['sum'] / rows['count']:.1f} events in 1 batch, {written['sum'] / written['count'] / 1024:.1f} KiB "
+              f"({values['persistence.events_dropped']:g} events dropped)")
+    for error in sorted(set(result["errors"]))[:5]:
+        print(f"error: {error}")
+
+
+if __name__ == "__main__":
+    main()
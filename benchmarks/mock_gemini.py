@@ -0,0 +1,136 @@
+"""
+Local stand-in for the Gemini model class, for benchmarks that must not call the API.
+
+MockGemini answers from a script instead of the network: it waits a configurable latency,
+decides which tools to call from the prompt, produces a text of a configurable number of
+tokens (streamed in chunks in SSE mode) and can inject 429 RESOURCE_EXHAUSTED errors.
+"""
+import asyncio
+import random
+import re
+from typing import AsyncGenerator, Callable, Optional
+
+from google.genai import types
+from google.genai.errors import ClientError
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+
+# Decides the tool calls of a model response from the user prompt and the names of the
+# tools available to the agent. Each call is a (tool name, args) pair, and several calls
+# are returned in the same response, as the model does for parallel function calling.
+ToolDecision = Callable[[str, list[str]], list[tuple[str, dict]]]
+
+PERSONAL_PATTERN = re.compile(r"\b(hello|hi|hola|my|me|i am|who am i)\b", re.IGNORECASE)
+SEARCH_PATTERN = re.compile(r"\b(recommend|restaurant|restaurants|near|best|book)\b", re.IGNORECASE)
+
+
+def default_tool_decision(prompt: str, tool_names: list[str]) -> list[tuple[str, dict]]:
+    """Looks up the user for greetings and personal questions, and searches for anything else.
+
+    Personalized recommendations ("recommend me a restaurant near my office") need both.
+    """
+    calls = []
+    personal = PERSONAL_PATTERN.search(prompt)
+    if personal:
+        if "get_user_info" in tool_names:
+            calls.append(("get_user_info", {}))
+        elif "user_info_agent" in tool_names:
+            calls.append(("user_info_agent", {"request": prompt}))
+    if (not personal or SEARCH_PATTERN.search(prompt)) and "search_agent" in tool_names:
+        calls.append(("search_agent", {"request": prompt}))
+    return calls
+
+
+def _text(content: types.Content) -> str:
+    return " ".join(part.text for part in content.parts or [] if part.text)
+
+
+def _turn_start(contents: list[types.Content]) -> Optional[int]:
+    # Index of the user message of the turn, the last user content that isn't a function response
+    for index in range(len(contents) - 1, -1, -1):
+        if contents[index].role == "user" and not any(part.function_response for part in contents[index].parts or []):
+            return index
+    return None
+
+
+def _estimate_tokens(llm_request: LlmRequest) -> int:
+    # Roughly 4 characters per token, as the real tokenizer for English text
+    characters = len(str(llm_request.config.system_instruction or "")) if llm_request.config else 0
+    for content in llm_request.contents:
+        for part in content.parts or []:
+            characters += len(part.text or "") + len(str(part.function_call or "")) + len(str(part.function_response or ""))
+    return max(1, characters // 4)
+
+
+class MockGemini(BaseLlm):
+    """Scriptable model with the same interface as google.adk.models.google_llm.Gemini."""
+
+    model: str = "gemini-2.5-flash-lite"
+    latency_s: float = 0.5  # Mean latency of a response
+    latency_jitter_s: float = 0.1  # Maximum random deviation from the mean latency
+    first_chunk_s: float = 0.1  # Time to the first chunk of a streamed response
+    output_tokens: int = 60  # Tokens of the text responses
+    stream_chunks: int = 6  # Chunks a streamed text response is split into
+    rate_limit_probability: float = 0.0  # Probability of failing a call with a 429 error
+    tool_decision: ToolDecision = default_tool_decision
+    sequential_tool_calls: bool = False  # Make the calls of a decision one per response, waiting for each result
+    calls: int = 0
+    rate_limited_calls: int = 0
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        self.calls += 1
+        latency = max(0.0, self.latency_s + random.uniform(-self.latency_jitter_s, self.latency_jitter_s))
+        if random.random() < self.rate_limit_probability:
+            self.rate_limited_calls += 1
+            await asyncio.sleep(latency / 10)
+            raise ClientError(429, {"error": {"code": 429, "message": "Resource has been exhausted (e.g. check quota).", "status": "RESOURCE_EXHAUSTED"}})
+
+        usage = types.GenerateContentResponseUsageMetadata(prompt_token_count=_estimate_tokens(llm_request))
+        calls = self._next_calls(llm_request)
+
+        if calls:
+            await asyncio.sleep(latency)
+            usage.candidates_token_count = 10 * len(calls)
+            parts = [types.Part.from_function_call(name=name, args=args) for name, args in calls]
+            yield LlmResponse(content=types.Content(role="model", parts=parts), usage_metadata=usage)
+            return
+
+        text = self._answer(llm_request)
+        usage.candidates_token_count = self.output_tokens
+        if not stream:
+            await asyncio.sleep(latency)
+            yield LlmResponse(content=types.Content(role="model", parts=[types.Part.from_text(text=text)]), usage_metadata=usage)
+            return
+
+        # Streamed like Gemini in SSE mode: partial chunks, then the aggregated response
+        words = text.split(" ")
+        size = max(1, len(words) // self.stream_chunks)
+        await asyncio.sleep(min(self.first_chunk_s, latency))
+        chunk_delay = max(0.0, latency - self.first_chunk_s) / self.stream_chunks
+        for start in range(0, len(words), size):
+            chunk = " ".join(words[start:start + size]) + (" " if start + size < len(words) else "")
+            yield LlmResponse(content=types.Content(role="model", parts=[types.Part.from_text(text=chunk)]), partial=True)
+            await asyncio.sleep(chunk_delay)
+        yield LlmResponse(content=types.Content(role="model", parts=[types.Part.from_text(text=text)]), usage_metadata=usage)
+
+    def _next_calls(self, llm_request: LlmRequest) -> list[tuple[str, dict]]:
+        # The calls decided for the prompt of the turn that weren't made yet in the turn
+        start = _turn_start(llm_request.contents)
+        if start is None:
+            return []
+        made = [part.function_call.name for content in llm_request.contents[start:] for part in content.parts or [] if part.function_call]
+        calls = [call for call in self.tool_decision(_text(llm_request.contents[start]), list(llm_request.tools_dict)) if call[0] not in made]
+        return calls[:1] if self.sequential_tool_calls else calls
+
+    def _answer(self, llm_request: LlmRequest) -> str:
+        # Echo the tool results of the turn, so the answers carry the data the agents looked up
+        start = _turn_start(llm_request.contents) or 0
+        results = [str(part.function_response.response) for content in llm_request.contents[start:] for part in content.parts or [] if part.function_response]
+        prefix = f"Based on {'; '.join(results)}: " if results else ""
+        return prefix + " ".join(f"token{i}" for i in range(self.output_tokens))
+
+
+def mock_model_factory(**kwargs) -> Callable[[], MockGemini]:
+    """Returns a model factory for create_runner that builds MockGemini models with the given settings."""
+    def factory() -> MockGemini:
+        return MockGemini(**kwargs)
+    return factory
@@ -1,13 +1,159 @@
-from google.genai import types
+import os
 
 # Constants definitions
 APP_NAME="default_app"
 USER_ID="default_user"
 ADK_SESSION_KEY="default_session_key"
 
-retry_config = types.HttpRetryOptions(
-    attempts=5,  # Maximum retry attempts
-    exp_base=7,  # Delay multiplier
-    initial_delay=1,
-    http_status_codes=[429, 500, 503, 504],  # Retry on these HTTP errors
-)
+# Stream the agent responses token by token (SSE) into the chat
+STREAMING_ENABLED=True
+
+# Headless HTTP/SSE API (python -m api.server), and the URL the Streamlit UI calls it at, if any
+AGENT_API_URL=os.environ.get("AGENT_API_URL")  # e.g. http://localhost:8000, the UI runs the agent in-process when unset
+AGENT_API_TOKEN=os.environ.get("AGENT_API_TOKEN")  # Bearer token required by the API when set
+AGENT_API_HOST=os.environ.get("AGENT_API_HOST", "127.0.0.1")  # Other hosts than the loopback need AGENT_API_TOKEN
+AGENT_API_PORT=int(os.environ.get("AGENT_API_PORT", "8000"))
+AGENT_API_WORKERS=int(os.environ.get("AGENT_API_WORKERS", "1"))  # uvicorn worker processes
+AGENT_API_SESSION_CACHE=False  # Per-process session caches go stale when several workers serve the same session
+AGENT_API_TIMEOUT_S=300  # Seconds the UI waits for a turn of the API
+
+# Chat history rendering: only the most recent messages are rendered on each rerun
+CHAT_HISTORY_WINDOW=20  # Messages rendered eagerly
+CHAT_HISTORY_PAGE=20  # Earlier messages added by each "Load earlier messages" click
+
+# How the root agent gets the logged user's profile. Options:
+# - "agent_tool": asking the user_info_agent sub-agent (one extra model call per lookup)
+# - "direct_tool": calling the get_user_info tool directly
+# - "session_state": from the profile injected in the session state and the root agent instruction
+USER_INFO_MODE="direct_tool"
+# Personalized questions that also need a search call the profile tool and search_agent in the
+# same step, so they run concurrently instead of one after the other
+PARALLEL_TOOL_CALLS=True
+
+# ADK session storage. Options:
+# - "sqlite": default DatabaseSessionService over a SQLite file
+# - "sqlite_pooled": SQLite in WAL mode with a bounded connection pool, off the event loop
+# - "memory": InMemorySessionService, sessions are lost on restart
+# - "redis": Redis server shared by all the replicas of the app (pip install redis)
+SESSION_BACKEND="sqlite_pooled"
+SESSION_DB_PATH="session_service_data.db"
+SQLITE_POOL_SIZE=8  # Maximum number of open connections (and database worker threads)
+SQLITE_BUSY_TIMEOUT_S=30  # Seconds to wait for the write lock before failing
+SQLITE_SYNCHRONOUS="NORMAL"  # NORMAL is safe with WAL and avoids an fsync per commit
+SQLITE_CACHE_SIZE_KB=16_384  # Page cache size per connection
+
+# Maintenance of the SQLite session database (python -m adk.maintenance run)
+RETENTION_POLICIES={  # Days a session is kept after its last update, by "app_name/user_id", "app_name" or "*", None keeps it forever
+    "*": 180,
+}
+ARCHIVE_DIR="session_archive"  # Gzipped JSON files of the expired sessions, restorable with "python -m adk.maintenance restore", None to delete them
+PRUNE_COMPACTED_EVENTS=True  # Delete the events summarized by a compaction, except the chat messages
+VACUUM_PAGES=0  # Free pages returned to the file system on each run, 0 for all
+MAINTENANCE_INTERVAL_S=6 * 60 * 60  # Period of "python -m adk.maintenance run --every"
+REDIS_URL=os.environ.get("REDIS_URL", "redis://localhost:6379/0")  # "fakeredis://" for an in-process stand-in (pip install fakeredis)
+REDIS_KEY_PREFIX="adk"
+REDIS_FLUSH_INTERVAL_S=0.05  # Appended events are written to Redis in batches, at most this late
+REDIS_FLUSH_MAX_EVENTS=64  # Pending events of a session that are written at once
+
+# In-process cache of hot ADK sessions in front of the database session service
+SESSION_CACHE_ENABLED=True
+SESSION_CACHE_MAX_SESSIONS=256  # Maximum number of sessions kept in memory
+SESSION_CACHE_MAX_EVENTS=50_000  # Maximum number of events kept in memory across all sessions
+SESSION_CACHE_MAX_BYTES=256 * 1024 * 1024  # Maximum serialized size of the events kept in memory across all sessions
+
+# Persistence of the events of the turns (adk/persistence.py)
+PERSISTENCE_BATCH_TURNS=True  # Write the events of a turn in a single batch at its end, instead of one by one
+PERSISTENCE_POLICY="full"  # Events of a turn written: "full", "shrink" (large tool responses truncated) or "final_only" (no tool calls)
+PERSISTENCE_MAX_RESPONSE_CHARS=2000  # Characters kept of each tool response with the "shrink" policy
+
+# Per-session turn coordinator: duplicate prompts follow the turn in flight, new prompts supersede it
+TURN_CANCEL_SUPERSEDED=True  # A new prompt cancels the turn of its session in progress, instead of waiting for it to end
+TURN_COALESCE_WINDOW_S=5.0  # Seconds a finished turn is still replayed to an identical prompt of its session (double submits)
+
+# Per-turn deadlines: the time left in the turn is passed down to the model calls and the sub-agents
+TURN_DEADLINE_S=45.0  # Seconds a turn has to answer, then it ends with the text so far and DEADLINE_NOTICE (None for no deadline)
+SUBAGENT_BUDGET_SHARE=0.6  # Share of the time left in the turn a sub-agent call gets, the rest is for the agent to answer without it
+MODEL_CALL_TIMEOUT_S=30.0  # HTTP timeout of a model call, lowered to the time left in the turn (None for the client default)
+DEADLINE_NOTICE="⏱️ _This answer took too long and may be incomplete, please try again or rephrase the question._"
+
+# Background turn jobs (adk/jobs.py): the UI submits each turn as a job and polls its progress
+JOB_POLL_INTERVAL_S=0.5  # Seconds between the refreshes of the response of a turn in progress in the UI
+JOB_RETENTION_S=900  # Seconds a finished job is kept for inspection and for the UI to pick up its result
+JOB_MAX_JOBS=1000  # Finished jobs kept at most, the oldest are dropped first
+
+# Background compaction (summarization) of the session history, driven by the size of the context
+COMPACTION_ENABLED=True
+COMPACTION_TRIGGER_TOKENS=8_000  # Estimated context tokens of a session that start a compaction after its turn
+COMPACTION_MIN_EVENTS=4  # Minimum number of events since the last compaction worth summarizing
+
+# Chat transcripts rebuilt from the persisted sessions on login or page refresh
+TRANSCRIPT_CACHE_MAX_PAGES=512  # Transcript pages kept in memory, reused while their session is unchanged
+
+# Gemini model used by all the agents
+MODEL_NAME="gemini-2.5-flash-lite"
+
+# Model routing: each turn is classified from its prompt into a tier, and its model calls go to
+# the first model of the tier that isn't failed over
+MODEL_ROUTING_ENABLED=True
+MODEL_TIERS={  # Models of each tier, in order of preference, the next ones are the failover alternates
+    "light": ("gemini-2.0-flash-lite", MODEL_NAME),  # Short prompts with nothing to search
+    "standard": (MODEL_NAME, "gemini-2.0-flash"),
+}
+ROUTING_LIGHT_MAX_WORDS=8  # Longest prompt of the light tier
+ROUTING_TEMPLATE_GREETINGS=True  # Plain greetings are answered from a template with the user profile, with no model call
+MODEL_LATENCY_SLO_S=8.0  # Average latency of a model (to its complete response) that fails it over
+MODEL_FAILOVER_ERROR_RATE=0.5  # Average rate of 429 and 5xx errors of a model that fails it over
+MODEL_FAILOVER_COOLDOWN_S=60.0  # Seconds a failed over model gets no calls
+MODEL_STATS_ALPHA=0.2  # Weight of the last call in the latency and error rate averages of a model
+ROUTING_LOG_PATH="traces/routing_decisions.jsonl"  # JSON lines file with the routing decisions, for offline tuning, None to disable
+
+# Process-wide scheduler of the model calls, shared by all the sessions and agents. It replaces
+# the per-model HTTP retries, so 429s back off all the calls together instead of each on its own
+MODEL_SCHEDULER_ENABLED=True
+MODEL_MAX_CONCURRENCY=16  # Maximum number of model calls in progress
+MODEL_REQUESTS_PER_MINUTE=600  # Sustained rate of model calls (token bucket refill rate)
+MODEL_BURST=20  # Model calls that can start at once after an idle period (token bucket size)
+MODEL_MAX_RETRIES=4  # Retries of a model call that fails before yielding any response
+MODEL_RETRY_STATUS_CODES=(429, 500, 503, 504)  # Retry on these HTTP errors
+MODEL_BACKOFF_INITIAL_S=1.0  # First backoff delay, doubled on each consecutive failure
+MODEL_BACKOFF_MAX_S=60.0  # Maximum backoff delay when the API sends no Retry-After
+
+# Cache of search_agent results shared by all the sessions of the process
+SEARCH_CACHE_ENABLED=True
+SEARCH_CACHE_TTL_S=6 * 60 * 60  # Seconds a search result is reused
+SEARCH_CACHE_MAX_ENTRIES=2048  # Maximum number of results kept in memory
+SEARCH_CACHE_DISK_PATH="search_cache.db"  # SQLite file to keep the results across restarts, None to disable
+SEARCH_CACHE_DEFAULT_LOCALE="en-US"  # Locale of the cache key when the browser locale is unknown
+
+# Whole-turn answer cache for paraphrased non-personal prompts (adk/answer_cache.py), opt-in
+ANSWER_CACHE_ENABLED=False
+ANSWER_CACHE_THRESHOLD=0.85  # Minimum cosine similarity of the embeddings of a prompt and a cached one for a hit, which also needs no conflicting words (another cuisine, place or day)
+ANSWER_CACHE_TTL_S=60 * 60  # Seconds an answer is reused
+ANSWER_CACHE_MAX_ENTRIES=2048  # Maximum number of answers kept, least recently used evicted first
+ANSWER_CACHE_DIM=1024  # Dimensions of the hashing embedding of the prompts
+ANSWER_CACHE_MIN_WORDS=3  # Shorter prompts are not cached, they are usually follow-ups of the conversation
+
+# Local restaurant catalog (adk/catalog.py), the root agent searches the web only when it has no answer
+RESTAURANT_CATALOG_PATH=None  # CSV or Parquet file of the catalog, None to always search the web
+RESTAURANT_GRID_CELL_KM=0.5  # Size of the cells of the location index
+RESTAURANT_RESULTS_LIMIT=5  # Restaurants returned by a catalog query
+
+# Per-turn latency breakdown (span trees) of the agent pipeline
+TRACING_ENABLED=True
+TRACE_FILE_PATH="traces/agent_traces.jsonl"  # Rotating JSON lines file with one trace per turn
+TRACE_FILE_MAX_BYTES=10 * 1024 * 1024  # Size of a trace file before it is rotated
+TRACE_FILE_BACKUPS=5  # Number of rotated trace files kept
+
+# Resource accounting of the process (adk/resources.py), shown to ADMIN_EMAILS in the sidebar
+ADMIN_EMAILS=frozenset(email.strip() for email in os.environ.get("ADMIN_EMAILS", "").split(",") if email.strip())  # Comma-separated
+RESOURCE_SAMPLE_INTERVAL_S=1.0  # Period of the samples of the event loop lag, the memory and the thread and connection pools
+METRICS_EXPORT_PATH="metrics/process_metrics.jsonl"  # Rotating JSON lines file with periodic snapshots of all the metrics, None to disable
+METRICS_EXPORT_INTERVAL_S=60.0  # Seconds between the snapshots written to METRICS_EXPORT_PATH
+METRICS_EXPORT_MAX_BYTES=10 * 1024 * 1024  # Size of a metrics file before it is rotated
+METRICS_EXPORT_BACKUPS=3  # Number of rotated metrics files kept
+CHAT_MEMORY_MAX_BYTES=512 * 1024  # Estimated memory of the messages of a browser tab over which the older ones are dropped, paged in again from the session on demand (None for no cap)
+
+# Startup of the agent runtime (adk/startup.py): the Runner, the session store connections and
+# the model API connections are set up before the first turn, and their time is reported
+STARTUP_BUDGET_S=20.0  # Startup time (imports and prewarm) over which the report is logged as a warning
+STARTUP_MODEL_WARMUP_TIMEOUT_S=10.0  # Maximum wait for the connection to the model API, startup goes on without it
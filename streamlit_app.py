@@ -1,7 +1,6 @@
 import os
 from time import time
 from typing import List
-import asyncio
 
 from google.genai import types
 from google.adk.agents import Agent
@@ -12,6 +11,9 @@ from google.adk.tools import google_search, AgentTool
 import streamlit as st
 from st_cookies_manager import EncryptedCookieManager
 
+from adk.event_loop import run_coroutine
+from adk.session_store import create_session_service
+
 # Constants definitions
 APP_NAME="default_app"
 USER_ID="default_user"
@@ -113,8 +115,10 @@ def init_adk():
         # st.write("✅ Root Agent defined.")
         # InMemorySessionService stores conversations in RAM (temporary)
         # session_service = InMemorySessionService()
-        db_url = f"sqlite:///session_service_data.db"  # Local SQLite file
-        session_service = DatabaseSessionService(db_url=db_url)
+        # db_url = f"sqlite:///session_service_data.db"  # Local SQLite file
+        # session_service = DatabaseSessionService(db_url=db_url)
+        # Session storage backend selected in config/settings.py (shared by all the replicas with "redis")
+        session_service = create_session_service()
 
 
 
@@ -219,7 +223,7 @@ def main():
         # cookies = init_cookies()
         # if not cookies.ready():
         #     st.stop()
-        # adk_session_id = asyncio.run(get_adk_session(runner, cookies))
+        # adk_session_id = run_coroutine(get_adk_session(runner, cookies))
         adk_session_id = str(st.user.email)
 
         st.subheader("Ask detailed questions for better responses")
@@ -250,7 +254,7 @@ def main():
             with st.chat_message("assistant"):
                 message_placeholder = st.empty() # Create an empty placeholder to update with the assistant's response.
                 with st.spinner("Assistant thinking..."): # Show a spinner while the agent processes the request.
-                    responses = asyncio.run(run_at_session(runner, prompt, adk_session_id))
+                    responses = run_coroutine(run_at_session(runner, prompt, adk_session_id))
                     print(responses)
                     try:
                         for response in responses:
@@ -0,0 +1,48 @@
+import json
+from typing import Iterator, Optional
+
+import httpx
+
+from adk.transcript import Cursor, TranscriptPage
+from config.settings import AGENT_API_TIMEOUT_S, AGENT_API_TOKEN, AGENT_API_URL
+
+# Thin client of the agent API (api/server.py), used by the Streamlit UI when AGENT_API_URL is set
+
+_client: Optional[httpx.Client] = None
+
+
+def _get_client() -> httpx.Client:
+    # One pooled client per UI process, keeping the connections to the API alive between turns
+    global _client
+    if _client is None:
+        headers = {"Authorization": f"Bearer {AGENT_API_TOKEN}"} if AGENT_API_TOKEN else {}
+        _client = httpx.Client(base_url=AGENT_API_URL, headers=headers, timeout=httpx.Timeout(AGENT_API_TIMEOUT_S, connect=10))
+    return _client
+
+
+def stream_turn(prompt: str, session_id: str, user_profile: Optional[dict] = None) -> Iterator[str]:
+    """Runs a turn in the agent API and yields the text of the response as it is generated."""
+    with _get_client().stream("POST", f"/sessions/{session_id}/turns", json={"prompt": prompt, "user_profile": user_profile}) as response:
+        response.raise_for_status()
+        event = None
+        for line in response.iter_lines():
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):])
+                if event == "delta":
+                    yield data["text"]
+                elif event == "error":
+                    raise RuntimeError(data["message"])
+                elif event == "done":
+                    return
+
+
+def load_transcript_page(session_id: str, limit: int, before: Optional[Cursor] = None) -> TranscriptPage:
+    params = {"limit": limit}
+    if before is not None:
+        params["before_ts"], params["before_id"] = before
+    response = _get_client().get(f"/sessions/{session_id}/messages", params=params)
+    response.raise_for_status()
+    page = response.json()
+    return TranscriptPage(page["messages"], tuple(page["before"]) if page["before"] else None)
@@ -1,11 +1,126 @@
-import asyncio
+import time
+
 import streamlit as st
-from adk.init_adk import get_google_api_key, initialize_adk, run_at_session
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from adk import metrics
+from adk.event_loop import run_coroutine
+from adk.jobs import DONE, get_job_manager, iterate_in_thread
+from adk.resources import forget_transcripts, record_transcript, sample, session_memory
+from adk.startup import get_google_api_key, start_prewarm
+from config.settings import (
+    ADMIN_EMAILS,
+    AGENT_API_URL,
+    CHAT_HISTORY_PAGE,
+    CHAT_HISTORY_WINDOW,
+    CHAT_MEMORY_MAX_BYTES,
+    JOB_POLL_INTERVAL_S,
+    TRACING_ENABLED,
+    USER_ID,
+)
+
+# The modules of the agent runtime (google.adk, google.genai, sqlalchemy) and of the charts take
+# seconds to import, so they are imported where they are used, after the login page is shown
+
+def render_latency_breakdown(session_id: str):
+    """Shows the span waterfall of the last turn of the session in the sidebar."""
+    import altair as alt
+    import pandas as pd
+    from adk.tracing import get_last_trace
+
+    trace = get_last_trace(session_id)
+    if trace is None:
+        st.sidebar.caption("No turns traced yet")
+        return
+    spans = {span.span_id: span for span in trace.spans}
+
+    def depth(span) -> int:
+        return 0 if span.parent_id not in spans else 1 + depth(spans[span.parent_id])
+
+    rows = [
+        {
+            "span": f"{i:02d} " + "· " * depth(span) + span.name,
+            "kind": span.kind,
+            "start_s": span.start,
+            "end_s": span.end if span.end is not None else trace.root.end,
+            "duration_s": round(span.duration or 0, 3),
+            "tokens": span.attributes.get("total_tokens"),
+        }
+        for i, span in enumerate(trace.spans)
+    ]
+    st.sidebar.caption(f"Last turn: {trace.root.duration:.2f} s, first text at {trace.root.attributes.get('first_text_s', 0):.2f} s")
+    chart = alt.Chart(pd.DataFrame(rows)).mark_bar().encode(
+        x=alt.X("start_s:Q", title="seconds"),
+        x2="end_s:Q",
+        y=alt.Y("span:N", sort=None, title=None),
+        color="kind:N",
+        tooltip=["span", "kind", "duration_s", "tokens"],
+    )
+    st.sidebar.altair_chart(chart, use_container_width=True)
+
+def render_resources(runner):
+    """Shows the resource usage of the process and the memory of each session in the sidebar."""
+    sample()
+    values = metrics.snapshot()
+    lag = values.get("event_loop.lag") or {}
+    with st.sidebar.expander("Resources (admin)"):
+        st.metric("Memory (RSS)", f"{values.get('process.rss_bytes', 0) / 2**20:.0f} MiB")
+        st.metric("Event loop lag (p99)", f"{(lag.get('p99') or 0) * 1e3:.0f} ms", help=f"Last {values.get('event_loop.lag_seconds', 0) * 1e3:.0f} ms, max {lag.get('max', 0) * 1e3:.0f} ms")
+        st.caption(f"{values.get('process.threads', 0):.0f} threads, {values.get('event_loop.tasks', 0):.0f} tasks on the event loop, {values.get('jobs.running', 0):.0f} turns running")
+        pools = [
+            {
+                "pool": name,
+                "busy": values[f"{name}.busy_threads"],
+                "max": values[f"{name}.max_threads"],
+                "queued": values[f"{name}.queued_calls"],
+                "connections": values.get(f"{name}.connections_in_use"),
+            }
+            for name in ("threads.default", "sqlite")
+            if f"{name}.max_threads" in values
+        ]
+        st.dataframe(pools, hide_index=True)
+        sessions = [
+            {
+                "session": memory.session_id,
+                "messages": memory.transcript_messages,
+                "transcript KiB": round(memory.transcript_bytes / 1024, 1),
+                "events": memory.adk_events,
+                "session KiB": round(memory.adk_bytes / 1024, 1),
+            }
+            for memory in session_memory(runner.session_service if runner is not None else None)
+        ]
+        st.dataframe(sessions, hide_index=True)
+
+def track_transcript(runner, adk_session_id: str):
+    """Records the memory of the transcript of this tab, and drops its oldest messages over CHAT_MEMORY_MAX_BYTES.
+
+    The dropped messages are still in the session, "Load earlier messages" pages them in again.
+    """
+    key = get_script_run_ctx().session_id
+    size = record_transcript(key, adk_session_id, st.session_state.messages)
+    if (
+        CHAT_MEMORY_MAX_BYTES is not None and size > CHAT_MEMORY_MAX_BYTES
+        and len(st.session_state.messages) > CHAT_HISTORY_WINDOW
+        and not st.session_state.get("turn_job")  # The prompt of the turn in progress may not be persisted yet
+    ):
+        page = load_transcript_page(runner, adk_session_id, CHAT_HISTORY_WINDOW)
+        if page.messages:
+            st.session_state.messages = page.messages
+            st.session_state.transcript_before = page.before
+            st.session_state.history_pages = 0
+            record_transcript(key, adk_session_id, st.session_state.messages)
+    if runtime.exists():
+        forget_transcripts(runtime.get_instance().is_active_session)
 
 def run_streamlit_app():
     st.title("Personal restaurant recommender")
     st.write("This is an AI App made with ❤️ by Álvaro using Google Agent Development Kit and Streamlit")
 
+    if not AGENT_API_URL:
+        # Build the runner in the background while the login page is shown, ready for the first turn
+        get_google_api_key()
+        start_prewarm()
+
     # Check if the user is logged in
     if not st.user.is_logged_in:
         # If not logged in, display a login button
@@ -23,47 +138,179 @@ def run_streamlit_app():
             st.logout()
             st.rerun() # Rerun the app to show the login state
 
-        get_google_api_key()
-        runner = initialize_adk()
+        # With AGENT_API_URL set the agent runs in the API service (api/server.py), and the UI is a thin client
+        runner = None
+        if not AGENT_API_URL:
+            from adk.init_adk import initialize_adk
+            runner = initialize_adk()
         adk_session_id = str(st.user.email)
 
+        # Optional waterfall of the spans of the last turn, traced in this process only
+        show_latency = TRACING_ENABLED and runner is not None and st.sidebar.toggle("Show latency breakdown")
+
         st.subheader("Ask detailed questions for better responses")
         st.divider()
         # st.subheader("Chat with the assistant")
 
-        # Initialize chat history
+        # Initialize chat history from the persisted ADK session, so a page refresh keeps the conversation
         if "messages" not in st.session_state:
-            st.session_state.messages = []
-
-        # Display chat messages from history on app rerun
-        for message in st.session_state.messages:
-            with st.chat_message(message["role"]):
-                messages = message["content"]
-                if type(messages) == str:
-                    messages = [messages]
-                for message in messages:
-                    st.markdown(message)
-
-        # React to user input
-        if prompt := st.chat_input("Ask anything"):
-            # Display user message in chat message container
-            st.chat_message("user").markdown(prompt)
-            # Add user message to chat history
+            page = load_transcript_page(runner, adk_session_id, CHAT_HISTORY_WINDOW)
+            st.session_state.messages = page.messages
+            st.session_state.transcript_before = page.before  # Cursor of the earlier messages not loaded yet
+            st.session_state.history_pages = 0  # Earlier pages loaded with "Load earlier messages"
+
+        track_transcript(runner, adk_session_id)
+
+        # Only a window of the most recent messages is rendered, earlier ones are paged in on demand
+        messages = st.session_state.messages
+        history_start = max(0, len(messages) - CHAT_HISTORY_WINDOW - st.session_state.history_pages * CHAT_HISTORY_PAGE)
+        if (history_start > 0 or st.session_state.transcript_before) and st.button("Load earlier messages"):
+            st.session_state.history_pages += 1
+            if history_start < CHAT_HISTORY_PAGE and st.session_state.transcript_before:
+                # The loaded messages run out, read the previous page of the session
+                page = load_transcript_page(runner, adk_session_id, CHAT_HISTORY_PAGE, st.session_state.transcript_before)
+                st.session_state.messages[:0] = page.messages
+                st.session_state.transcript_before = page.before
+            st.rerun()
+
+        # Messages of earlier runs are rendered once per full rerun, the new turns in the chat fragment
+        st.session_state.live_start = len(messages)
+        for message in messages[history_start:st.session_state.live_start]:
+            render_message(message)
+
+        chat_fragment(runner, adk_session_id)
+
+        if show_latency:
+            render_latency_breakdown(adk_session_id)
+
+        with st.sidebar.expander("Turn jobs"):
+            st.dataframe(get_job_manager().list_jobs(adk_session_id), hide_index=True)
+
+        if st.user.email in ADMIN_EMAILS:
+            render_resources(runner)
+
+def load_transcript_page(runner, adk_session_id: str, limit: int, before=None):
+    from adk.transcript import TranscriptPage, load_transcript
+    from ui import api_client
+
+    try:
+        if runner is None:
+            return api_client.load_transcript_page(adk_session_id, limit, before)
+        return run_coroutine(load_transcript(runner.session_service, runner.app_name, USER_ID, adk_session_id, limit, before))
+    except Exception as e:
+        # The chat still works without the earlier messages
+        st.warning(f"Couldn't load the earlier messages: {e}")
+        return TranscriptPage()
+
+def render_message(message: dict):
+    with st.chat_message(message["role"]):
+        messages = message["content"]
+        if type(messages) == str:
+            messages = [messages]
+        for message in messages:
+            st.markdown(message)
+
+def submit_turn(runner, prompt: str, adk_session_id: str):
+    """Submits the turn as a background job, run on the shared event loop (or in the API)."""
+    from adk.init_adk import get_user_profile, run_at_session
+    from ui import api_client
+
+    # The profile is read here, st.user is only available in the script thread
+    user_profile = get_user_profile()
+    if runner is None:
+        run = lambda: iterate_in_thread(api_client.stream_turn(prompt, adk_session_id, user_profile))
+    else:
+        run = lambda: run_at_session(runner, prompt, adk_session_id, user_profile)
+    return get_job_manager().submit(adk_session_id, prompt, run)
+
+@st.fragment
+def chat_fragment(runner, adk_session_id: str):
+    """Chat input and the turns since the last full rerun.
+
+    Submitting a prompt reruns only this fragment, so the earlier messages are not rendered
+    and sent to the browser again on every turn. The turn runs as a background job, its
+    response is polled by poll_turn_job, or by turn_job_fragment in a full run.
+    """
+    # Display the messages added since the last full rerun
+    for message in st.session_state.messages[st.session_state.live_start:]:
+        render_message(message)
+    if error := st.session_state.pop("turn_error", None):
+        st.error(f"‼️ Error processing LLM response: Details {error}")
+
+    # React to user input
+    if prompt := st.chat_input("Ask anything"):
+        # Display user message in chat message container
+        st.chat_message("user").markdown(prompt)
+        # Add user message to chat history, once if it was submitted twice (the job manager
+        # returns the job of the first submit)
+        if st.session_state.messages[-1:] != [{"role": "user", "content": prompt}]:
             st.session_state.messages.append({"role": "user", "content": prompt})
+        try:
+            st.session_state.turn_job = submit_turn(runner, prompt, adk_session_id).job_id
+        except Exception as e:
+            st.error(f"‼️ Error processing LLM response: Details {e}")
+            st.stop()
+    elif "turn_job" not in st.session_state:
+        # After a page refresh, pick up the turn of the session still in progress
+        job = get_job_manager().latest(adk_session_id)
+        st.session_state.turn_job = job.job_id if job is not None and not job.finished else None
+
+    if st.session_state.turn_job:
+        if get_script_run_ctx().fragment_ids_this_run:
+            poll_turn_job(adk_session_id)
+        else:
+            # A full run (a page refresh during the turn) can't rerun this fragment by itself
+            st.fragment(turn_job_fragment, run_every=JOB_POLL_INTERVAL_S)(adk_session_id)
+
+def current_turn_job(adk_session_id: str):
+    job = get_job_manager().get(st.session_state.turn_job)
+    if job is None or job.session_id != adk_session_id:
+        # Dropped after JOB_RETENTION_S, or the process was restarted
+        st.session_state.turn_job = None
+        return None
+    return job
+
+def render_partial_response(job):
+    # Display the assistant response so far in chat message container
+    with st.chat_message("assistant"):
+        if job.text:
+            st.markdown(job.text + "▌")
+        else:
+            st.caption("Assistant thinking...")
+
+def finish_turn_job(job):
+    # Add assistant response to chat history, rendered by the next run of chat_fragment with the
+    # messages since the last full rerun (the sidebar and the history window are only updated by
+    # full reruns)
+    st.session_state.turn_job = None
+    if job.status == DONE or job.text:
+        st.session_state.messages.append({"role": "assistant", "content": job.text})
+    if job.status != DONE:
+        st.session_state.turn_error = job.error
+
+def poll_turn_job(adk_session_id: str):
+    """Response of the turn in progress, in a fragment run of chat_fragment.
+
+    The fragment reruns itself every JOB_POLL_INTERVAL_S until the job ends, and once more to
+    render the response with the other new messages, so the earlier ones are never sent again.
+    """
+    job = current_turn_job(adk_session_id)
+    if job is None:
+        return
+    if not job.finished:
+        render_partial_response(job)
+        time.sleep(JOB_POLL_INTERVAL_S)
+    else:
+        finish_turn_job(job)
+    st.rerun(scope="fragment")
 
-            # Display assistant response in chat message container
-            with st.chat_message("assistant"):
-                message_placeholder = st.empty() # Create an empty placeholder to update with the assistant's response.
-                with st.spinner("Assistant thinking..."): # Show a spinner while the agent processes the request.
-                    loop = asyncio.new_event_loop()
-                    responses = loop.run_until_complete(run_at_session(runner, prompt, adk_session_id))
-                    print(responses)
-                    try:
-                        for response in responses:
-                            st.markdown(response)
-                    except Exception as e:
-                        st.error(f"‼️ Error processing LLM response: Details {e}")
-                        st.stop()
-
-            # Add assistant response to chat history
-            st.session_state.messages.append({"role": "assistant", "content": responses})
+def turn_job_fragment(adk_session_id: str):
+    """Response of the turn in progress after a full run, rerun every JOB_POLL_INTERVAL_S until its job ends."""
+    job = current_turn_job(adk_session_id)
+    if job is not None and not job.finished:
+        render_partial_response(job)
+        return
+    if job is not None:
+        finish_turn_job(job)
+    # Streamlit only stops the run_every timer of a fragment on a full rerun
+    st.rerun(scope="app")